@@ -1,8 +1,28 @@
 from http.server import BaseHTTPRequestHandler
 import json
 import os
+import sys
+from pathlib import Path
+from urllib import error as _urlerr
 from urllib import request as _urlreq
 
+# 获取项目根目录
+BASE_DIR = Path(__file__).resolve().parent.parent
+if str(BASE_DIR) not in sys.path:
+    sys.path.insert(0, str(BASE_DIR))
+
+from iching.cache import interpretation_key
+from iching.llm import UpstreamError, UpstreamTimeout, parse_retry_after
+from iching.prompts import build_payload, for_model
+from iching.resilience import get_resilience
+from iching.singleflight import SyncSingleFlight
+
+# 单次解读的总截止时间（含重试与备用模型）；主模型的尝试会为备用模型留出其延迟目标
+AI_DEADLINE = 30
+
+# 同一实例内相同请求并发到达时只调用一次上游
+_FLIGHTS = SyncSingleFlight()
+
 class handler(BaseHTTPRequestHandler):
     def do_POST(self):
         try:
@@ -32,29 +52,22 @@ class handler(BaseHTTPRequestHandler):
                 self.send_error_response("AI service not configured")
                 return
             
-            # 构建提示词
             hex_name = hexagram.get('name', '未知')
-            hex_code = hexagram.get('code', 0)
-            lines = hexagram.get('lines', [])
-            
-            prompt = f"""作为一位资深的易经大师，请为以下占卜结果提供详细解读：
-
-问题：{question}
-卦象：{hex_name}（第{hex_code}卦）
-爻线：{lines}
 
-请从以下几个方面进行解读：
-1. 卦象含义和象征
-2. 针对问题的具体指导
-3. 当前形势分析
-4. 行动建议
-5. 注意事项
-
-请用通俗易懂的语言，结合现代生活实际情况进行解读。"""
+            # 构建提示词：预生成的卦象片段 + 按变爻取用的爻辞，按模型设置 max_tokens
+            payload = build_payload(hexagram, question, model)
 
             # 调用AI服务
             try:
-                ai_response = self.call_ai_service(api_key, model, prompt)
+                flight_key = interpretation_key(hexagram, question, model)
+                ai_response, used_model = _FLIGHTS.do(
+                    flight_key,
+                    lambda: get_resilience().call_sync(
+                        model,
+                        lambda m, timeout: self.call_ai_service(api_key, for_model(payload, m), timeout),
+                        AI_DEADLINE,
+                    ),
+                )[0]
                 
                 self.send_response(200)
                 self.send_header('Content-Type', 'application/json')
@@ -67,7 +80,7 @@ class handler(BaseHTTPRequestHandler):
                     "question": question,
                     "hexagram": hex_name,
                     "interpretation": ai_response,
-                    "model": model
+                    "model": used_model
                 }
                 
                 response = json.dumps(result, ensure_ascii=False)
@@ -79,26 +92,10 @@ class handler(BaseHTTPRequestHandler):
         except Exception as e:
             self.send_error_response(f"Server error: {str(e)}")
     
-    def call_ai_service(self, api_key: str, model: str, prompt: str) -> str:
-        """调用硅基流动AI服务"""
+    def call_ai_service(self, api_key: str, payload: dict, timeout: float = AI_DEADLINE) -> str:
+        """调用硅基流动AI服务；失败时抛出带状态码的 UpstreamError 以便重试与回退"""
         url = "https://api.siliconflow.cn/v1/chat/completions"
         
-        payload = {
-            "model": model,
-            "messages": [
-                {
-                    "role": "system",
-                    "content": "你是一位精通易经的大师，能够为用户提供准确、有用的占卜解读。"
-                },
-                {
-                    "role": "user", 
-                    "content": prompt
-                }
-            ],
-            "max_tokens": 2000,
-            "temperature": 0.7
-        }
-        
         headers = {
             "Authorization": f"Bearer {api_key}",
             "Content-Type": "application/json"
@@ -111,9 +108,20 @@ class handler(BaseHTTPRequestHandler):
             method='POST'
         )
         
-        with _urlreq.urlopen(req, timeout=30) as response:
-            result = json.loads(response.read().decode('utf-8'))
-            return result['choices'][0]['message']['content']
+        try:
+            with _urlreq.urlopen(req, timeout=timeout) as response:
+                body = response.read()
+        except _urlerr.HTTPError as e:
+            raise UpstreamError(f"HTTP {e.code}", e.code, parse_retry_after(e.headers.get('Retry-After')))
+        except (TimeoutError, OSError) as e:
+            if 'timed out' in str(e).lower():
+                raise UpstreamTimeout("AI 服务响应超时，请稍后重试")
+            raise UpstreamError(str(e))
+        # 响应体不完整或格式不符同样按上游错误处理，熔断器才能记录结果
+        try:
+            return json.loads(body.decode('utf-8'))['choices'][0]['message']['content']
+        except (ValueError, KeyError, IndexError, TypeError) as e:
+            raise UpstreamError(f"AI 服务返回格式异常: {e!r}", 502)
     
     def send_error_response(self, message: str):
         """发送错误响应"""
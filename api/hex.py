@@ -1,41 +1,45 @@
 from http.server import BaseHTTPRequestHandler
 import json
+import sys
 from pathlib import Path
-from typing import Any, Dict, Optional
-from urllib.parse import urlparse, parse_qs
+from typing import Any, Dict
+from urllib.parse import urlparse
 
 # 获取项目根目录
 BASE_DIR = Path(__file__).resolve().parent.parent
-DATA_DIR = BASE_DIR / "data"
-
-_ICHING_CACHE: Optional[Dict[str, Any]] = None
-
-def _load_iching_db() -> Dict[str, Any]:
-    """加载易经数据库"""
-    global _ICHING_CACHE
-    if _ICHING_CACHE is not None:
-        return _ICHING_CACHE
-    
-    json_path = DATA_DIR / "iching_basic.json"
-    if not json_path.exists():
-        _ICHING_CACHE = {}
-        return _ICHING_CACHE
-    
-    try:
-        with open(json_path, 'r', encoding='utf-8') as f:
-            _ICHING_CACHE = json.load(f)
-    except Exception:
-        _ICHING_CACHE = {}
-    
-    return _ICHING_CACHE
-
-def find_record(name: str) -> Optional[Dict[str, Any]]:
-    """根据卦名查找记录"""
-    db = _load_iching_db()
-    for record in db.get("hexagrams", []):
-        if record.get("name") == name:
-            return record
-    return None
+if str(BASE_DIR) not in sys.path:
+    sys.path.insert(0, str(BASE_DIR))
+
+from iching import (
+    CACHE_CONTROL,
+    HEXAGRAM_NAMES,
+    EncodedPayload,
+    encode_payload,
+    etag_matches,
+    get_store,
+    pick_encoding,
+)
+
+def build_result(code: int) -> Dict[str, Any]:
+    """按序号直接取记录，组装接口返回结构"""
+    record = get_store().get(code) or {}
+    name = record.get("name") or HEXAGRAM_NAMES[code - 1]
+    return {
+        "code": code,
+        "name": name,
+        "judgement": record.get("judgement") or f"{name}：利于正道与循序渐进。",
+        "image": record.get("image", ""),
+        "lines": record.get("lines", []),
+    }
+
+# 按卦首次请求时序列化并压缩，之后复用；冷启动只需读取快照索引
+RESPONSES: Dict[int, EncodedPayload] = {}
+
+def get_response(code: int) -> EncodedPayload:
+    payload = RESPONSES.get(code)
+    if payload is None:
+        payload = RESPONSES[code] = encode_payload(build_result(code))
+    return payload
 
 class handler(BaseHTTPRequestHandler):
     def do_GET(self):
@@ -43,77 +47,68 @@ class handler(BaseHTTPRequestHandler):
             # 解析URL路径
             parsed_url = urlparse(self.path)
             path_parts = parsed_url.path.strip('/').split('/')
-            
+
             # 期望路径格式: /api/hex/{code}
             if len(path_parts) < 3 or path_parts[0] != 'api' or path_parts[1] != 'hex':
                 self.send_error_response("Invalid path format", 404)
                 return
-            
+
             try:
                 code = int(path_parts[2])
             except ValueError:
                 self.send_error_response("Invalid hexagram code", 400)
                 return
-            
+
             if not (1 <= code <= 64):
                 self.send_error_response("Hexagram code must be between 1 and 64", 400)
                 return
-            
-            # 获取卦象名称
-            hexagram_names = [
-                "乾","坤","屯","蒙","需","讼","师","比","小畜","履","泰","否","同人","大有","谦","豫",
-                "随","蛊","临","观","噬嗑","贲","剥","复","无妄","大畜","颐","大过","坎","离","咸","恒",
-                "遁","大壮","晋","明夷","家人","睽","蹇","解","损","益","夬","姤","萃","升","困","井","革",
-                "鼎","震","艮","渐","归妹","丰","旅","巽","兑","涣","节","中孚","小过","既济","未济"
-            ]
-            
-            name = hexagram_names[code - 1]
-            record = find_record(name)
-            
-            if not record:
-                result = {
-                    "code": code,
-                    "name": name,
-                    "judgement": f"{name}：利于正道与循序渐进。",
-                    "image": "",
-                    "lines": []
-                }
-            else:
-                result = {
-                    "code": code,
-                    "name": name,
-                    "judgement": record.get("judgement", f"{name}：利于正道与循序渐进。"),
-                    "image": record.get("image", ""),
-                    "lines": record.get("lines", [])
-                }
-            
+
+            payload = get_response(code)
+            encoding = pick_encoding(self.headers.get('Accept-Encoding'), payload)
+            body, etag = payload.variant(encoding)
+
+            # 条件请求命中时只返回 304
+            if etag_matches(self.headers.get('If-None-Match'), payload.etag):
+                self.send_response(304)
+                self.send_header('Vary', 'Accept-Encoding')
+                self.send_header('ETag', etag)
+                self.send_header('Cache-Control', CACHE_CONTROL)
+                self.send_header('Access-Control-Allow-Origin', '*')
+                self.end_headers()
+                return
+
             # 返回结果
             self.send_response(200)
-            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Type', 'application/json; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            if encoding:
+                self.send_header('Content-Encoding', encoding)
+            self.send_header('Vary', 'Accept-Encoding')
+            self.send_header('ETag', etag)
+            self.send_header('Cache-Control', CACHE_CONTROL)
             self.send_header('Access-Control-Allow-Origin', '*')
             self.send_header('Access-Control-Allow-Methods', 'GET, OPTIONS')
             self.send_header('Access-Control-Allow-Headers', 'Content-Type')
             self.end_headers()
-            
-            response = json.dumps(result, ensure_ascii=False)
-            self.wfile.write(response.encode('utf-8'))
-            
+
+            self.wfile.write(body)
+
         except Exception as e:
             self.send_error_response(f"Server error: {str(e)}")
-    
+
     def send_error_response(self, message: str, status_code: int = 500):
         """发送错误响应"""
         self.send_response(status_code)
         self.send_header('Content-Type', 'application/json')
         self.send_header('Access-Control-Allow-Origin', '*')
         self.end_headers()
-        
+
         error_response = json.dumps({"error": message}, ensure_ascii=False)
         self.wfile.write(error_response.encode('utf-8'))
-    
+
     def do_OPTIONS(self):
         self.send_response(200)
         self.send_header('Access-Control-Allow-Origin', '*')
         self.send_header('Access-Control-Allow-Methods', 'GET, OPTIONS')
         self.send_header('Access-Control-Allow-Headers', 'Content-Type')
-        self.end_headers()
\ No newline at end of file
+        self.end_headers()
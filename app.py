@@ -6,27 +6,363 @@
 
 from __future__ import annotations
 
-import os
+import asyncio
 import json as _json
-import random
+import math
+import os
+import time
+from contextlib import asynccontextmanager
 from pathlib import Path
-from typing import Any, Dict, List, Optional
-from urllib import request as _urlreq
+from typing import Any, Dict, List, Literal, Optional
 
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Query, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import HTMLResponse
+from fastapi.responses import HTMLResponse, JSONResponse, Response, StreamingResponse
 from fastapi.staticfiles import StaticFiles
 from pydantic import BaseModel, Field
 
+from iching import (
+    CACHE_CONTROL,
+    cast_reading,
+    divine_batch,
+    etag_matches,
+    get_hex_payloads,
+    get_store,
+    make_rng,
+    pick_encoding,
+)
+from iching.admission import (
+    DEFAULT_AI_RATE,
+    DEFAULT_CHEAP_RATE,
+    PRIORITY_BACKGROUND,
+    PRIORITY_INTERACTIVE,
+    Overloaded,
+    get_admission_queue,
+    limiter_from_env,
+)
+from iching.cache import get_interpretation_cache, interpretation_key
+from iching.jobs import JobRunner, RetryLater, get_job_store, job_db_path, validate_webhook
+from iching.metrics import (
+    REGISTRY,
+    begin_timing,
+    current_timings,
+    end_timing,
+    server_timing_header,
+    stage,
+)
+from iching.pregen import get_pregenerated
+from iching.prompts import build_payload, for_model, get_prompt_fragments, hexagram_code, moving_mask
+from iching.relations import changed_code, relation_dict, relation_graph, relations_of
+from iching.search import get_search_index
+from iching.semantic import get_similarity_index, similarity_group
+from iching.stats import SOURCE_API, SOURCE_WEB, get_reading_stats
+from iching.resilience import CircuitOpen, get_resilience, is_retryable
+from iching.singleflight import SingleFlight
+from iching.llm import (
+    UpstreamError,
+    UpstreamTimeout,
+    api_key_from_env,
+    close_llm_client,
+    extract_content,
+    extract_delta,
+    get_llm_client,
+)
+
 # ===================== 应用配置 =====================
 
+# 预热状态：/readyz 只在预热完成且数据校验通过后返回 200
+_WARMUP: Dict[str, Any] = {"ready": False, "errors": [], "seconds": None, "upstream": None}
+
+def _warm_up() -> None:
+    """加载并校验卦象库，建立各索引并预编码响应（在线程中执行）"""
+    started = time.perf_counter()
+    errors: List[str] = []
+    try:
+        errors = get_store().validate()
+        get_hex_payloads()
+        get_search_index()
+        get_prompt_fragments()
+        get_interpretation_cache()
+        get_pregenerated()
+        get_similarity_index()
+        get_resilience()
+    except Exception as e:
+        errors.append(f"预热失败: {e}")
+    try:
+        get_reading_stats()  # 回放统计日志；日志不可写时统计接口返回 503，不影响就绪
+    except OSError as e:
+        print(f"警告：占卜统计不可用：{e}")
+    _WARMUP["errors"] = errors
+    _WARMUP["seconds"] = round(time.perf_counter() - started, 4)
+    _WARMUP["ready"] = not errors
+    if errors:
+        print("警告：数据校验未通过，/readyz 将返回 503：" + "；".join(errors[:5]))
+
+async def _warm_up_async() -> None:
+    await asyncio.to_thread(_warm_up)
+    # 上游连接预热不影响就绪状态
+    if api_key_from_env():
+        _WARMUP["upstream"] = await get_llm_client().warm()
+
+# 后台解读任务的 worker 池：首次提交任务时才创建任务库并启动（AI_JOB_WORKERS=0 或未配置上游密钥时不启动）
+_JOBS: Optional[JobRunner] = None
+
+def _job_worker_count() -> int:
+    return int(os.getenv("AI_JOB_WORKERS", "") or 2)
+
+def _job_retryable(e: BaseException) -> bool:
+    """只重试上游的 429/5xx、超时与网络错误；请求本身有误（4xx）直接失败"""
+    return isinstance(e, UpstreamError) and is_retryable(e)
+
+async def _ensure_jobs() -> Optional[JobRunner]:
+    global _JOBS
+    if _JOBS is None and _job_worker_count() > 0 and api_key_from_env():
+        store = await asyncio.to_thread(get_job_store)
+        if _JOBS is None:
+            _JOBS = JobRunner(
+                store, _run_job, workers=_job_worker_count(),
+                webhook_secret=os.getenv("JOB_WEBHOOK_SECRET") or None, retryable=_job_retryable,
+            )
+            _JOBS.start()
+    return _JOBS
+
+async def _run_job(request: Dict[str, Any]) -> Dict[str, Any]:
+    """执行一个后台任务：与 /api/ai 共用缓存与请求合并，以低于交互请求的优先级排队"""
+    hit = _pregenerated(AIRequest(**request))
+    if hit is not None:
+        return hit
+    key = api_key_from_env()
+    if not key:
+        raise RuntimeError("缺少环境变量 SILICONFLOW_API_KEY")
+    try:
+        return await _interpret(AIRequest(**request), key, PRIORITY_BACKGROUND)
+    except Overloaded as e:
+        raise RetryLater(str(e), e.retry_after, count_attempt=False)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """启动后在后台预热：校验数据、建立索引、预编码响应并预先连接上游；完成前 /readyz 返回 503"""
+    global _JOBS
+    get_llm_client()
+    warmup = asyncio.create_task(_warm_up_async())
+    # 任务库已存在时（可能有上次未完成的任务）启动即恢复 worker，否则等首次提交
+    if job_db_path().exists():
+        await _ensure_jobs()
+    yield
+    warmup.cancel()
+    if _JOBS is not None:
+        await _JOBS.stop()
+        _JOBS = None
+    await close_llm_client()
+
 app = FastAPI(
     title="AI算卦服务",
     description="基于易经的AI智能占卜解读服务",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan,
 )
 
+# ===================== 运行指标 =====================
+
+HTTP_LATENCY = REGISTRY.histogram(
+    "iching_http_request_seconds", "HTTP 请求耗时（至响应体发送完毕）", ("method", "route", "status")
+)
+HTTP_REQUESTS = REGISTRY.counter("iching_http_requests", "HTTP 请求数", ("method", "route", "status"))
+HTTP_IN_FLIGHT = REGISTRY.gauge("iching_http_requests_in_flight", "进行中的 HTTP 请求数")
+
+class MetricsMiddleware:
+    """纯 ASGI 中间件：按路由模板记录请求数与耗时，并把各阶段耗时写入 Server-Timing 响应头"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        started = time.perf_counter()
+        token = begin_timing()
+        status = 500
+
+        async def send_with_timing(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                stages = current_timings() + [("total", time.perf_counter() - started)]
+                headers = list(message.get("headers") or [])
+                headers.append((b"server-timing", server_timing_header(stages).encode("latin-1")))
+                headers.append((b"timing-allow-origin", b"*"))
+                message = dict(message, headers=headers)
+            await send(message)
+
+        HTTP_IN_FLIGHT.inc()
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            HTTP_IN_FLIGHT.dec()
+            end_timing(token)
+            # 只用路由模板作标签，避免 /api/divine/hex/{code} 之类的路径产生无限标签
+            route = getattr(scope.get("route"), "path", None) or "unmatched"
+            labels = {"method": scope["method"], "route": route, "status": status}
+            HTTP_LATENCY.observe(time.perf_counter() - started, **labels)
+            HTTP_REQUESTS.inc(**labels)
+
+
+def _collect_runtime():
+    """抓取时读取的瞬时状态：缓存、请求合并、上游容错、线程池与预热"""
+    cache = get_interpretation_cache().stats()
+    yield "iching_ai_cache_lookups_total", "counter", "AI 解读缓存查询次数", [
+        ({"result": "memory_hit"}, cache["memory_hits"]),
+        ({"result": "disk_hit"}, cache["disk_hits"]),
+        ({"result": "miss"}, cache["misses"]),
+        ({"result": "bypass"}, cache["bypass"]),
+    ]
+    yield "iching_ai_cache_hit_ratio", "gauge", "AI 解读缓存命中率", [({}, cache["hit_ratio"])]
+    yield "iching_ai_cache_entries", "gauge", "内存层缓存条目数", [({}, cache["memory_size"])]
+
+    flights = _AI_FLIGHTS.stats()
+    yield "iching_ai_singleflight_total", "counter", "AI 请求合并：发起与挂靠次数", [
+        ({"role": "leader"}, flights["leaders"]),
+        ({"role": "shared"}, flights["shared"]),
+    ]
+    yield "iching_ai_singleflight_in_flight", "gauge", "进行中的合并调用数", [({}, flights["in_flight"])]
+
+    upstream = get_resilience().stats()
+    yield "iching_upstream_resilience_total", "counter", "上游容错事件数", [
+        ({"event": e}, upstream[e]) for e in ("calls", "retries", "fallbacks", "short_circuited", "failures")
+    ]
+    yield "iching_upstream_retry_tokens", "gauge", "重试预算剩余令牌", [({}, upstream["retry_tokens"])]
+    yield "iching_upstream_breaker_open", "gauge", "熔断器状态（1 为打开或半开）", [
+        ({"model": m, "state": st}, 0 if st == "closed" else 1) for m, st in upstream["breakers"].items()
+    ]
+
+    try:
+        import anyio.to_thread
+
+        limiter = anyio.to_thread.current_default_thread_limiter()
+        yield "iching_threadpool_in_use", "gauge", "同步端点占用的线程数", [({}, limiter.borrowed_tokens)]
+        yield "iching_threadpool_capacity", "gauge", "同步端点线程池容量", [({}, limiter.total_tokens)]
+    except Exception:
+        pass
+
+    admission = get_admission_queue().stats()
+    yield "iching_ai_admission_total", "counter", "AI 准入队列：放行、排队、拒绝与排队超时次数", [
+        ({"outcome": e}, admission[e]) for e in ("admitted", "queued", "shed", "timed_out")
+    ]
+    yield "iching_ai_admission_active", "gauge", "正在进行的 AI 调用数", [({}, admission["active"])]
+    yield "iching_ai_admission_waiting", "gauge", "排队中的 AI 调用数", [({}, admission["waiting"])]
+    yield "iching_rate_limited_total", "counter", "被限流拒绝的请求数", [
+        ({"lane": lane}, limiter.rejected) for lane, limiter in _RATE_LIMITERS.items() if limiter is not None
+    ]
+
+    similar = get_similarity_index()
+    if similar is not None:
+        semantic = similar.stats()
+        yield "iching_ai_semantic_lookups_total", "counter", "相似问题缓存查询次数（near_miss 为差一点达到阈值的未命中）", [
+            ({"result": "hit"}, semantic["hits"]),
+            ({"result": "miss"}, semantic["misses"]),
+            ({"result": "near_miss"}, semantic["near_misses"]),
+            ({"result": "stale"}, semantic["stale"]),
+        ]
+        yield "iching_ai_semantic_hit_ratio", "gauge", "相似问题缓存命中率", [({}, semantic["hit_ratio"])]
+
+    pregen = get_pregenerated()
+    if pregen is not None:
+        served = pregen.stats()
+        yield "iching_ai_pregenerated_lookups_total", "counter", "预生成解读查询次数", [
+            ({"result": "hit"}, served["hits"]),
+            ({"result": "miss"}, served["misses"]),
+        ]
+
+    if _JOBS is not None:
+        jobs = _JOBS.stats()
+        yield "iching_ai_jobs_total", "counter", "本进程处理的后台任务结果与 webhook 回调次数", [
+            ({"outcome": e}, jobs[e]) for e in ("done", "failed", "retried", "webhooks", "webhook_failures")
+        ]
+        yield "iching_ai_jobs", "gauge", "任务表中各状态的任务数（所有进程共享）", [
+            ({"status": status}, n) for status, n in _JOBS.store.counts().items()
+        ]
+
+    yield "iching_ready", "gauge", "预热完成且数据校验通过为 1", [({}, 1 if _WARMUP["ready"] else 0)]
+
+REGISTRY.add_collector(_collect_runtime)
+
+# ===================== 限流与准入 =====================
+
+# 按通道分别限流：AI 通道额度小，廉价接口（起卦、卦象详情等）单独计数，不会被 AI 请求耗尽；
+# 静态资源、探针与指标不限流
+_RATE_LIMITERS = {
+    "ai": limiter_from_env("AI_RATE_LIMIT", DEFAULT_AI_RATE),
+    "cheap": limiter_from_env("CHEAP_RATE_LIMIT", DEFAULT_CHEAP_RATE),
+}
+_UNLIMITED_PATHS = ("/", "/healthz", "/readyz", "/metrics")
+
+def _proxy_hops(spec: str) -> int:
+    """TRUST_PROXY_HEADERS：前面可信反向代理的层数；true/yes 等同 1"""
+    spec = spec.strip().lower()
+    if spec in ("true", "yes"):
+        return 1
+    try:
+        return max(0, int(spec or 0))
+    except ValueError:
+        return 0
+
+_TRUSTED_HOPS = _proxy_hops(os.getenv("TRUST_PROXY_HEADERS", ""))
+# 只有登记过的 API Key 单独计数；任意伪造的 X-API-Key 仍按 IP 限流
+_RATE_LIMIT_KEYS = frozenset(k.strip() for k in os.getenv("RATE_LIMIT_API_KEYS", "").split(",") if k.strip())
+
+def _lane(scope) -> Optional[str]:
+    path = scope["path"]
+    if path in _UNLIMITED_PATHS or path.startswith("/static/") or scope["method"] == "OPTIONS":
+        return None
+    if path.startswith("/api/ai") and scope["method"] == "POST":
+        return "ai"
+    return "cheap"
+
+def _client_key(scope) -> str:
+    """X-API-Key 在 RATE_LIMIT_API_KEYS 中时按该值区分客户端，否则按 IP
+
+    TRUST_PROXY_HEADERS=N 时取 X-Forwarded-For 从右数第 N 个地址：最右侧各项由可信代理追加，
+    更左侧的内容可由客户端任意伪造。
+    """
+    headers = dict(scope.get("headers") or ())
+    api_key = headers.get(b"x-api-key", b"").decode("latin-1")
+    if api_key and api_key in _RATE_LIMIT_KEYS:
+        return "key:" + api_key
+    if _TRUSTED_HOPS and b"x-forwarded-for" in headers:
+        hops = [h.strip() for h in headers[b"x-forwarded-for"].decode("latin-1").split(",") if h.strip()]
+        if hops:
+            return "ip:" + hops[-min(_TRUSTED_HOPS, len(hops))]
+    client = scope.get("client")
+    return "ip:" + (client[0] if client else "unknown")
+
+def _retry_after_header(seconds: float) -> Dict[str, str]:
+    return {"Retry-After": str(max(1, math.ceil(seconds)))}
+
+class RateLimitMiddleware:
+    """纯 ASGI 中间件：按客户端与通道做令牌桶限流，超限直接返回 429 + Retry-After"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http":
+            lane = _lane(scope)
+            limiter = _RATE_LIMITERS.get(lane) if lane else None
+            if limiter is not None:
+                wait = limiter.hit(_client_key(scope))
+                if wait:
+                    response = JSONResponse(
+                        {"detail": "请求过于频繁，请稍后再试", "lane": lane},
+                        status_code=429,
+                        headers=_retry_after_header(wait),
+                    )
+                    await response(scope, receive, send)
+                    return
+        await self.app(scope, receive, send)
+
+# 中间件自外向内：指标 -> CORS -> 限流（被限流的请求也计入指标并带上 CORS 头）
+app.add_middleware(RateLimitMiddleware)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
@@ -34,6 +370,10 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+app.add_middleware(MetricsMiddleware)
+
+def _overloaded(e: Overloaded) -> HTTPException:
+    return HTTPException(status_code=503, detail=str(e), headers=_retry_after_header(e.retry_after))
 
 # ===================== 路径配置 =====================
 
@@ -41,96 +381,27 @@ BASE_DIR = Path(__file__).resolve().parent
 STATIC_DIR = BASE_DIR / "static"
 DATA_DIR = BASE_DIR / "data"
 
-# ===================== 易经基础数据 =====================
-
-HEXAGRAM_NAMES = [
-    "乾","坤","屯","蒙","需","讼","师","比","小畜","履","泰","否","同人","大有","谦","豫",
-    "随","蛊","临","观","噬嗑","贲","剥","复","无妄","大畜","颐","大过","坎","离","咸","恒",
-    "遁","大壮","晋","明夷","家人","睽","蹇","解","损","益","夬","姤","萃","升","困","井","革",
-    "鼎","震","艮","渐","归妹","丰","旅","巽","兑","涣","节","中孚","小过","既济","未济"
-]
-
-WEN_MATRIX = [
-    [1,43,14,34,9,5,26,11],
-    [10,58,38,54,61,60,41,19],
-    [13,49,30,55,37,63,22,36],
-    [25,17,21,51,42,3,27,24],
-    [44,28,50,32,57,48,18,46],
-    [6,47,64,40,59,29,4,7],
-    [33,31,56,62,53,39,52,15],
-    [12,45,35,16,20,8,23,2],
-]
-
-TRIGRAM_BITS_TO_IDX = {
-    0b111:0,  # 乾
-    0b110:1,  # 兑
-    0b101:2,  # 离
-    0b100:3,  # 震
-    0b011:4,  # 巽
-    0b010:5,  # 坎
-    0b001:6,  # 艮
-    0b000:7,  # 坤
-}
-
-TRIGRAM_IDX_TO_NAME = ["乾","兑","离","震","巽","坎","艮","坤"]
-
-# ===================== 数据缓存 =====================
-
-_ICHING_CACHE: Optional[Dict[str, Any]] = None
-
-def _load_iching_db() -> Dict[str, Any]:
-    """加载易经数据库"""
-    global _ICHING_CACHE
-    if _ICHING_CACHE is not None:
-        return _ICHING_CACHE
-    
-    json_path = DATA_DIR / "iching_basic.json"
-    if not json_path.exists():
-        # 如果数据文件不存在，返回空字典
-        _ICHING_CACHE = {}
-        return _ICHING_CACHE
-    
-    try:
-        with open(json_path, "r", encoding="utf-8") as f:
-            _ICHING_CACHE = _json.load(f)
-    except Exception as e:
-        print(f"警告：无法加载易经数据库 {json_path}: {e}")
-        _ICHING_CACHE = {}
-    
-    return _ICHING_CACHE
-
-# ===================== 工具函数 =====================
-
-def _hexagram_index_from_lines(lines: list[int]) -> tuple[int, str, str]:
-    """根据爻线计算卦象索引和上下卦名"""
-    if len(lines) != 6:
-        return 0, "", ""
-    
-    # 计算上下卦的三位二进制
-    lower_bits = (lines[2] << 2) | (lines[1] << 1) | lines[0]
-    upper_bits = (lines[5] << 2) | (lines[4] << 1) | lines[3]
-    
-    lower_idx = TRIGRAM_BITS_TO_IDX.get(lower_bits, 0)
-    upper_idx = TRIGRAM_BITS_TO_IDX.get(upper_bits, 0)
-    
-    lower_name = TRIGRAM_IDX_TO_NAME[lower_idx]
-    upper_name = TRIGRAM_IDX_TO_NAME[upper_idx]
-    
-    # 查找卦象序号
-    hexagram_idx = WEN_MATRIX[upper_idx][lower_idx]
-    
-    return hexagram_idx, upper_name, lower_name
-
 # ===================== 数据模型 =====================
 
 class DivineRequest(BaseModel):
     seed: Optional[str] = None
     topic: Optional[str] = None
+    source: Literal["api", "web"] = "api"  # 统计来源标记：前端起卦传 web
+
+class BatchDivineRequest(BaseModel):
+    count: int = Field(1, ge=1, le=10000)
+    seed: Optional[str] = None
+    topic: Optional[str] = None
+    format: Literal["json", "columnar"] = "json"
 
 class AIRequest(BaseModel):
     question: str
     model: str = "Qwen/QwQ-32B"
     hexagram: Dict[str, Any]
+    no_cache: bool = False  # 「重新生成」时跳过缓存读取，结果仍会写回缓存
+
+class AIJobRequest(AIRequest):
+    webhook: Optional[str] = Field(None, max_length=2048)  # 完成或失败后 POST 回调的地址
 
 class InterpretRequest(BaseModel):
     hexagram: Dict[str, Any]
@@ -145,6 +416,19 @@ class LineRequest(BaseModel):
     question: Optional[str] = ""
     model: Optional[str] = None
 
+# ===================== AI 请求组装 =====================
+
+def _build_ai_payload(req: AIRequest) -> Dict[str, Any]:
+    """组装上游 chat/completions 请求体：预生成的卦象片段 + 按变爻取用的爻辞，按模型设置 max_tokens"""
+    return build_payload(req.hexagram or {}, req.question, req.model)
+
+# 进行中的上游调用，按解读缓存键合并
+_AI_FLIGHTS = SingleFlight()
+
+def _sse(event: str, data: Dict[str, Any]) -> bytes:
+    """编码一条 Server-Sent Event"""
+    return f"event: {event}\ndata: {_json.dumps(data, ensure_ascii=False)}\n\n".encode("utf-8")
+
 # ===================== API端点 =====================
 
 @app.get("/")
@@ -176,12 +460,24 @@ def index() -> HTMLResponse:
             <div class="api-item">
                 <span class="method">POST</span> /api/divine/coin - 铜钱占卜生成卦象
             </div>
+            <div class="api-item">
+                <span class="method">POST</span> /api/divine/coin/batch - 批量铜钱占卜（JSON 或列式）
+            </div>
             <div class="api-item">
                 <span class="method">POST</span> /api/ai - AI解读卦象
             </div>
+            <div class="api-item">
+                <span class="method">POST</span> /api/ai/stream - AI解读卦象（SSE 流式）
+            </div>
             <div class="api-item">
                 <span class="method">GET</span> /api/divine/hex/{code} - 获取卦象详细信息
             </div>
+            <div class="api-item">
+                <span class="method">GET</span> /api/divine/relations/{code} - 互卦、综卦、错卦与单爻变邻卦
+            </div>
+            <div class="api-item">
+                <span class="method">GET</span> /api/search?q=... - 全文检索卦辞、爻辞与应用说明
+            </div>
             <div class="api-item">
                 <span class="method">POST</span> /api/divine/interpret - 传统卦象解读
             </div>
@@ -200,145 +496,350 @@ def index() -> HTMLResponse:
     """
     return HTMLResponse(content=html_content)
 
+@app.get("/healthz")
+def healthz() -> Dict[str, Any]:
+    """存活探针：进程可响应即返回 200"""
+    return {"status": "ok"}
+
+@app.get("/readyz")
+def readyz() -> JSONResponse:
+    """就绪探针：预热完成且数据校验通过后才返回 200"""
+    return JSONResponse(
+        {"status": "ready" if _WARMUP["ready"] else "warming", **_WARMUP},
+        status_code=200 if _WARMUP["ready"] else 503,
+    )
+
 @app.post("/api/divine/coin")
 def api_divine_coin(req: DivineRequest) -> Dict[str, Any]:
     """铜钱占卜生成卦象"""
-    rnd = random.Random(req.seed) if req.seed else random.SystemRandom()
-    lines: list[int] = []
-    moving: list[bool] = []
-    
-    for _ in range(6):
-        # 三枚铜钱：正=3 反=2；总和 6老阴 7少阳 8少阴 9老阳
-        s = sum(rnd.choice([2, 3]) for _ in range(3))
-        if s == 6:
-            lines.append(0)
-            moving.append(True)
-        elif s == 7:
-            lines.append(1)
-            moving.append(False)
-        elif s == 8:
-            lines.append(0)
-            moving.append(False)
-        else:  # 9
-            lines.append(1)
-            moving.append(True)
-
-    # 变卦
-    changed = [(1 - v) if moving[i] else v for i, v in enumerate(lines)]
-    idx, upper, lower = _hexagram_index_from_lines(lines)
-    idx2, up2, lo2 = _hexagram_index_from_lines(changed)
-    name = HEXAGRAM_NAMES[idx - 1] if 1 <= idx <= 64 else ""
-    name2 = HEXAGRAM_NAMES[idx2 - 1] if 1 <= idx2 <= 64 else ""
-
-    return {
-        "method": "coin",
-        "question": req.topic or "",
-        "primary": {
-            "code": idx,
-            "name": name,
-            "upper": upper,
-            "lower": lower,
-            "lines": lines,
-            "moving": moving,
-        },
-        "changed": {
-            "code": idx2,
-            "name": name2,
-            "upper": up2,
-            "lower": lo2,
-            "lines": changed,
-        },
-        "meta": {
-            "sixBeasts": ["青龙","朱雀","勾陈","腾蛇","白虎","玄武"],
-        },
-    }
+    reading = cast_reading(make_rng(req.seed))
+    if req.seed is None:
+        # 指定种子的请求是可复现的重放，不计入统计；全站统计只收服务端起出的卦，客户端无法指定结果
+        try:
+            get_reading_stats().record(reading.bits, SOURCE_WEB if req.source == "web" else SOURCE_API)
+        except OSError:
+            pass
+    return reading.to_dict(req.topic or "")
+
+@app.post("/api/divine/coin/batch")
+def api_divine_coin_batch(req: BatchDivineRequest) -> Dict[str, Any]:
+    """批量铜钱占卜：一次生成 count 卦，给定 seed 时可复现"""
+    return divine_batch(req.count, req.seed, req.format, req.topic or "")
+
+def _reading_stats():
+    try:
+        return get_reading_stats()
+    except OSError as e:
+        raise HTTPException(status_code=503, detail=f"统计日志不可用: {e}")
+
+@app.get("/api/stats")
+def api_stats(k: int = Query(1, ge=1, le=64)) -> Dict[str, Any]:
+    """全站概览：累计次数、今日次数（UTC）与出现最多的 k 卦"""
+    return _reading_stats().summary(k)
+
+@app.get("/api/stats/daily")
+def api_stats_daily(days: int = Query(30, ge=1, le=366)) -> Dict[str, Any]:
+    return {"days": _reading_stats().daily(days)}
+
+@app.get("/api/stats/top")
+def api_stats_top(k: int = Query(10, ge=1, le=64)) -> Dict[str, Any]:
+    return {"top": _reading_stats().top(k)}
+
+@app.get("/api/stats/moving")
+def api_stats_moving() -> Dict[str, Any]:
+    return _reading_stats().moving()
+
+def _pregenerated(req: AIRequest) -> Optional[Dict[str, Any]]:
+    """问题为常见主题（综合运势/事业/感情/财运）且未指定模型时直接返回预生成的解读，不经缓存与上游"""
+    store = get_pregenerated()
+    # 显式指定了模型（且不是生成文件所用的模型）时照常调用上游
+    model = req.model if "model" in req.model_fields_set else None
+    if store is None or req.no_cache or not store.serves(model):
+        return None
+    code = hexagram_code(req.hexagram or {})
+    if code is None:
+        return None
+    with stage("pregen"):
+        content = store.lookup(code, moving_mask(req.hexagram or {}), req.question)
+    if content is None:
+        return None
+    return {"content": content, "raw": None, "model": store.meta.get("model"), "cached": True, "pregenerated": True}
+
+def _index_question(req: AIRequest, cache_key: str) -> None:
+    """记下已缓存解读对应的问题，供相似问题复用"""
+    index = get_similarity_index()
+    if index is not None:
+        index.add(similarity_group(req.hexagram or {}, req.model), req.question, cache_key)
+
+async def _similar_cached(req: AIRequest, cache_key: str) -> Optional[Dict[str, Any]]:
+    """精确未命中时，查同卦同变爻下问题足够相似的已缓存解读"""
+    index = get_similarity_index()
+    if index is None:
+        return None
+    group = similarity_group(req.hexagram or {}, req.model)
+    with stage("similar"):
+        key, score = index.match(group, req.question)
+        if key is None or key == cache_key:
+            return None
+        value = await get_interpretation_cache().aget(key)
+    if value is None:
+        index.forget(group, key)
+        return None
+    return dict(value, cached=True, similar=True, similarity=round(score, 3))
+
+async def _interpret(req: AIRequest, key: str, priority: int = PRIORITY_INTERACTIVE) -> Dict[str, Any]:
+    """查缓存、合并相同请求、经准入队列调用上游；上游与过载错误原样抛出"""
+    cache = get_interpretation_cache()
+    cache_key = interpretation_key(req.hexagram, req.question, req.model)
+    if req.no_cache:
+        cache.record_bypass()
+    else:
+        with stage("cache"):
+            cached = await cache.aget(cache_key)
+        if cached is not None:
+            _index_question(req, cache_key)
+            return dict(cached, cached=True)
+        similar = await _similar_cached(req, cache_key)
+        if similar is not None:
+            return similar
+
+    async def fetch() -> Dict[str, Any]:
+        # 429/5xx 重试、熔断与备用模型回退
+        client = get_llm_client()
+        with stage("prompt"):
+            payload = _build_ai_payload(req)
+        with stage("queue"):
+            await admission.acquire(priority)
+        started = time.monotonic()
+        try:
+            resp_data, used = await get_resilience().call(
+                req.model,
+                lambda model, timeout: client.chat(for_model(payload, model), key, timeout),
+                client.timeout,
+            )
+        finally:
+            admission.release(time.monotonic() - started)
+        with stage("parse"):
+            content = extract_content(resp_data)
+        result = {"content": content or "（无返回内容）", "raw": resp_data, "model": used}
+        if content and used == req.model:
+            await cache.aset(cache_key, result)
+            _index_question(req, cache_key)
+        return result
+
+    # 相同请求并发到达时只调用一次上游；排队过长时快速拒绝
+    admission = get_admission_queue()
+    result, shared = await _AI_FLIGHTS.do(cache_key, fetch)
+    return dict(result, cached=False, shared=shared)
 
 @app.post("/api/ai")
-def api_ai(req: AIRequest) -> Dict[str, Any]:
+async def api_ai(req: AIRequest) -> Dict[str, Any]:
     """AI解读卦象"""
-    key = os.getenv("SILICONFLOW_API_KEY") or os.getenv("SILICONFLOW_TOKEN") or os.getenv("SILICONFLOW_KEY")
+    hit = _pregenerated(req)
+    if hit is not None:
+        return hit
+    key = api_key_from_env()
     if not key:
         raise HTTPException(status_code=400, detail="缺少环境变量 SILICONFLOW_API_KEY")
-
-    base = "https://api.siliconflow.cn/v1/chat/completions"
-    sys_prompt = (
-        "你是一位严谨且通俗易懂的《周易》分析助手。"
-        "结合用户问题与卦象（卦名、卦辞、象辞、爻辞、变爻），"
-        "给出结构化的中文解读：\n"
-        "- 结论（一句话）\n- 形势分析\n- 建议（行动要点）\n- 注意事项\n"
-        "要求：真实、简洁、避免迷信表达，避免绝对化断语。"
-    )
-    
-    # 组装 messages
-    hx = req.hexagram or {}
-    raw_lines = hx.get('lines') or []
-    try:
-        lines_text = "\n".join([str(x) for x in raw_lines])
-    except Exception:
-        lines_text = ""
-    
-    raw_change_list = hx.get('changeList') or []
     try:
-        change_list_text = ", ".join([str(x) for x in raw_change_list]) or '无'
-    except Exception:
-        change_list_text = '无'
-
-    user_content = (
-        f"问题：{req.question}\n"
-        f"卦象：{hx.get('name','')}（序号 {hx.get('sequence','')}，{hx.get('fullName','')}）\n"
-        f"变爻：{change_list_text}\n"
-        f"卦辞：{hx.get('judgement','')}\n"
-        f"象曰：{hx.get('image','')}\n"
-        f"爻辞：{lines_text}"
-    )
-    
-    payload = {
-        "model": req.model,
-        "messages": [
-            {"role": "system", "content": sys_prompt},
-            {"role": "user", "content": user_content},
-        ],
-        "temperature": 0.7,
-    }
-
-    data = _json.dumps(payload).encode("utf-8")
-    req_obj = _urlreq.Request(
-        base,
-        data=data,
-        headers={
-            "Authorization": f"Bearer {key}",
-            "Content-Type": "application/json",
-        },
-        method="POST",
-    )
-    
-    try:
-        with _urlreq.urlopen(req_obj, timeout=60) as resp:
-            resp_text = resp.read().decode("utf-8")
-            resp_data = _json.loads(resp_text)
-    except Exception as e:
-        error_msg = str(e)
-        if "timed out" in error_msg.lower() or "timeout" in error_msg.lower():
-            raise HTTPException(status_code=504, detail="AI 服务响应超时，请稍后重试")
-        else:
-            raise HTTPException(status_code=502, detail=f"AI 服务请求失败: {error_msg}")
+        return await _interpret(req, key)
+    except Overloaded as e:
+        raise _overloaded(e)
+    except UpstreamTimeout as e:
+        raise HTTPException(status_code=504, detail=str(e))
+    except CircuitOpen as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    except UpstreamError as e:
+        raise HTTPException(status_code=502, detail=str(e))
+
+@app.post("/api/ai/jobs", status_code=202)
+async def api_ai_jobs_submit(req: AIJobRequest) -> Dict[str, Any]:
+    """提交后台解读任务，立即返回任务 ID；结果用 GET /api/ai/jobs/{id} 轮询，或由 webhook 回调"""
+    if not api_key_from_env():
+        raise HTTPException(status_code=400, detail="缺少环境变量 SILICONFLOW_API_KEY")
+    if _job_worker_count() <= 0:
+        raise HTTPException(status_code=503, detail="后台任务未启用（AI_JOB_WORKERS=0）")
+    if req.webhook:
+        problem = await asyncio.to_thread(validate_webhook, req.webhook)
+        if problem:
+            raise HTTPException(status_code=422, detail=problem)
+    jobs = await _ensure_jobs()
+    if jobs is None:
+        raise HTTPException(status_code=503, detail="后台任务未启用（AI_JOB_WORKERS=0）")
+    request = req.model_dump(exclude={"webhook"}, exclude_unset=True)  # 保留「是否指定了模型」
+    job_id = await asyncio.to_thread(jobs.store.submit, request, req.webhook)
+    jobs.notify()
+    return {"id": job_id, "status": "queued", "poll": f"/api/ai/jobs/{job_id}"}
+
+@app.get("/api/ai/jobs/{job_id}")
+def api_ai_jobs_get(job_id: str) -> Dict[str, Any]:
+    """任务状态：queued / running / done（附 result）/ failed（附 error）"""
+    # 任务可能由其他 worker 进程受理：只要任务库存在就查询，但不为查询新建任务库
+    job = get_job_store().get(job_id) if _JOBS is not None or job_db_path().exists() else None
+    if job is None:
+        raise HTTPException(status_code=404, detail="任务不存在或已过期")
+    return job
+
+@app.post("/api/ai/stream")
+async def api_ai_stream(req: AIRequest) -> StreamingResponse:
+    """AI解读卦象（流式）：转发上游增量为 SSE
+
+    事件：reasoning（推理过程增量）、delta（正文增量）、done（完整正文与用量）、error
+    """
+    hit = _pregenerated(req)
+    if hit is not None:
+        async def pregenerated():
+            yield _sse("delta", {"content": hit["content"]})
+            yield _sse("done", {
+                "content": hit["content"], "model": hit["model"], "usage": None, "cached": True, "pregenerated": True,
+            })
+
+        return StreamingResponse(
+            pregenerated(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"},
+        )
+    key = api_key_from_env()
+    if not key:
+        raise HTTPException(status_code=400, detail="缺少环境变量 SILICONFLOW_API_KEY")
 
-    content = None
-    try:
-        content = resp_data.get("choices", [{}])[0].get("message", {}).get("content")
-    except Exception:
-        content = None
+    cache = get_interpretation_cache()
+    cache_key = interpretation_key(req.hexagram, req.question, req.model)
+    cached = None
+    if req.no_cache:
+        cache.record_bypass()
+    else:
+        with stage("cache"):
+            cached = await cache.aget(cache_key)
+        if cached is not None:
+            _index_question(req, cache_key)
+        else:
+            cached = await _similar_cached(req, cache_key)
+
+    # 未命中缓存且没有可挂靠的同键调用时，预计排队过长就在建立事件流之前拒绝
+    admission = get_admission_queue()
+    if cached is None and not _AI_FLIGHTS.streaming(cache_key):
+        try:
+            admission.check()
+        except Overloaded as e:
+            raise _overloaded(e)
+
+    async def upstream():
+        # 在独立任务中运行：即使发起者断开，其他挂靠者仍能收完并写入缓存
+        client = get_llm_client()
+        payload = _build_ai_payload(req)
+        parts: List[str] = []
+        usage = None
+        used = req.model
+        async with admission.slot():
+            async for chunk, used in get_resilience().stream(
+                req.model,
+                lambda model, timeout: client.stream_chat(for_model(payload, model), key, timeout),
+                client.timeout,
+            ):
+                parts.append(extract_delta(chunk)[0])
+                usage = chunk.get("usage") or usage
+                yield chunk, used
+        content = "".join(parts)
+        if content and used == req.model:
+            await cache.aset(cache_key, {"content": content, "raw": {"model": used, "usage": usage}})
+            _index_question(req, cache_key)
+
+    async def events():
+        if cached is not None:
+            yield _sse("delta", {"content": cached["content"]})
+            yield _sse("done", {
+                "content": cached["content"], "model": req.model, "usage": None, "cached": True,
+                "similar": cached.get("similar", False),
+            })
+            return
+
+        parts: List[str] = []
+        usage = None
+        used = req.model
+        chunks, shared = _AI_FLIGHTS.stream(cache_key, upstream)
+        try:
+            async for chunk, used in chunks:
+                content, reasoning = extract_delta(chunk)
+                if reasoning:
+                    yield _sse("reasoning", {"content": reasoning})
+                if content:
+                    parts.append(content)
+                    yield _sse("delta", {"content": content})
+                usage = chunk.get("usage") or usage
+        except Overloaded as e:
+            yield _sse("error", {"detail": str(e), "status": 503, "retry_after": e.retry_after})
+            return
+        except UpstreamError as e:
+            status = 504 if isinstance(e, UpstreamTimeout) else 503 if isinstance(e, CircuitOpen) else 502
+            yield _sse("error", {"detail": str(e), "status": status})
+            return
+        content = "".join(parts)
+        yield _sse("done", {
+            "content": content or "（无返回内容）", "model": used, "usage": usage,
+            "cached": False, "shared": shared,
+        })
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
 
-    return {"content": content or "（无返回内容）", "raw": resp_data}
+@app.get("/metrics")
+async def metrics() -> Response:
+    """Prometheus 文本格式指标（异步端点：线程池占用需在事件循环线程中读取）"""
+    return Response(REGISTRY.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+@app.get("/api/ai/cache/stats")
+def api_ai_cache_stats() -> Dict[str, Any]:
+    """AI 解读缓存命中统计、请求合并统计与上游容错状态"""
+    pregen = get_pregenerated()
+    similar = get_similarity_index()
+    return dict(
+        get_interpretation_cache().stats(),
+        singleflight=_AI_FLIGHTS.stats(),
+        upstream=get_resilience().stats(),
+        admission=get_admission_queue().stats(),
+        jobs=_JOBS.stats() if _JOBS is not None else None,
+        pregenerated=pregen.stats() if pregen is not None else None,
+        semantic=similar.stats() if similar is not None else None,
+    )
 
 @app.get("/api/divine/hex/{code}")
-def api_divine_hex(code: int) -> Dict[str, Any]:
-    """获取卦象详细信息"""
-    DB = _load_iching_db()
-    rec = DB.get(str(code))
-    if not rec:
+def api_divine_hex(code: int, request: Request) -> Response:
+    """获取卦象详细信息（启动时预编码，按 Accept-Encoding 返回 br/gzip/原文）"""
+    payload = get_hex_payloads().get(code)
+    if payload is None:
         raise HTTPException(status_code=404, detail="hexagram not found")
-    return rec
+
+    encoding = pick_encoding(request.headers.get("accept-encoding"), payload)
+    body, etag = payload.variant(encoding)
+    headers = {"ETag": etag, "Cache-Control": CACHE_CONTROL, "Vary": "Accept-Encoding"}
+    if etag_matches(request.headers.get("if-none-match"), payload.etag):
+        return Response(status_code=304, headers=headers)
+    if encoding:
+        headers["Content-Encoding"] = encoding
+    return Response(content=body, media_type="application/json", headers=headers)
+
+@app.get("/api/divine/relations")
+def api_divine_relations() -> Dict[str, Any]:
+    """64 卦关系图：互卦、综卦、错卦、交卦与单爻变邻卦"""
+    return {"relations": relation_graph()}
+
+@app.get("/api/divine/relations/{code}")
+def api_divine_relations_code(code: int) -> Dict[str, Any]:
+    """单卦关系"""
+    rel = relation_dict(code)
+    if rel is None:
+        raise HTTPException(status_code=404, detail="hexagram not found")
+    return rel
+
+@app.get("/api/search")
+def api_search(
+    q: str = Query(..., min_length=1, max_length=64),
+    limit: int = Query(10, ge=1, le=64),
+) -> Dict[str, Any]:
+    """全文检索卦辞、象辞、爻辞、别名、标签、宜忌与现代应用；片段中命中部分以 <mark> 标出"""
+    return get_search_index().search(q, limit)
 
 @app.post("/api/divine/interpret")
 def api_divine_interpret(req: InterpretRequest) -> Dict[str, Any]:
@@ -352,17 +853,16 @@ def api_divine_interpret(req: InterpretRequest) -> Dict[str, Any]:
     moving_cnt = int(sum(1 for x in moving if x))
     q = (req.question or "").strip() or "综合运势"
 
-    # 载入离线基础库
-    DB = _load_iching_db()
-
-    def find_record(hexa_name: str):
-        for k,v in DB.items():
-            if v.get("name") == hexa_name:
-                return v
-        return None
-
-    rec = find_record(name) or {}
-    rec2 = find_record(name2) or {}
+    # 离线基础库：优先按序号，其次按卦名；变卦缺失时由关系表推出
+    store = get_store()
+    rec = store.get(p.get("code")) or store.by_name(name) or {}
+    name = name or rec.get("name", "")
+    rel = relations_of(rec.get("id") or p.get("code"))
+    code2 = c.get("code")
+    if not code2 and rel is not None:
+        code2 = changed_code(rel.code, sum(1 << i for i, b in enumerate(moving[:6]) if b))
+    rec2 = store.get(code2) or store.by_name(name2) or {}
+    name2 = name2 or rec2.get("name", "")
 
     # 组合解释
     summary = (rec.get("judgement") or f"{name}：利于正道与循序渐进。")
@@ -379,14 +879,19 @@ def api_divine_interpret(req: InterpretRequest) -> Dict[str, Any]:
     if rec2.get("judgement"):
         details.append("变卦启示：" + rec2["judgement"]) 
 
+    # 互卦示事情发展的内在过程
+    related = relation_dict(rel.code) if rel is not None else None
+    nuclear = store.get(rel.nuclear) if rel is not None and rel.nuclear != rel.code else None
+    if nuclear and nuclear.get("judgement"):
+        details.append(f"互卦「{nuclear.get('name', '')}」：" + nuclear["judgement"])
+
     advice = "结合卦意与现实资源，小步快跑、持续验证；与关键人保持顺畅沟通。"
-    return {"summary": summary, "details": details, "advice": advice}
+    return {"summary": summary, "details": details, "advice": advice, "related": related}
 
 @app.post("/api/divine/line")
 def api_divine_line(req: LineRequest) -> Dict[str, Any]:
     """爻辞解读"""
-    DB = _load_iching_db()
-    rec = DB.get(str(req.code))
+    rec = get_store().get(req.code)
     if not rec:
         raise HTTPException(status_code=404, detail="hexagram not found")
     
@@ -414,6 +919,37 @@ def api_divine_line(req: LineRequest) -> Dict[str, Any]:
 if STATIC_DIR.exists():
     app.mount("/static", StaticFiles(directory=str(STATIC_DIR)), name="static")
 
-if __name__ == "__main__":
+def _serve() -> None:
+    """命令行入口：默认单进程；--workers N（0 为 CPU 核数）启动多 worker 生产模式"""
+    import argparse
+
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8080)
\ No newline at end of file
+
+    parser = argparse.ArgumentParser(description="AI算卦服务")
+    parser.add_argument("--host", default=os.getenv("HOST", "0.0.0.0"))
+    parser.add_argument("--port", type=int, default=int(os.getenv("PORT", "") or 8080))
+    parser.add_argument(
+        "--workers", type=int, default=int(os.getenv("WEB_CONCURRENCY", "") or 1),
+        help="worker 进程数，0 表示 CPU 核数（默认读取 WEB_CONCURRENCY，未设置时为 1）",
+    )
+    parser.add_argument("--graceful-timeout", type=int, default=30, help="关闭时等待进行中请求的秒数")
+    args = parser.parse_args()
+
+    workers = args.workers if args.workers > 0 else (os.cpu_count() or 1)
+    if workers == 1:
+        uvicorn.run(app, host=args.host, port=args.port, timeout_graceful_shutdown=args.graceful_timeout)
+        return
+
+    # 多 worker：未配置共享缓存时使用本地 SQLite，避免命中率随 worker 数下降
+    if not os.getenv("AI_CACHE_URL") and not os.getenv("AI_CACHE_DB"):
+        cache_dir = BASE_DIR / ".cache"
+        cache_dir.mkdir(exist_ok=True)
+        os.environ["AI_CACHE_DB"] = str(cache_dir / "ai_cache.sqlite3")
+    print(f"启动 {workers} 个 worker（kill -HUP {os.getpid()} 可平滑重启全部 worker）")
+    uvicorn.run(
+        "app:app", host=args.host, port=args.port, workers=workers,
+        timeout_graceful_shutdown=args.graceful_timeout, app_dir=str(BASE_DIR),
+    )
+
+if __name__ == "__main__":
+    _serve()
\ No newline at end of file
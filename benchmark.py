@@ -0,0 +1,332 @@
+#!/usr/bin/env python3
+"""
+性能基准
+微基准覆盖起卦、位型查表、记录查询与解读组装等热点函数；
+端到端压测在本进程内启动服务与模拟上游（延迟可配），对各接口并发请求。
+结果以 JSON 输出吞吐量与 p50/p95/p99，可与基线比较，超出容差时以非零状态码退出。
+
+用法：
+    python benchmark.py                          # 微基准 + 压测，JSON 输出到标准输出
+    python benchmark.py micro                    # 只跑微基准
+    python benchmark.py load -c 32 -n 2000 --mock-latency 50
+    python benchmark.py -o bench.json            # 写入文件
+    python benchmark.py --baseline bench.json --tolerance 0.2   # p95 劣化超过 20% 时退出码为 1
+    python benchmark.py load --url http://127.0.0.1:8080       # 压测已启动的服务（如多 worker 模式）
+
+进程内压测时客户端与服务共用一个解释器，吞吐量偏保守，适合做回归对比；
+绝对容量请用 --url 压测独立进程中的服务。
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import socket
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional
+
+BASE_DIR = Path(__file__).resolve().parent
+if str(BASE_DIR) not in sys.path:
+    sys.path.insert(0, str(BASE_DIR))
+
+
+def summarize(samples_ms: List[float], elapsed: float) -> Dict[str, float]:
+    """延迟样本（毫秒）-> 吞吐量与分位数"""
+    xs = sorted(samples_ms)
+    n = len(xs)
+
+    def pct(p: float) -> float:
+        return round(xs[min(n - 1, int(p * n))], 4) if n else 0.0
+
+    return {
+        "count": n,
+        "throughput_per_s": round(n / elapsed, 1) if elapsed > 0 else 0.0,
+        "p50_ms": pct(0.50),
+        "p95_ms": pct(0.95),
+        "p99_ms": pct(0.99),
+        "max_ms": round(xs[-1], 4) if n else 0.0,
+    }
+
+
+# ===================== 微基准 =====================
+
+def _micro(fn: Callable[[], Any], iterations: int) -> Dict[str, float]:
+    for _ in range(min(iterations, 200)):  # 预热
+        fn()
+    samples: List[float] = []
+    clock = time.perf_counter_ns
+    started = time.perf_counter()
+    for _ in range(iterations):
+        t = clock()
+        fn()
+        samples.append((clock() - t) / 1e6)
+    return summarize(samples, time.perf_counter() - started)
+
+
+def run_micro(iterations: int = 20000) -> Dict[str, Any]:
+    import app as service
+    from iching.batch import divine_batch
+    from iching.core import Reading, cast_reading, divine_coin, hexagram_from_lines, make_rng
+    from iching.search import get_search_index
+    from iching.store import get_store
+
+    store = get_store()
+    rng = make_rng("bench")
+    reading = divine_coin("bench", "事业")
+    lines = reading["primary"]["lines"]
+    interpret_req = service.InterpretRequest(hexagram=reading, question="事业发展如何")
+    ai_req = service.AIRequest(
+        question="事业发展如何",
+        hexagram={**store.get(1), "sequence": 1, "changeList": ["初九"]},
+    )
+    index = get_search_index()
+
+    cases: Dict[str, Callable[[], Any]] = {
+        "core.hexagram_from_lines": lambda: hexagram_from_lines(lines),
+        "core.Reading.from_lines": lambda: Reading.from_lines(lines, reading["primary"]["moving"]),
+        "core.cast_reading": lambda: cast_reading(rng),
+        "core.divine_coin": lambda: divine_coin(None, "事业"),
+        "batch.divine_batch(1000,columnar)": lambda: divine_batch(1000, "bench", "columnar"),
+        "store.get": lambda: store.get(38),
+        "store.by_name": lambda: store.by_name("睽"),
+        "store.by_pinyin": lambda: store.by_pinyin("lu"),
+        "search.search": lambda: index.search("潜龙勿用"),
+        "app.api_divine_interpret": lambda: service.api_divine_interpret(interpret_req),
+        "app._build_ai_payload": lambda: service._build_ai_payload(ai_req),
+    }
+    slow = {"batch.divine_batch(1000,columnar)", "search.search", "app.api_divine_interpret"}
+    return {
+        name: _micro(fn, max(200, iterations // 20) if name in slow else iterations)
+        for name, fn in cases.items()
+    }
+
+
+# ===================== 模拟上游 =====================
+
+class MockLLMHandler(BaseHTTPRequestHandler):
+    """OpenAI 兼容的 chat/completions 模拟：固定延迟后返回，支持 stream: true"""
+
+    latency = 0.05
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args: Any) -> None:
+        pass
+
+    def do_HEAD(self) -> None:
+        self.send_response(200)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def do_POST(self) -> None:
+        body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        time.sleep(self.latency)
+        if body.get("stream"):
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Connection", "close")
+            self.end_headers()
+            for piece in ("## 结论\n", "顺势而为，", "稳中求进。"):
+                chunk = {"choices": [{"delta": {"content": piece}}]}
+                self.wfile.write(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode("utf-8"))
+            self.wfile.write(b'data: {"choices":[{"delta":{}}],"usage":{"total_tokens":64}}\n\ndata: [DONE]\n\n')
+            self.close_connection = True
+            return
+        out = json.dumps({
+            "model": body.get("model"),
+            "choices": [{"message": {"content": "## 结论\n顺势而为，稳中求进。"}}],
+            "usage": {"prompt_tokens": 400, "completion_tokens": 64, "total_tokens": 464},
+        }, ensure_ascii=False).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(out)))
+        self.end_headers()
+        self.wfile.write(out)
+
+
+def start_mock_llm(latency: float) -> ThreadingHTTPServer:
+    handler = type("Handler", (MockLLMHandler,), {"latency": latency})
+    server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+# ===================== 端到端压测 =====================
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _start_service(port: int):
+    import uvicorn
+
+    import app as service
+
+    server = uvicorn.Server(uvicorn.Config(service.app, host="127.0.0.1", port=port, log_level="warning"))
+    threading.Thread(target=server.run, daemon=True).start()
+    deadline = time.time() + 15
+    while not server.started and time.time() < deadline:
+        time.sleep(0.05)
+    return server
+
+
+async def _drive(client: Any, make_request: Callable[[int], Any], total: int, concurrency: int) -> Dict[str, Any]:
+    samples: List[float] = []
+    errors: Dict[str, int] = {}
+    counter = iter(range(total))
+
+    async def worker() -> None:
+        for i in counter:
+            t = time.perf_counter()
+            try:
+                resp = await make_request(i)
+                ok = resp.status_code < 400
+                key = str(resp.status_code)
+            except Exception as e:  # 连接错误等
+                ok, key = False, type(e).__name__
+            samples.append((time.perf_counter() - t) * 1000)
+            if not ok:
+                errors[key] = errors.get(key, 0) + 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    result = summarize(samples, time.perf_counter() - started)
+    result["errors"] = errors
+    return result
+
+
+async def _load_scenarios(base: str, total: int, concurrency: int) -> Dict[str, Any]:
+    import httpx
+
+    from iching.core import divine_coin
+    from iching.store import get_store
+
+    readings = [divine_coin(str(i)) for i in range(64)]
+    record = get_store().get(1) or {}
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(base_url=base, limits=limits, timeout=60) as client:
+        scenarios: Dict[str, Callable[[int], Any]] = {
+            "POST /api/divine/coin": lambda i: client.post("/api/divine/coin", json={"topic": "事业"}),
+            "GET /api/divine/hex/{code}": lambda i: client.get(
+                f"/api/divine/hex/{i % 64 + 1}", headers={"Accept-Encoding": "gzip"}
+            ),
+            "POST /api/divine/interpret": lambda i: client.post(
+                "/api/divine/interpret", json={"hexagram": readings[i % 64], "question": "事业"}
+            ),
+            # 问题各不相同：每次都经过上游（模拟延迟）
+            "POST /api/ai (miss)": lambda i: client.post("/api/ai", json={
+                "question": f"问题{i}", "hexagram": {**record, "sequence": 1},
+            }),
+            # 相同问题：除首个请求外都命中缓存
+            "POST /api/ai (hit)": lambda i: client.post("/api/ai", json={
+                "question": "事业", "hexagram": {**record, "sequence": 1},
+            }),
+        }
+        results = {}
+        for name, make_request in scenarios.items():
+            await _drive(client, make_request, min(total, concurrency * 2), concurrency)  # 预热
+            results[name] = await _drive(client, make_request, total, concurrency)
+        return results
+
+
+def run_load(
+    total: int = 1000, concurrency: int = 16, mock_latency: float = 0.05, url: Optional[str] = None
+) -> Dict[str, Any]:
+    if url:
+        return asyncio.run(_load_scenarios(url.rstrip("/"), total, concurrency))
+    mock = start_mock_llm(mock_latency)
+    os.environ["SILICONFLOW_BASE_URL"] = f"http://127.0.0.1:{mock.server_address[1]}/v1/chat/completions"
+    os.environ.setdefault("SILICONFLOW_API_KEY", "benchmark")
+    os.environ.setdefault("AI_MODEL_FALLBACKS", "none")
+    port = _free_port()
+    server = _start_service(port)
+    try:
+        return asyncio.run(_load_scenarios(f"http://127.0.0.1:{port}", total, concurrency))
+    finally:
+        server.should_exit = True
+        mock.shutdown()
+
+
+# ===================== 基线比较 =====================
+
+def compare(current: Dict[str, Any], baseline: Dict[str, Any], tolerance: float) -> List[str]:
+    """返回 p95 劣化超过容差的条目"""
+    regressions = []
+    for section in ("micro", "load"):
+        for name, cur in (current.get(section) or {}).items():
+            base = (baseline.get(section) or {}).get(name)
+            if not base or not base.get("p95_ms"):
+                continue
+            ratio = cur["p95_ms"] / base["p95_ms"]
+            if ratio > 1 + tolerance:
+                regressions.append(f"{section}/{name}: p95 {base['p95_ms']}ms -> {cur['p95_ms']}ms (x{ratio:.2f})")
+    return regressions
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="AI算卦服务性能基准")
+    parser.add_argument("suite", nargs="?", choices=("all", "micro", "load"), default="all")
+    parser.add_argument("-n", "--requests", type=int, default=1000, help="每个压测场景的请求数")
+    parser.add_argument("-c", "--concurrency", type=int, default=16)
+    parser.add_argument("--iterations", type=int, default=20000, help="每个微基准的调用次数")
+    parser.add_argument("--mock-latency", type=float, default=50.0, help="模拟上游延迟（毫秒）")
+    parser.add_argument("--url", help="压测已启动的服务，不在进程内启动服务与模拟上游")
+    parser.add_argument("-o", "--output", help="结果写入文件（默认标准输出）")
+    parser.add_argument("--baseline", help="基线 JSON 文件")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="p95 允许劣化比例")
+    args = parser.parse_args(argv)
+
+    # 进程内压测：所有请求来自同一地址，关闭限流；起卦统计与任务库写到临时目录，不污染工作区；
+    # 不读取预生成解读，AI 命中/未命中场景只经过精确缓存与模拟上游
+    scratch = tempfile.mkdtemp(prefix="iching-bench-")
+    os.environ.setdefault("AI_RATE_LIMIT", "none")
+    os.environ.setdefault("CHEAP_RATE_LIMIT", "none")
+    os.environ.setdefault("READING_STATS_LOG", os.path.join(scratch, "readings.log"))
+    os.environ.setdefault("AI_JOB_DB", os.path.join(scratch, "jobs.sqlite3"))
+    os.environ.setdefault("PREGEN_PATH", "none")
+    # 未命中场景的问题只差编号（问题12 / 问题123），关闭相似问题复用才能测到真实的未命中耗时
+    os.environ.setdefault("AI_SEMANTIC_THRESHOLD", "none")
+
+    result: Dict[str, Any] = {
+        "meta": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "timestamp": int(time.time()),
+            "requests": args.requests,
+            "concurrency": args.concurrency,
+            "mock_latency_ms": None if args.url else args.mock_latency,
+            "url": args.url,
+        },
+    }
+    if args.suite in ("all", "micro"):
+        result["micro"] = run_micro(args.iterations)
+    if args.suite in ("all", "load"):
+        result["load"] = run_load(args.requests, args.concurrency, args.mock_latency / 1000, args.url)
+
+    text = json.dumps(result, ensure_ascii=False, indent=2)
+    if args.output:
+        Path(args.output).write_text(text + "\n", encoding="utf-8")
+    else:
+        print(text)
+
+    if args.baseline:
+        regressions = compare(result, json.loads(Path(args.baseline).read_text(encoding="utf-8")), args.tolerance)
+        for line in regressions:
+            print("性能回退：" + line, file=sys.stderr)
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,73 @@
+"""
+易经核心库
+app.py 与 Vercel 无服务器函数（api/*.py）共用，不依赖 FastAPI
+
+子模块按需导入：只用 iching.core 的无服务器函数不会为数据加载与压缩付出导入开销
+"""
+
+from __future__ import annotations
+
+import importlib
+from typing import Any
+
+_EXPORTS = {
+    "CODE_TO_PATTERN": "core",
+    "HEXAGRAM_NAMES": "core",
+    "PATTERN_TO_CODE": "core",
+    "Reading": "core",
+    "TRIGRAM_BITS": "core",
+    "TRIGRAM_NAMES": "core",
+    "build_reading": "core",
+    "cast_coins": "core",
+    "cast_reading": "core",
+    "divine_coin": "core",
+    "hexagram_from_lines": "core",
+    "hexagram_from_pattern": "core",
+    "hexagram_name": "core",
+    "lines_from_pattern": "core",
+    "make_rng": "core",
+    "pattern_from_lines": "core",
+    "pattern_from_trigrams": "core",
+    "DATA_PATH": "store",
+    "HexagramStore": "store",
+    "get_store": "store",
+    "HexagramRelations": "relations",
+    "changed_code": "relations",
+    "relation_dict": "relations",
+    "relations_of": "relations",
+    "SearchIndex": "search",
+    "get_search_index": "search",
+    "cast_patterns": "batch",
+    "divine_batch": "batch",
+    "build_payload": "prompts",
+    "estimate_tokens": "prompts",
+    "output_budget": "prompts",
+    "PregeneratedStore": "pregen",
+    "get_pregenerated": "pregen",
+    "SimilarityIndex": "semantic",
+    "canonical_question": "semantic",
+    "get_similarity_index": "semantic",
+    "ReadingStats": "stats",
+    "get_reading_stats": "stats",
+    "CACHE_CONTROL": "payloads",
+    "EncodedPayload": "payloads",
+    "encode_payload": "payloads",
+    "etag_matches": "payloads",
+    "get_hex_payloads": "payloads",
+    "pick_encoding": "payloads",
+}
+
+__all__ = list(_EXPORTS)
+
+
+def __getattr__(name: str) -> Any:
+    module = _EXPORTS.get(name)
+    if module is None:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(importlib.import_module(f".{module}", __name__), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__() -> list:
+    return sorted(set(globals()) | set(__all__))
@@ -0,0 +1,206 @@
+"""
+限流与准入控制
+RateLimiter：按客户端（IP 或 API Key）的令牌桶，超出速率时给出需等待的秒数（用于 429 + Retry-After）。
+AdmissionQueue：AI 调用的有界优先级准入队列。同时进行的调用数有上限，其余按优先级排队；
+按最近调用耗时的滑动平均估算排队时间，队列已满或预计等待超过截止时间时立即拒绝（503 + Retry-After），
+而不是让请求在队列里耗到超时。
+
+两者都只在进程内生效；多 worker 部署时每个进程各自计数。
+"""
+
+from __future__ import annotations
+
+import asyncio
+import heapq
+import itertools
+import math
+import os
+import threading
+import time
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+
+# 优先级：数值越小越先放行
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BACKGROUND = 10
+
+DEFAULT_AI_RATE = "0.5:10"  # 每秒补充 0.5 个令牌，桶容量 10
+DEFAULT_CHEAP_RATE = "20:100"
+
+
+class Overloaded(Exception):
+    """准入队列拒绝：retry_after 为建议的重试等待秒数"""
+
+    def __init__(self, message: str, retry_after: float):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class RateLimiter:
+    """按键的令牌桶；键数超过 max_keys 时淘汰最久未访问的桶"""
+
+    def __init__(self, rate: float, burst: float, max_keys: int = 10000):
+        self.rate = rate
+        self.burst = burst
+        self.max_keys = max_keys
+        self._buckets: "OrderedDict[str, List[float]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.rejected = 0
+
+    def hit(self, key: str, cost: float = 1.0) -> float:
+        """消耗令牌；放行返回 0，否则返回令牌补足所需的秒数"""
+        now = time.monotonic()
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = self._buckets[key] = [self.burst, now]
+                if len(self._buckets) > self.max_keys:
+                    self._buckets.popitem(last=False)
+            else:
+                self._buckets.move_to_end(key)
+                bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+                bucket[1] = now
+            if bucket[0] >= cost:
+                bucket[0] -= cost
+                return 0.0
+            self.rejected += 1
+            return (cost - bucket[0]) / self.rate if self.rate > 0 else math.inf
+
+    def __len__(self) -> int:
+        return len(self._buckets)
+
+
+def parse_rate(spec: Optional[str]) -> Optional[Tuple[float, float]]:
+    """解析 "每秒速率:突发容量"；none 或空表示不限流"""
+    if not spec or spec.strip().lower() == "none":
+        return None
+    rate, _, burst = spec.partition(":")
+    try:
+        rate_f = float(rate)
+        return rate_f, float(burst) if burst else max(1.0, rate_f)
+    except ValueError:
+        return None
+
+
+class AdmissionQueue:
+    """异步有界优先级队列（只在事件循环线程中使用，无需加锁）"""
+
+    def __init__(self, concurrency: int = 32, max_queue: int = 128, max_wait: float = 10.0, initial_service: float = 8.0):
+        self.concurrency = max(1, concurrency)
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+        self.service_time = initial_service  # 单次调用耗时的指数滑动平均（秒）
+        self._active = 0
+        self._waiting = 0
+        self._heap: List[Tuple[int, int, "asyncio.Future[None]"]] = []
+        self._seq = itertools.count()
+        self._stats = {"admitted": 0, "queued": 0, "shed": 0, "timed_out": 0}
+
+    def estimated_wait(self, priority: int = PRIORITY_INTERACTIVE) -> float:
+        if self._active < self.concurrency and not self._waiting:
+            return 0.0
+        ahead = sum(1 for p, _, f in self._heap if p <= priority and not f.done())
+        return (ahead + 1) / self.concurrency * self.service_time
+
+    def check(self, priority: int = PRIORITY_INTERACTIVE) -> None:
+        """不排队时的快速判断：预计需要排队且等不到截止时间即抛出 Overloaded"""
+        if self._waiting >= self.max_queue:
+            self._stats["shed"] += 1
+            raise Overloaded("AI 服务繁忙，排队已满，请稍后重试", self._retry_after())
+        wait = self.estimated_wait(priority)
+        if wait > self.max_wait:
+            self._stats["shed"] += 1
+            raise Overloaded("AI 服务繁忙，预计等待过长，请稍后重试", self._retry_after(wait - self.max_wait))
+
+    def _retry_after(self, extra: float = 0.0) -> float:
+        return max(1.0, math.ceil(max(extra, self.service_time)))
+
+    async def acquire(self, priority: int = PRIORITY_INTERACTIVE) -> None:
+        if self._active < self.concurrency and not self._waiting:
+            self._active += 1
+            self._stats["admitted"] += 1
+            return
+        self.check(priority)
+        fut: "asyncio.Future[None]" = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._heap, (priority, next(self._seq), fut))
+        self._waiting += 1
+        self._stats["queued"] += 1
+        try:
+            await asyncio.wait_for(fut, self.max_wait)
+        except BaseException as e:
+            if fut.done() and not fut.cancelled():
+                # 放行与超时/取消同时发生：归还刚拿到的名额
+                self._release()
+            else:
+                fut.cancel()
+                self._waiting -= 1
+            if isinstance(e, asyncio.TimeoutError):
+                self._stats["timed_out"] += 1
+                raise Overloaded("AI 服务繁忙，排队超时，请稍后重试", self._retry_after()) from None
+            raise
+        self._stats["admitted"] += 1
+
+    def _release(self) -> None:
+        self._active -= 1
+        while self._heap and self._active < self.concurrency:
+            _, _, fut = heapq.heappop(self._heap)
+            if fut.done():
+                continue
+            self._waiting -= 1
+            self._active += 1
+            fut.set_result(None)
+
+    def release(self, elapsed: Optional[float] = None) -> None:
+        if elapsed is not None:
+            self.service_time = 0.8 * self.service_time + 0.2 * elapsed
+        self._release()
+
+    @asynccontextmanager
+    async def slot(self, priority: int = PRIORITY_INTERACTIVE) -> AsyncIterator[None]:
+        await self.acquire(priority)
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self.release(time.monotonic() - started)
+
+    def stats(self) -> Dict[str, Any]:
+        return dict(
+            self._stats,
+            active=self._active,
+            waiting=self._waiting,
+            concurrency=self.concurrency,
+            service_time=round(self.service_time, 3),
+        )
+
+
+def _env_float(name: str, default: float) -> float:
+    try:
+        return float(os.getenv(name, "") or default)
+    except ValueError:
+        return default
+
+
+_QUEUE: Optional[AdmissionQueue] = None
+_QUEUE_LOCK = threading.Lock()
+
+
+def get_admission_queue() -> AdmissionQueue:
+    """进程内共享的 AI 准入队列；AI_QUEUE_CONCURRENCY / AI_QUEUE_SIZE / AI_QUEUE_WAIT 可配置"""
+    global _QUEUE
+    if _QUEUE is None:
+        with _QUEUE_LOCK:
+            if _QUEUE is None:
+                _QUEUE = AdmissionQueue(
+                    concurrency=int(_env_float("AI_QUEUE_CONCURRENCY", 32)),
+                    max_queue=int(_env_float("AI_QUEUE_SIZE", 128)),
+                    max_wait=_env_float("AI_QUEUE_WAIT", 10.0),
+                )
+    return _QUEUE
+
+
+def limiter_from_env(name: str, default: str) -> Optional[RateLimiter]:
+    """按环境变量（"每秒速率:突发容量"，none 关闭）创建限流器"""
+    parsed = parse_rate(os.getenv(name, default))
+    return RateLimiter(*parsed) if parsed else None
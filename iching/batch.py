@@ -0,0 +1,94 @@
+"""
+批量起卦
+一次取出 N×18 个随机位（每爻三枚铜钱各 1 位，正=1），查表得到本卦位型与动爻掩码，
+再由预计算的 64×64 转移表得到变卦。安装了 NumPy 时用向量化解码，结果与纯 Python 路径逐位一致，
+给定种子时可复现。
+"""
+
+from __future__ import annotations
+
+from typing import Any, Dict, List, Sequence, Tuple
+
+from .core import PATTERN_TO_CODE, Reading, Seed, make_rng
+
+try:  # 可选依赖：仅用于加速解码
+    import numpy as _np
+except ImportError:  # pragma: no cover
+    _np = None
+
+BITS_PER_READING = 18
+MAX_BATCH = 100_000
+
+
+def _half_table() -> Tuple[Tuple[int, int], ...]:
+    """9 位（三爻的三枚铜钱）-> (三爻阴阳位, 三爻动爻位)；正面数 1、3 为阳，0、3 为动"""
+    table = []
+    for bits in range(512):
+        lines = moving = 0
+        for j in range(3):
+            heads = bin((bits >> (3 * j)) & 0b111).count("1")
+            if heads & 1:
+                lines |= 1 << j
+            if heads in (0, 3):
+                moving |= 1 << j
+        table.append((lines, moving))
+    return tuple(table)
+
+
+_HALF = _half_table()
+
+# 转移表：下标 (本卦位型 << 6) | 动爻掩码 -> 变卦卦序
+TRANSITIONS = tuple(PATTERN_TO_CODE[p ^ m] for p in range(64) for m in range(64))
+
+
+def _random_bits(n: int, seed: Seed) -> int:
+    return make_rng(seed).getrandbits(BITS_PER_READING * n) if n else 0
+
+
+def cast_patterns(n: int, seed: Seed = None) -> Tuple[Sequence[int], Sequence[int]]:
+    """起 n 卦，返回 (本卦位型序列, 动爻掩码序列)"""
+    n = max(0, min(int(n), MAX_BATCH))
+    data = _random_bits(n, seed)
+    if _np is not None and n >= 64:
+        raw = _np.frombuffer(data.to_bytes((BITS_PER_READING * n + 7) // 8, "little"), dtype=_np.uint8)
+        bits = _np.unpackbits(raw, bitorder="little")[: BITS_PER_READING * n].reshape(n, 6, 3)
+        heads = bits.sum(axis=2, dtype=_np.uint8)
+        weights = (1 << _np.arange(6, dtype=_np.uint8))
+        patterns = ((heads & 1) * weights).sum(axis=1, dtype=_np.uint8)
+        masks = (((heads == 0) | (heads == 3)) * weights).sum(axis=1, dtype=_np.uint8)
+        return patterns.tolist(), masks.tolist()
+
+    # 每 4 卦恰好 72 位 = 9 字节，按块取小整数解码，避免反复移位大整数
+    patterns: List[int] = []
+    masks: List[int] = []
+    half = _HALF
+    raw = data.to_bytes((BITS_PER_READING * n + 71) // 72 * 9, "little")
+    for offset in range(0, len(raw), 9):
+        block = int.from_bytes(raw[offset:offset + 9], "little")
+        for _ in range(4):
+            lo_lines, lo_moving = half[block & 0x1FF]
+            hi_lines, hi_moving = half[(block >> 9) & 0x1FF]
+            patterns.append(lo_lines | (hi_lines << 3))
+            masks.append(lo_moving | (hi_moving << 3))
+            block >>= BITS_PER_READING
+    return patterns[:n], masks[:n]
+
+
+def divine_batch(count: int, seed: Seed = None, fmt: str = "json", question: str = "") -> Dict[str, Any]:
+    """批量铜钱占卜
+
+    fmt="json" 返回与单次占卜相同结构的列表；fmt="columnar" 返回列式数组
+    （本卦/变卦卦序、六爻位型、动爻掩码），体积更小、便于批处理。
+    """
+    patterns, masks = cast_patterns(count, seed)
+    if fmt == "columnar":
+        return {
+            "format": "columnar",
+            "count": len(patterns),
+            "primary": [PATTERN_TO_CODE[p] for p in patterns],
+            "changed": [TRANSITIONS[(p << 6) | m] for p, m in zip(patterns, masks)],
+            "lines": list(patterns),
+            "moving": list(masks),
+        }
+    readings = [Reading(p | (m << 6)).to_dict(question) for p, m in zip(patterns, masks)]
+    return {"format": "json", "count": len(readings), "readings": readings}
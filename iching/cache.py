@@ -0,0 +1,234 @@
+"""
+AI 解读缓存
+键由规范化的卦象内容、动爻（与提示词同样由 bits 或 changeList 得出）、规范化问题与模型组成；
+第一层为进程内 LRU（带 TTL），可选第二层为进程外共享存储，多 worker 部署时各进程共用：
+AI_CACHE_URL 设为 redis://…（需安装 redis，兼容 Redis 协议的服务均可）或 sqlite:///路径，
+AI_CACHE_DB 等价于 sqlite 路径。
+"""
+
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import json as _json
+import os
+import sqlite3
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+from .prompts import moving_mask
+
+DEFAULT_QUESTION = "综合运势"
+
+# 参与提示词组装的卦象字段；其余字段不影响解读结果
+_HEXAGRAM_FIELDS = ("sequence", "code", "name", "fullName", "judgement", "image", "lines")
+
+
+def normalize_question(question: Optional[str]) -> str:
+    """全角转半角、去空白与标点、英文小写；空问题视为「综合运势」"""
+    text = unicodedata.normalize("NFKC", question or "").lower()
+    text = "".join(ch for ch in text if not (ch.isspace() or unicodedata.category(ch).startswith("P")))
+    return text or DEFAULT_QUESTION
+
+
+def canonical_hexagram(hexagram: Dict[str, Any]) -> Tuple[Dict[str, Any], Tuple[int, Tuple[str, ...]]]:
+    """提取卦象中影响解读的字段，以及 (动爻掩码, 排序后的变爻名)
+
+    掩码与组装提示词时一致：bits 有效时取其高 6 位，否则由 changeList 推出；
+    变爻名原样出现在提示词里，也一并计入。
+    """
+    hx = {k: hexagram[k] for k in _HEXAGRAM_FIELDS if hexagram.get(k) not in (None, "", [])}
+    labels = tuple(sorted(str(x) for x in (hexagram.get("changeList") or [])))
+    return hx, (moving_mask(hexagram), labels)
+
+
+def interpretation_key(hexagram: Dict[str, Any], question: Optional[str], model: str) -> str:
+    """解读缓存键（sha256）"""
+    hx, moving = canonical_hexagram(hexagram or {})
+    raw = _json.dumps(
+        {"h": hx, "m": moving, "q": normalize_question(question), "model": model},
+        ensure_ascii=False, sort_keys=True, separators=(",", ":"),
+    )
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class TTLCache:
+    """线程安全的 LRU 缓存，条目超过 ttl 秒后失效"""
+
+    def __init__(self, maxsize: int = 2048, ttl: float = 86400.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: "OrderedDict[str, Tuple[float, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[Any]:
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            expires, value = item
+            if expires < time.time():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key: str, value: Any, ttl: Optional[float] = None) -> None:
+        expires = time.time() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._data[key] = (expires, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+
+class SQLiteCache:
+    """SQLite 持久层：值以 JSON 存储，过期条目在读取时忽略、写入时顺带清理"""
+
+    def __init__(self, path: str, ttl: float = 86400.0):
+        self.path = path
+        self.ttl = ttl
+        self._local = threading.local()
+        self._conn().execute(
+            "CREATE TABLE IF NOT EXISTS ai_cache (key TEXT PRIMARY KEY, value TEXT NOT NULL, expires REAL NOT NULL)"
+        )
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5.0, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def get(self, key: str) -> Optional[Any]:
+        row = self._conn().execute(
+            "SELECT value, expires FROM ai_cache WHERE key = ?", (key,)
+        ).fetchone()
+        if row is None or row[1] < time.time():
+            return None
+        return _json.loads(row[0])
+
+    def set(self, key: str, value: Any, ttl: Optional[float] = None) -> None:
+        now = time.time()
+        expires = now + (self.ttl if ttl is None else ttl)
+        conn = self._conn()
+        conn.execute(
+            "INSERT OR REPLACE INTO ai_cache (key, value, expires) VALUES (?, ?, ?)",
+            (key, _json.dumps(value, ensure_ascii=False), expires),
+        )
+        conn.execute("DELETE FROM ai_cache WHERE expires < ?", (now,))
+
+
+class RedisCache:
+    """Redis 共享层：值以 JSON 存储，过期交给 Redis；连接失败时按未命中处理，不影响请求"""
+
+    def __init__(self, url: str, ttl: float = 86400.0, prefix: str = "iching:ai:"):
+        import redis
+
+        self._errors = redis.RedisError
+        self._client = redis.Redis.from_url(url, socket_timeout=0.5, socket_connect_timeout=0.5)
+        self.path = url.split("@")[-1]  # 统计信息中不暴露密码
+        self.ttl = ttl
+        self.prefix = prefix
+
+    def get(self, key: str) -> Optional[Any]:
+        try:
+            raw = self._client.get(self.prefix + key)
+        except self._errors:
+            return None
+        return _json.loads(raw) if raw is not None else None
+
+    def set(self, key: str, value: Any, ttl: Optional[float] = None) -> None:
+        seconds = max(1, int(self.ttl if ttl is None else ttl))
+        try:
+            self._client.set(self.prefix + key, _json.dumps(value, ensure_ascii=False), ex=seconds)
+        except self._errors:
+            pass
+
+
+def shared_cache_from_env(ttl: float) -> Optional[Any]:
+    """按 AI_CACHE_URL / AI_CACHE_DB 创建进程外共享层；均未设置时返回 None"""
+    url = os.getenv("AI_CACHE_URL", "")
+    if url.startswith(("redis://", "rediss://", "unix://")):
+        return RedisCache(url, ttl)
+    if url.startswith("sqlite:///"):
+        return SQLiteCache(url[len("sqlite:///"):], ttl)
+    db = os.getenv("AI_CACHE_DB")
+    return SQLiteCache(db, ttl) if db else None
+
+
+class InterpretationCache:
+    """两级解读缓存，并统计命中率；disk 为任意提供 get/set 的共享层（SQLite 或 Redis）"""
+
+    def __init__(self, memory: TTLCache, disk: Optional[Any] = None):
+        self.memory = memory
+        self.disk = disk
+        self._stats = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "bypass": 0, "sets": 0}
+
+    def get(self, key: str) -> Optional[Any]:
+        value = self.memory.get(key)
+        if value is not None:
+            self._stats["memory_hits"] += 1
+            return value
+        if self.disk is not None:
+            value = self.disk.get(key)
+            if value is not None:
+                self._stats["disk_hits"] += 1
+                self.memory.set(key, value)
+                return value
+        self._stats["misses"] += 1
+        return None
+
+    def set(self, key: str, value: Any) -> None:
+        self._stats["sets"] += 1
+        self.memory.set(key, value)
+        if self.disk is not None:
+            self.disk.set(key, value)
+
+    def record_bypass(self) -> None:
+        self._stats["bypass"] += 1
+
+    async def aget(self, key: str) -> Optional[Any]:
+        """内存命中时直接返回，需要查询磁盘层时放到线程中执行"""
+        if self.disk is None:
+            return self.get(key)
+        return await asyncio.to_thread(self.get, key)
+
+    async def aset(self, key: str, value: Any) -> None:
+        if self.disk is None:
+            self.set(key, value)
+        else:
+            await asyncio.to_thread(self.set, key, value)
+
+    def stats(self) -> Dict[str, Any]:
+        s = dict(self._stats)
+        hits = s["memory_hits"] + s["disk_hits"]
+        lookups = hits + s["misses"]
+        s["hit_ratio"] = round(hits / lookups, 4) if lookups else 0.0
+        s["memory_size"] = len(self.memory)
+        s["disk"] = self.disk.path if self.disk is not None else None
+        return s
+
+
+_CACHE: Optional[InterpretationCache] = None
+_CACHE_LOCK = threading.Lock()
+
+
+def get_interpretation_cache() -> InterpretationCache:
+    """进程内共享的解读缓存；AI_CACHE_SIZE / AI_CACHE_TTL / AI_CACHE_URL / AI_CACHE_DB 可配置"""
+    global _CACHE
+    if _CACHE is None:
+        with _CACHE_LOCK:
+            if _CACHE is None:
+                ttl = float(os.getenv("AI_CACHE_TTL", "") or 86400)
+                size = int(os.getenv("AI_CACHE_SIZE", "") or 2048)
+                _CACHE = InterpretationCache(TTLCache(size, ttl), shared_cache_from_env(ttl))
+    return _CACHE
@@ -0,0 +1,217 @@
+"""
+占卜核心
+卦名、三爻卦编码、六爻位型 -> 卦序查表与铜钱起卦，只依赖标准库，
+供 app.py 与 Vercel 无服务器函数共用，导入开销极小。
+
+爻线约定：lines[0] 为初爻（最下），lines[5] 为上爻，阳=1 阴=0。
+六爻位型：第 i 位为第 i 爻，低三位为下卦，高三位为上卦。
+一次占卜打包为 12 位整数（Reading）：低 6 位为位型，高 6 位为动爻掩码，只在输出时展开为 JSON。
+"""
+
+from __future__ import annotations
+
+import random
+from typing import Any, Dict, List, Optional, Sequence, Tuple, Union
+
+HEXAGRAM_NAMES = (
+    "乾","坤","屯","蒙","需","讼","师","比","小畜","履","泰","否","同人","大有","谦","豫",
+    "随","蛊","临","观","噬嗑","贲","剥","复","无妄","大畜","颐","大过","坎","离","咸","恒",
+    "遁","大壮","晋","明夷","家人","睽","蹇","解","损","益","夬","姤","萃","升","困","井","革",
+    "鼎","震","艮","渐","归妹","丰","旅","巽","兑","涣","节","中孚","小过","既济","未济",
+)
+
+# 三爻卦按位型编码：初爻为最低位
+TRIGRAM_NAMES = ("坤", "震", "坎", "兑", "艮", "离", "巽", "乾")
+TRIGRAM_SYMBOLS = ("地", "雷", "水", "泽", "山", "火", "风", "天")
+TRIGRAM_BITS = {name: bits for bits, name in enumerate(TRIGRAM_NAMES)}
+
+# 六爻位型 -> 文王卦序（1..64）
+PATTERN_TO_CODE = (
+    2, 24, 7, 19, 15, 36, 46, 11, 16, 51, 40, 54, 62, 55, 32, 34,
+    8, 3, 29, 60, 39, 63, 48, 5, 45, 17, 47, 58, 31, 49, 28, 43,
+    23, 27, 4, 41, 52, 22, 18, 26, 35, 21, 64, 38, 56, 30, 50, 14,
+    20, 42, 59, 61, 53, 37, 57, 9, 12, 25, 6, 10, 33, 13, 44, 1,
+)
+
+# 文王卦序 -> 六爻位型（下标 0 不用）
+CODE_TO_PATTERN = (0,) + tuple(PATTERN_TO_CODE.index(code) for code in range(1, 65))
+
+SIX_BEASTS = ("青龙", "朱雀", "勾陈", "腾蛇", "白虎", "玄武")
+
+# 位型 -> 互卦位型：二三四爻为下卦，三四五爻为上卦
+NUCLEAR_PATTERN = tuple(((p >> 1) & 0b111) | (((p >> 2) & 0b111) << 3) for p in range(64))
+# 位型 -> 综卦位型：六爻上下颠倒
+INVERSE_PATTERN = tuple(int(format(p, "06b")[::-1], 2) for p in range(64))
+
+Seed = Union[int, str, bytes, None]
+
+
+def pattern_from_lines(lines: Sequence[int]) -> int:
+    """爻线 -> 六爻位型"""
+    pattern = 0
+    for i, v in enumerate(lines[:6]):
+        if v:
+            pattern |= 1 << i
+    return pattern
+
+
+def lines_from_pattern(pattern: int) -> List[int]:
+    """六爻位型 -> 爻线"""
+    return [(pattern >> i) & 1 for i in range(6)]
+
+
+def pattern_from_trigrams(upper: str, lower: str) -> Optional[int]:
+    """上下卦名 -> 六爻位型"""
+    up = TRIGRAM_BITS.get(upper)
+    lo = TRIGRAM_BITS.get(lower)
+    if up is None or lo is None:
+        return None
+    return (up << 3) | lo
+
+
+def hexagram_from_pattern(pattern: int) -> Tuple[int, str, str]:
+    """六爻位型 -> (卦序, 上卦名, 下卦名)"""
+    pattern &= 0b111111
+    return PATTERN_TO_CODE[pattern], TRIGRAM_NAMES[pattern >> 3], TRIGRAM_NAMES[pattern & 0b111]
+
+
+def hexagram_from_lines(lines: Sequence[int]) -> Tuple[int, str, str]:
+    """根据爻线计算 (卦序, 上卦名, 下卦名)；爻数不为 6 时返回 (0, "", "")"""
+    if len(lines) != 6:
+        return 0, "", ""
+    return hexagram_from_pattern(pattern_from_lines(lines))
+
+
+def hexagram_name(code: int) -> str:
+    return HEXAGRAM_NAMES[code - 1] if 1 <= code <= 64 else ""
+
+
+def make_rng(seed: Seed = None) -> random.Random:
+    """有种子时可复现（0 与空串也是种子），否则使用系统随机源"""
+    return random.Random(seed) if seed is not None else random.SystemRandom()
+
+
+class Reading:
+    """一次占卜的紧凑表示：bits 低 6 位为本卦位型，高 6 位为动爻掩码；派生属性均为查表或位运算"""
+
+    __slots__ = ("bits",)
+
+    def __init__(self, bits: int):
+        self.bits = bits & 0xFFF
+
+    @classmethod
+    def from_lines(cls, lines: Sequence[int], moving: Sequence[bool] = ()) -> "Reading":
+        return cls(pattern_from_lines(lines) | (pattern_from_lines(moving) << 6))
+
+    @property
+    def pattern(self) -> int:
+        return self.bits & 0b111111
+
+    @property
+    def moving_mask(self) -> int:
+        return self.bits >> 6
+
+    @property
+    def changed_pattern(self) -> int:
+        return (self.bits ^ (self.bits >> 6)) & 0b111111
+
+    @property
+    def code(self) -> int:
+        return PATTERN_TO_CODE[self.bits & 0b111111]
+
+    @property
+    def changed_code(self) -> int:
+        return PATTERN_TO_CODE[self.changed_pattern]
+
+    @property
+    def upper(self) -> str:
+        return TRIGRAM_NAMES[(self.bits >> 3) & 0b111]
+
+    @property
+    def lower(self) -> str:
+        return TRIGRAM_NAMES[self.bits & 0b111]
+
+    @property
+    def nuclear_code(self) -> int:
+        """互卦卦序"""
+        return PATTERN_TO_CODE[NUCLEAR_PATTERN[self.bits & 0b111111]]
+
+    @property
+    def inverse_code(self) -> int:
+        """综卦卦序"""
+        return PATTERN_TO_CODE[INVERSE_PATTERN[self.bits & 0b111111]]
+
+    @property
+    def complement_code(self) -> int:
+        """错卦卦序"""
+        return PATTERN_TO_CODE[(self.bits & 0b111111) ^ 0b111111]
+
+    @property
+    def moving_count(self) -> int:
+        return bin(self.bits >> 6).count("1")
+
+    def __eq__(self, other: object) -> bool:
+        return isinstance(other, Reading) and other.bits == self.bits
+
+    def __hash__(self) -> int:
+        return self.bits
+
+    def __repr__(self) -> str:
+        return f"Reading(0b{self.bits:012b})"
+
+    def to_dict(self, question: str = "") -> Dict[str, Any]:
+        """展开为接口返回的 JSON 结构"""
+        pattern = self.pattern
+        moving = self.moving_mask
+        changed = self.changed_pattern
+        code, code2 = PATTERN_TO_CODE[pattern], PATTERN_TO_CODE[changed]
+        return {
+            "method": "coin",
+            "question": question,
+            "primary": {
+                "code": code,
+                "name": HEXAGRAM_NAMES[code - 1],
+                "upper": TRIGRAM_NAMES[pattern >> 3],
+                "lower": TRIGRAM_NAMES[pattern & 0b111],
+                "lines": lines_from_pattern(pattern),
+                "moving": [bool((moving >> i) & 1) for i in range(6)],
+            },
+            "changed": {
+                "code": code2,
+                "name": HEXAGRAM_NAMES[code2 - 1],
+                "upper": TRIGRAM_NAMES[changed >> 3],
+                "lower": TRIGRAM_NAMES[changed & 0b111],
+                "lines": lines_from_pattern(changed),
+            },
+            "meta": {
+                "sixBeasts": list(SIX_BEASTS),
+            },
+        }
+
+
+def cast_reading(rnd: random.Random) -> Reading:
+    """三枚铜钱起六爻：正=3 反=2；总和 6老阴 7少阳 8少阴 9老阳，直接打包为 Reading"""
+    bits = 0
+    for i in range(6):
+        s = sum(rnd.choice((2, 3)) for _ in range(3))
+        if s & 1:            # 7、9 为阳
+            bits |= 1 << i
+        if s in (6, 9):      # 老阴、老阳为动爻
+            bits |= 1 << (i + 6)
+    return Reading(bits)
+
+
+def cast_coins(rnd: random.Random) -> Tuple[List[int], List[bool]]:
+    """起六爻，返回 (爻线, 动爻) 列表"""
+    reading = cast_reading(rnd)
+    return lines_from_pattern(reading.pattern), [bool((reading.moving_mask >> i) & 1) for i in range(6)]
+
+
+def build_reading(lines: List[int], moving: List[bool], question: str = "") -> Dict[str, Any]:
+    """由本卦爻线与动爻组装占卜结果（本卦、变卦）"""
+    return Reading.from_lines(lines, moving).to_dict(question)
+
+
+def divine_coin(seed: Seed = None, question: str = "") -> Dict[str, Any]:
+    """铜钱占卜生成卦象"""
+    return cast_reading(make_rng(seed)).to_dict(question)
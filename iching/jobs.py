@@ -0,0 +1,398 @@
+"""
+后台解读任务
+提交后立即返回任务 ID，由进程内的 worker 池逐个取出执行，客户端轮询结果或接收 webhook 回调。
+任务持久化在本地 SQLite（WAL），无需外部服务；多 worker 进程共用同一数据库时，
+取任务在 BEGIN IMMEDIATE 事务内先查后改，写锁保证互斥（不依赖 3.35 才有的 UPDATE … RETURNING）。
+执行中的任务带租约，执行期间每隔三分之一租约续租一次；进程崩溃后不再续租，租约到期即被重新取出。
+
+任务状态：queued -> running -> done / failed；可重试的错误按退避重新排队，超过次数后置为 failed。
+完成或失败的任务保留 ttl 秒后清理。
+
+webhook 以 POST JSON 回调，配置了密钥时附带 X-Iching-Signature: sha256=<HMAC-SHA256(body)>；
+JOB_WEBHOOK_HOSTS 可限制允许回调的主机。回调地址解析到回环、内网、链路本地（含云元数据 169.254.169.254）
+等非公网地址时拒绝，提交与投递时各检查一次；内网部署可设 JOB_WEBHOOK_ALLOW_PRIVATE=1 放开。
+"""
+
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import hmac
+import ipaddress
+import json as _json
+import os
+import secrets
+import socket
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+from urllib.parse import urlsplit
+
+DEFAULT_DB = Path(__file__).resolve().parent.parent / ".cache" / "jobs.sqlite3"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    status TEXT NOT NULL,
+    request TEXT NOT NULL,
+    result TEXT,
+    error TEXT,
+    webhook TEXT,
+    webhook_status TEXT,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    created REAL NOT NULL,
+    updated REAL NOT NULL,
+    not_before REAL NOT NULL,
+    lease_until REAL,
+    expires REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS jobs_pending ON jobs (status, not_before, created);
+"""
+
+
+def _is_public(address: str) -> bool:
+    ip = ipaddress.ip_address(address.split("%", 1)[0])
+    if isinstance(ip, ipaddress.IPv6Address) and ip.ipv4_mapped is not None:
+        ip = ip.ipv4_mapped
+    return ip.is_global and not ip.is_multicast
+
+
+def validate_webhook(url: str) -> Optional[str]:
+    """返回错误信息；合法时返回 None（会解析主机名，阻塞调用，异步代码中应放到线程执行）"""
+    parts = urlsplit(url)
+    if parts.scheme not in ("http", "https") or not parts.hostname:
+        return "webhook 须为 http(s) 地址"
+    allowed = [h.strip().lower() for h in os.getenv("JOB_WEBHOOK_HOSTS", "").split(",") if h.strip()]
+    if allowed and parts.hostname.lower() not in allowed:
+        return "webhook 主机不在 JOB_WEBHOOK_HOSTS 允许列表中"
+    if os.getenv("JOB_WEBHOOK_ALLOW_PRIVATE", "").lower() in ("1", "true", "yes"):
+        return None
+    try:
+        port = parts.port or (443 if parts.scheme == "https" else 80)
+        infos = socket.getaddrinfo(parts.hostname, port, proto=socket.IPPROTO_TCP)
+    except (OSError, ValueError, UnicodeError):
+        return "webhook 主机无法解析"
+    # 任一解析结果为非公网地址即拒绝，避免借回调访问内网服务
+    if not infos or not all(_is_public(info[4][0]) for info in infos):
+        return "webhook 不允许指向回环、内网或链路本地地址"
+    return None
+
+
+class JobStore:
+    """SQLite 任务表；每个线程一个连接"""
+
+    def __init__(self, path: str, ttl: float = 86400.0):
+        self.path = path
+        self.ttl = ttl
+        self._local = threading.local()
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self._conn().executescript(_SCHEMA)
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5.0, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.row_factory = sqlite3.Row
+            self._local.conn = conn
+        return conn
+
+    def submit(self, request: Dict[str, Any], webhook: Optional[str] = None) -> str:
+        job_id = secrets.token_urlsafe(12)  # 凭 ID 即可读取结果，须不可猜测
+        now = time.time()
+        self._conn().execute(
+            "INSERT INTO jobs (id, status, request, webhook, created, updated, not_before, expires)"
+            " VALUES (?, 'queued', ?, ?, ?, ?, ?, ?)",
+            (job_id, _json.dumps(request, ensure_ascii=False), webhook, now, now, now, now + self.ttl),
+        )
+        return job_id
+
+    def claim(self, lease: float) -> Optional[Dict[str, Any]]:
+        """取出一个可执行的任务（含租约已过期的执行中任务）并标记为 running"""
+        conn = self._conn()
+        now = time.time()
+        conn.execute("BEGIN IMMEDIATE")  # 先取写锁，查到的任务不会同时被其他连接取走
+        try:
+            row = conn.execute(
+                "SELECT id, request, webhook, attempts FROM jobs"
+                " WHERE (status = 'queued' AND not_before <= ?) OR (status = 'running' AND lease_until < ?)"
+                " ORDER BY created LIMIT 1",
+                (now, now),
+            ).fetchone()
+            if row is not None:
+                conn.execute(
+                    "UPDATE jobs SET status = 'running', attempts = attempts + 1, updated = ?, lease_until = ?"
+                    " WHERE id = ?",
+                    (now, now + lease, row["id"]),
+                )
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        if row is None:
+            return None
+        return {"id": row["id"], "request": _json.loads(row["request"]), "webhook": row["webhook"],
+                "attempts": row["attempts"] + 1}
+
+    def renew(self, job_id: str, attempts: int, lease: float) -> bool:
+        """续租；任务已被重新取出（attempts 已变）或已结束时返回 False"""
+        now = time.time()
+        return self._conn().execute(
+            "UPDATE jobs SET lease_until = ?, updated = ? WHERE id = ? AND status = 'running' AND attempts = ?",
+            (now + lease, now, job_id, attempts),
+        ).rowcount == 1
+
+    def finish(self, job_id: str, result: Dict[str, Any]) -> None:
+        now = time.time()
+        self._conn().execute(
+            "UPDATE jobs SET status = 'done', result = ?, error = NULL, updated = ?, lease_until = NULL, expires = ?"
+            " WHERE id = ?",
+            (_json.dumps(result, ensure_ascii=False), now, now + self.ttl, job_id),
+        )
+
+    def fail(self, job_id: str, error: str) -> None:
+        now = time.time()
+        self._conn().execute(
+            "UPDATE jobs SET status = 'failed', error = ?, updated = ?, lease_until = NULL, expires = ? WHERE id = ?",
+            (error, now, now + self.ttl, job_id),
+        )
+
+    def requeue(self, job_id: str, delay: float, error: Optional[str] = None, count_attempt: bool = True) -> None:
+        """放回队列，delay 秒后再取；count_attempt=False 时不计入尝试次数（如排队过载）"""
+        now = time.time()
+        self._conn().execute(
+            "UPDATE jobs SET status = 'queued', error = ?, updated = ?, not_before = ?, lease_until = NULL,"
+            " attempts = attempts - ? WHERE id = ?",
+            (error, now, now + delay, 0 if count_attempt else 1, job_id),
+        )
+
+    def set_webhook_status(self, job_id: str, status: str) -> None:
+        self._conn().execute("UPDATE jobs SET webhook_status = ? WHERE id = ?", (status, job_id))
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        row = self._conn().execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if row is None or row["expires"] < time.time():
+            return None
+        return {
+            "id": row["id"],
+            "status": row["status"],
+            "attempts": row["attempts"],
+            "created": row["created"],
+            "updated": row["updated"],
+            "result": _json.loads(row["result"]) if row["result"] else None,
+            "error": row["error"],
+            "webhook": row["webhook_status"] if row["webhook"] else None,
+        }
+
+    def purge(self) -> int:
+        """删除已过期的任务（含长期未被执行的排队任务），返回删除条数"""
+        return self._conn().execute("DELETE FROM jobs WHERE expires < ?", (time.time(),)).rowcount
+
+    def counts(self) -> Dict[str, int]:
+        rows = self._conn().execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall()
+        return {status: n for status, n in rows}
+
+
+class RetryLater(Exception):
+    """处理函数请求稍后重试：delay 为等待秒数，count_attempt 决定是否计入尝试次数"""
+
+    def __init__(self, message: str, delay: float, count_attempt: bool = True):
+        super().__init__(message)
+        self.delay = delay
+        self.count_attempt = count_attempt
+
+
+class JobRunner:
+    """异步 worker 池：从 JobStore 取任务交给 handler 执行，完成后回调 webhook"""
+
+    def __init__(
+        self,
+        store: JobStore,
+        handler: Callable[[Dict[str, Any]], Awaitable[Dict[str, Any]]],
+        workers: int = 2,
+        lease: float = 120.0,
+        max_attempts: int = 3,
+        poll_interval: float = 1.0,
+        webhook_secret: Optional[str] = None,
+        retryable: Optional[Callable[[BaseException], bool]] = None,
+    ):
+        self.store = store
+        self.handler = handler
+        self.workers = workers
+        self.lease = lease
+        self.max_attempts = max_attempts
+        self.poll_interval = poll_interval
+        self.webhook_secret = webhook_secret
+        self.retryable = retryable or (lambda e: False)  # 判断 handler 抛出的异常是否值得退避重试
+        self._wakeup: Optional[asyncio.Event] = None
+        self._stopping = False
+        self._tasks: List["asyncio.Task[None]"] = []
+        self._running: Dict[str, Dict[str, Any]] = {}
+        self._last_purge = 0.0
+        self._http = None
+        self._stats = {"done": 0, "failed": 0, "retried": 0, "webhooks": 0, "webhook_failures": 0}
+
+    def start(self) -> None:
+        import httpx
+
+        self._wakeup = asyncio.Event()
+        self._stopping = False
+        self._http = httpx.AsyncClient(timeout=httpx.Timeout(10.0, connect=3.0), follow_redirects=False)
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self) -> None:
+        # Python 3.11 的 wait_for 在超时与取消同时发生时会吞掉取消，worker 还要靠这个标记退出循环
+        self._stopping = True
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        # 未完成的任务立即放回队列，重启后由任意进程继续执行
+        for job_id in list(self._running):
+            await asyncio.to_thread(self.store.requeue, job_id, 0.0, None, False)
+        self._running.clear()
+        if self._http is not None:
+            await self._http.aclose()
+
+    def notify(self) -> None:
+        """有新任务提交时唤醒空闲 worker（其他进程提交的任务靠轮询发现）"""
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    async def _worker(self) -> None:
+        while not self._stopping:
+            try:
+                job = await asyncio.to_thread(self.store.claim, self.lease)
+            except sqlite3.Error as e:
+                # 数据库被锁或不可写：记录后等下一轮，不让 worker 静默空转
+                print(f"后台任务取任务失败：{e}")
+                job = None
+            if job is None:
+                await self._idle()
+                continue
+            self._running[job["id"]] = job
+            heartbeat = asyncio.create_task(self._heartbeat(job))
+            try:
+                await self._run(job)
+            except asyncio.CancelledError:
+                raise  # 留在 _running 中，由 stop() 放回队列
+            except Exception as e:
+                # 任务表写入失败等：租约到期后任务会被重新取出
+                print(f"后台任务 {job['id']} 处理异常：{e}")
+            finally:
+                heartbeat.cancel()
+            self._running.pop(job["id"], None)
+
+    async def _heartbeat(self, job: Dict[str, Any]) -> None:
+        """执行期间定期续租：上游调用链耗时超过租约时，任务不会被其他 worker 重复执行、重复回调"""
+        while True:
+            await asyncio.sleep(self.lease / 3)
+            try:
+                held = await asyncio.to_thread(self.store.renew, job["id"], job["attempts"], self.lease)
+            except sqlite3.Error as e:
+                print(f"后台任务 {job['id']} 续租失败：{e}")
+                continue
+            if not held:
+                print(f"后台任务 {job['id']} 的租约已失效，可能已被其他 worker 取出")
+                return
+
+    async def _idle(self) -> None:
+        now = time.monotonic()
+        if now - self._last_purge > 60:
+            self._last_purge = now
+            await asyncio.to_thread(self.store.purge)
+        assert self._wakeup is not None
+        try:
+            await asyncio.wait_for(self._wakeup.wait(), self.poll_interval)
+        except asyncio.TimeoutError:
+            pass
+        self._wakeup.clear()
+
+    async def _run(self, job: Dict[str, Any]) -> None:
+        job_id = job["id"]
+        try:
+            result = await self.handler(job["request"])
+        except asyncio.CancelledError:
+            raise
+        except RetryLater as e:
+            await self._retry(job, str(e), e.delay, e.count_attempt)
+            return
+        except Exception as e:
+            if self.retryable(e):
+                delay = getattr(e, "retry_after", None) or 2.0 ** job["attempts"]
+                await self._retry(job, str(e), delay, True)
+            else:
+                await self._fail(job, str(e) or type(e).__name__)
+            return
+        await asyncio.to_thread(self.store.finish, job_id, result)
+        self._stats["done"] += 1
+        await self._deliver(job, {"id": job_id, "status": "done", "result": result})
+
+    async def _retry(self, job: Dict[str, Any], error: str, delay: float, count_attempt: bool) -> None:
+        if count_attempt and job["attempts"] >= self.max_attempts:
+            await self._fail(job, error)
+            return
+        self._stats["retried"] += 1
+        await asyncio.to_thread(self.store.requeue, job["id"], delay, error, count_attempt)
+
+    async def _fail(self, job: Dict[str, Any], error: str) -> None:
+        await asyncio.to_thread(self.store.fail, job["id"], error)
+        self._stats["failed"] += 1
+        await self._deliver(job, {"id": job["id"], "status": "failed", "error": error})
+
+    async def _deliver(self, job: Dict[str, Any], body: Dict[str, Any]) -> None:
+        url = job.get("webhook")
+        if not url or self._http is None:
+            return
+        # 提交后主机的解析结果可能已改变：投递前再检查一次
+        problem = await asyncio.to_thread(validate_webhook, url)
+        if problem:
+            self._stats["webhook_failures"] += 1
+            await asyncio.to_thread(self.store.set_webhook_status, job["id"], f"rejected: {problem}")
+            return
+        data = _json.dumps(body, ensure_ascii=False).encode("utf-8")
+        headers = {"Content-Type": "application/json"}
+        if self.webhook_secret:
+            digest = hmac.new(self.webhook_secret.encode("utf-8"), data, hashlib.sha256).hexdigest()
+            headers["X-Iching-Signature"] = f"sha256={digest}"
+        status = "failed"
+        for attempt in range(3):
+            try:
+                resp = await self._http.post(url, content=data, headers=headers)
+                if resp.status_code < 300:
+                    status = "delivered"
+                    break
+                status = f"failed: HTTP {resp.status_code}"
+                if resp.status_code < 500 and resp.status_code != 429:
+                    break
+            except Exception as e:
+                status = f"failed: {type(e).__name__}"
+            if attempt < 2:
+                await asyncio.sleep(2 ** attempt)
+        self._stats["webhooks" if status == "delivered" else "webhook_failures"] += 1
+        await asyncio.to_thread(self.store.set_webhook_status, job["id"], status)
+
+    def stats(self) -> Dict[str, Any]:
+        return dict(self._stats, workers=self.workers, running=len(self._running))
+
+
+_STORE: Optional[JobStore] = None
+_STORE_LOCK = threading.Lock()
+
+
+def job_db_path() -> Path:
+    return Path(os.getenv("AI_JOB_DB", "") or DEFAULT_DB)
+
+
+def get_job_store() -> JobStore:
+    """进程内共享的任务表；AI_JOB_DB（默认 .cache/jobs.sqlite3）/ AI_JOB_TTL（秒，默认 86400）可配置"""
+    global _STORE
+    if _STORE is None:
+        with _STORE_LOCK:
+            if _STORE is None:
+                ttl = float(os.getenv("AI_JOB_TTL", "") or 86400)
+                _STORE = JobStore(str(job_db_path()), ttl)
+    return _STORE
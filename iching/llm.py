@@ -0,0 +1,276 @@
+"""
+上游大模型客户端
+基于 httpx.AsyncClient 的长连接池，限制并发并为每个请求设置总截止时间，
+大量进行中的解读只占用协程而不占用线程池。
+
+通过 SILICONFLOW_BASE_URL 可指向本地模拟上游进行测试。
+"""
+
+from __future__ import annotations
+
+import asyncio
+import json as _json
+import os
+import time
+from typing import Any, AsyncIterator, Awaitable, Dict, Optional, Tuple, TypeVar
+
+from .metrics import UPSTREAM_LATENCY, UPSTREAM_REQUESTS, UPSTREAM_TOKENS, UPSTREAM_TTFT, record_stage
+
+DEFAULT_BASE_URL = "https://api.siliconflow.cn/v1/chat/completions"
+DEFAULT_MODEL = "Qwen/QwQ-32B"
+
+T = TypeVar("T")
+
+
+def _env_int(name: str, default: int) -> int:
+    try:
+        return int(os.getenv(name, "") or default)
+    except ValueError:
+        return default
+
+
+def _env_float(name: str, default: float) -> float:
+    try:
+        return float(os.getenv(name, "") or default)
+    except ValueError:
+        return default
+
+
+def api_key_from_env() -> Optional[str]:
+    return os.getenv("SILICONFLOW_API_KEY") or os.getenv("SILICONFLOW_TOKEN") or os.getenv("SILICONFLOW_KEY")
+
+
+class UpstreamError(Exception):
+    """上游请求失败；status 为上游 HTTP 状态码（网络错误时为 None），retry_after 为上游建议的等待秒数"""
+
+    def __init__(self, message: str, status: Optional[int] = None, retry_after: Optional[float] = None):
+        super().__init__(message)
+        self.status = status
+        self.retry_after = retry_after
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """解析秒数形式的 Retry-After（HTTP 日期形式忽略）"""
+    try:
+        return max(float(value), 0.0) if value else None
+    except ValueError:
+        return None
+
+
+class UpstreamTimeout(UpstreamError):
+    """超过请求截止时间（含排队等待并发名额的时间）"""
+
+
+def _status_label(error: BaseException) -> str:
+    if isinstance(error, UpstreamTimeout):
+        return "timeout"
+    return str(getattr(error, "status", None) or "error")
+
+
+def _record(model: str, mode: str, status: str, started: float) -> None:
+    elapsed = time.perf_counter() - started
+    UPSTREAM_LATENCY.observe(elapsed, model=model, mode=mode, status=status)
+    UPSTREAM_REQUESTS.inc(model=model, mode=mode, status=status)
+    record_stage("upstream", elapsed)
+
+
+def _record_usage(model: str, usage: Any) -> None:
+    if not isinstance(usage, dict):
+        return
+    for kind in ("prompt_tokens", "completion_tokens"):
+        value = usage.get(kind)
+        if isinstance(value, (int, float)) and value > 0:
+            UPSTREAM_TOKENS.inc(value, model=model, kind=kind.split("_")[0])
+
+
+class LLMClient:
+    """共享连接池的异步上游客户端；每次请求记录耗时、状态码与 token 用量指标"""
+
+    def __init__(
+        self,
+        base_url: Optional[str] = None,
+        max_concurrency: Optional[int] = None,
+        max_connections: Optional[int] = None,
+        max_keepalive: Optional[int] = None,
+        timeout: Optional[float] = None,
+        connect_timeout: float = 5.0,
+        transport: Any = None,
+    ):
+        import httpx
+
+        self.base_url = base_url or os.getenv("SILICONFLOW_BASE_URL") or DEFAULT_BASE_URL
+        self.timeout = timeout if timeout is not None else _env_float("AI_TIMEOUT", 60.0)
+        concurrency = max_concurrency or _env_int("AI_MAX_CONCURRENCY", 256)
+        self._slots = asyncio.Semaphore(concurrency)
+        self._client = httpx.AsyncClient(
+            timeout=httpx.Timeout(self.timeout, connect=connect_timeout),
+            limits=httpx.Limits(
+                max_connections=max_connections or _env_int("AI_MAX_CONNECTIONS", concurrency),
+                max_keepalive_connections=max_keepalive or _env_int("AI_MAX_KEEPALIVE", 32),
+                keepalive_expiry=30.0,
+            ),
+            transport=transport,
+        )
+
+    @staticmethod
+    def headers(api_key: str) -> Dict[str, str]:
+        return {"Authorization": f"Bearer {api_key}", "Content-Type": "application/json"}
+
+    async def chat(self, payload: Dict[str, Any], api_key: str, timeout: Optional[float] = None) -> Dict[str, Any]:
+        """发送一次 chat/completions 请求，返回解析后的 JSON"""
+        deadline = timeout if timeout is not None else self.timeout
+        model = str(payload.get("model", ""))
+        started = time.perf_counter()
+        status = "error"
+        try:
+            data = await asyncio.wait_for(self._chat(payload, api_key), deadline)
+            status = "200"
+            _record_usage(model, data.get("usage") if isinstance(data, dict) else None)
+            return data
+        except asyncio.TimeoutError:
+            status = "timeout"
+            raise UpstreamTimeout("AI 服务响应超时，请稍后重试") from None
+        except UpstreamError as e:
+            status = _status_label(e)
+            raise
+        finally:
+            _record(model, "chat", status, started)
+
+    async def _chat(self, payload: Dict[str, Any], api_key: str) -> Dict[str, Any]:
+        import httpx
+
+        async with self._slots:
+            try:
+                resp = await self._client.post(self.base_url, json=payload, headers=self.headers(api_key))
+            except httpx.TimeoutException:
+                raise UpstreamTimeout("AI 服务响应超时，请稍后重试") from None
+            except httpx.HTTPError as e:
+                raise UpstreamError(f"AI 服务请求失败: {e}") from None
+        if resp.status_code >= 400:
+            raise UpstreamError(
+                f"AI 服务请求失败: HTTP {resp.status_code} {resp.text[:200]}",
+                resp.status_code, parse_retry_after(resp.headers.get("retry-after")),
+            )
+        try:
+            return resp.json()
+        except ValueError:
+            raise UpstreamError("AI 服务返回了无法解析的内容", resp.status_code) from None
+
+    async def stream_chat(
+        self, payload: Dict[str, Any], api_key: str, timeout: Optional[float] = None
+    ) -> AsyncIterator[Dict[str, Any]]:
+        """以 stream: true 请求上游，逐个产出解析后的 SSE 数据块；超过截止时间抛出 UpstreamTimeout"""
+        import httpx
+
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + (timeout if timeout is not None else self.timeout)
+        model = str(payload.get("model", ""))
+        started = time.perf_counter()
+        try:
+            await asyncio.wait_for(self._slots.acquire(), max(deadline - loop.time(), 0))
+        except asyncio.TimeoutError:
+            _record(model, "stream", "timeout", started)
+            raise UpstreamTimeout("AI 服务响应超时，请稍后重试") from None
+        status = "closed"  # 调用方提前关闭数据流
+        first = True
+
+        async def within_deadline(aw: Awaitable[T]) -> T:
+            # 等待响应头与每一行都受截止时间约束：上游中途停顿时按时超时，而不是等到 httpx 读超时
+            try:
+                return await asyncio.wait_for(aw, max(deadline - loop.time(), 0))
+            except asyncio.TimeoutError:
+                raise UpstreamTimeout("AI 服务响应超时，请稍后重试") from None
+
+        try:
+            body = dict(payload, stream=True)
+            request = self._client.build_request("POST", self.base_url, json=body, headers=self.headers(api_key))
+            resp = await within_deadline(self._client.send(request, stream=True))
+            try:
+                if resp.status_code >= 400:
+                    text = (await within_deadline(resp.aread())).decode("utf-8", "replace")
+                    raise UpstreamError(
+                        f"AI 服务请求失败: HTTP {resp.status_code} {text[:200]}",
+                        resp.status_code, parse_retry_after(resp.headers.get("retry-after")),
+                    )
+                lines = resp.aiter_lines()
+                while True:
+                    try:
+                        line = await within_deadline(lines.__anext__())
+                    except StopAsyncIteration:
+                        break
+                    if not line.startswith("data:"):
+                        continue
+                    data = line[5:].strip()
+                    if data == "[DONE]":
+                        break
+                    try:
+                        chunk = _json.loads(data)
+                    except ValueError:
+                        continue
+                    if first:
+                        first = False
+                        UPSTREAM_TTFT.observe(time.perf_counter() - started, model=model)
+                    if isinstance(chunk, dict) and chunk.get("usage"):
+                        _record_usage(model, chunk["usage"])
+                    yield chunk
+                status = "200"
+            finally:
+                await resp.aclose()
+        except httpx.TimeoutException:
+            status = "timeout"
+            raise UpstreamTimeout("AI 服务响应超时，请稍后重试") from None
+        except httpx.HTTPError as e:
+            status = "error"
+            raise UpstreamError(f"AI 服务请求失败: {e}") from None
+        except UpstreamError as e:
+            status = _status_label(e)
+            raise
+        finally:
+            self._slots.release()
+            _record(model, "stream", status, started)
+
+    async def warm(self, timeout: float = 3.0) -> bool:
+        """预先建立一条到上游的长连接（发送轻量 HEAD 请求，不关心状态码）；失败返回 False"""
+        try:
+            await asyncio.wait_for(self._client.head(self.base_url), timeout)
+            return True
+        except Exception:
+            return False
+
+    async def aclose(self) -> None:
+        await self._client.aclose()
+
+
+def extract_content(resp_data: Dict[str, Any]) -> Optional[str]:
+    """取出 choices[0].message.content"""
+    try:
+        return resp_data.get("choices", [{}])[0].get("message", {}).get("content")
+    except Exception:
+        return None
+
+
+def extract_delta(chunk: Dict[str, Any]) -> Tuple[str, str]:
+    """取出流式数据块中的 (正文增量, 推理过程增量)"""
+    try:
+        delta = (chunk.get("choices") or [{}])[0].get("delta") or {}
+    except Exception:
+        return "", ""
+    return delta.get("content") or "", delta.get("reasoning_content") or ""
+
+
+_CLIENT: Optional[LLMClient] = None
+
+
+def get_llm_client() -> LLMClient:
+    """进程内共享的上游客户端（需在事件循环内首次调用）"""
+    global _CLIENT
+    if _CLIENT is None:
+        _CLIENT = LLMClient()
+    return _CLIENT
+
+
+async def close_llm_client() -> None:
+    global _CLIENT
+    if _CLIENT is not None:
+        await _CLIENT.aclose()
+        _CLIENT = None
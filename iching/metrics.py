@@ -0,0 +1,276 @@
+"""
+运行指标
+轻量的 Prometheus 文本格式指标（计数器、仪表、直方图），以及按请求收集各阶段耗时的
+Server-Timing 记录器。只依赖标准库，线程安全；瞬时状态（缓存命中率、熔断器等）
+通过采集函数在抓取时读取，不在热路径上重复记账。
+"""
+
+from __future__ import annotations
+
+import contextvars
+import math
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+# 秒；覆盖从亚毫秒的本地接口到数十秒的大模型调用
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+Sample = Tuple[str, Dict[str, str], float]  # (名称后缀, 标签, 值)
+
+
+def _format_value(v: float) -> str:
+    if v == math.inf:
+        return "+Inf"
+    return repr(float(v)) if not float(v).is_integer() else str(int(v))
+
+
+def _escape(v: Any) -> str:
+    return str(v).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(labels: Dict[str, str]) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in labels.items()) + "}"
+
+
+class _Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, doc: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.doc = doc
+        self.labels = tuple(labels)
+        self._lock = threading.Lock()
+
+    @property
+    def exposed_name(self) -> str:
+        return self.name
+
+    def _key(self, labels: Dict[str, Any]) -> Tuple[str, ...]:
+        return tuple(str(labels.get(k, "")) for k in self.labels)
+
+    def samples(self) -> Iterable[Sample]:
+        return ()
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    @property
+    def exposed_name(self) -> str:
+        return self.name + "_total"
+
+    def __init__(self, name: str, doc: str, labels: Sequence[str] = ()):
+        super().__init__(name, doc, labels)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1.0, **labels: Any) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def samples(self) -> Iterable[Sample]:
+        with self._lock:
+            items = list(self._values.items())
+        for key, value in items:
+            yield "_total", dict(zip(self.labels, key)), value
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def __init__(self, name: str, doc: str, labels: Sequence[str] = ()):
+        super().__init__(name, doc, labels)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def set(self, value: float, **labels: Any) -> None:
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def inc(self, amount: float = 1.0, **labels: Any) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def dec(self, amount: float = 1.0, **labels: Any) -> None:
+        self.inc(-amount, **labels)
+
+    def samples(self) -> Iterable[Sample]:
+        with self._lock:
+            items = list(self._values.items())
+        for key, value in items:
+            yield "", dict(zip(self.labels, key)), value
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, doc: str, labels: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, doc, labels)
+        self.buckets = tuple(sorted(buckets))
+        # 标签 -> [各桶计数..., 总和, 次数]
+        self._values: Dict[Tuple[str, ...], List[float]] = {}
+
+    def observe(self, value: float, **labels: Any) -> None:
+        key = self._key(labels)
+        n = len(self.buckets)
+        with self._lock:
+            row = self._values.get(key)
+            if row is None:
+                row = self._values[key] = [0.0] * (n + 2)
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    row[i] += 1
+                    break
+            row[n] += value
+            row[n + 1] += 1
+
+    @contextmanager
+    def time(self, **labels: Any) -> Iterator[None]:
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def samples(self) -> Iterable[Sample]:
+        with self._lock:
+            items = [(k, list(v)) for k, v in self._values.items()]
+        n = len(self.buckets)
+        for key, row in items:
+            labels = dict(zip(self.labels, key))
+            cumulative = 0.0
+            for bound, count in zip(self.buckets, row):
+                cumulative += count
+                yield "_bucket", dict(labels, le=_format_value(bound)), cumulative
+            yield "_bucket", dict(labels, le="+Inf"), row[n + 1]
+            yield "_sum", labels, row[n]
+            yield "_count", labels, row[n + 1]
+
+
+# 采集函数返回 (名称, 类型, 说明, [(标签, 值), ...])
+Collector = Callable[[], Iterable[Tuple[str, str, str, Iterable[Tuple[Dict[str, str], float]]]]]
+
+
+class Registry:
+    def __init__(self) -> None:
+        self._metrics: Dict[str, _Metric] = {}
+        self._collectors: List[Collector] = []
+        self._lock = threading.Lock()
+
+    def _register(self, metric: _Metric) -> Any:
+        with self._lock:
+            existing = self._metrics.get(metric.name)
+            if existing is not None:
+                return existing
+            self._metrics[metric.name] = metric
+            return metric
+
+    def counter(self, name: str, doc: str, labels: Sequence[str] = ()) -> Counter:
+        return self._register(Counter(name, doc, labels))
+
+    def gauge(self, name: str, doc: str, labels: Sequence[str] = ()) -> Gauge:
+        return self._register(Gauge(name, doc, labels))
+
+    def histogram(
+        self, name: str, doc: str, labels: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS
+    ) -> Histogram:
+        return self._register(Histogram(name, doc, labels, buckets))
+
+    def add_collector(self, collector: Collector) -> None:
+        with self._lock:
+            self._collectors.append(collector)
+
+    def render(self) -> str:
+        """Prometheus 文本格式（0.0.4）"""
+        out: List[str] = []
+        with self._lock:
+            metrics = list(self._metrics.values())
+            collectors = list(self._collectors)
+        for m in metrics:
+            out.append(f"# HELP {m.exposed_name} {m.doc}")
+            out.append(f"# TYPE {m.exposed_name} {m.kind}")
+            for suffix, labels, value in m.samples():
+                out.append(f"{m.name}{suffix}{_format_labels(labels)} {_format_value(value)}")
+        for collect in collectors:
+            try:
+                families = list(collect())
+            except Exception:
+                continue
+            for name, kind, doc, samples in families:
+                out.append(f"# HELP {name} {doc}")
+                out.append(f"# TYPE {name} {kind}")
+                for labels, value in samples:
+                    out.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+        return "\n".join(out) + "\n"
+
+
+REGISTRY = Registry()
+
+# 上游指标由 llm.LLMClient 记录
+UPSTREAM_LATENCY = REGISTRY.histogram(
+    "iching_upstream_request_seconds", "上游大模型请求耗时（流式为完整响应耗时）", ("model", "mode", "status")
+)
+UPSTREAM_TTFT = REGISTRY.histogram(
+    "iching_upstream_ttft_seconds", "流式请求的首个数据块耗时", ("model",)
+)
+UPSTREAM_REQUESTS = REGISTRY.counter(
+    "iching_upstream_requests", "上游请求数，status 为 HTTP 状态码或 timeout/error", ("model", "mode", "status")
+)
+UPSTREAM_TOKENS = REGISTRY.counter(
+    "iching_upstream_tokens", "上游报告的 token 用量", ("model", "kind")
+)
+
+# 相似问题缓存：每次查询的最高相似度（由 semantic.SimilarityIndex 记录，用于调阈值）
+SEMANTIC_SIMILARITY = REGISTRY.histogram(
+    "iching_ai_semantic_similarity", "相似问题缓存查询的最高余弦相似度", ("result",),
+    buckets=(0.3, 0.4, 0.5, 0.6, 0.7, 0.75, 0.8, 0.85, 0.9, 0.95, 1.0),
+)
+
+
+# ===================== Server-Timing =====================
+
+_TIMINGS: contextvars.ContextVar[Optional[List[Tuple[str, float]]]] = contextvars.ContextVar(
+    "iching_server_timing", default=None
+)
+
+
+def begin_timing() -> contextvars.Token:
+    """为当前请求开启阶段耗时记录"""
+    return _TIMINGS.set([])
+
+
+def end_timing(token: contextvars.Token) -> List[Tuple[str, float]]:
+    stages = _TIMINGS.get() or []
+    _TIMINGS.reset(token)
+    return stages
+
+
+def current_timings() -> List[Tuple[str, float]]:
+    return list(_TIMINGS.get() or ())
+
+
+def record_stage(name: str, seconds: float) -> None:
+    stages = _TIMINGS.get()
+    if stages is not None:
+        stages.append((name, seconds))
+
+
+@contextmanager
+def stage(name: str) -> Iterator[None]:
+    """记录一个阶段的耗时到当前请求的 Server-Timing"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_stage(name, time.perf_counter() - started)
+
+
+def server_timing_header(stages: Iterable[Tuple[str, float]]) -> str:
+    merged: Dict[str, float] = {}
+    for name, seconds in stages:
+        merged[name] = merged.get(name, 0.0) + seconds
+    return ", ".join(f"{name};dur={seconds * 1000:.2f}" for name, seconds in merged.items())
@@ -0,0 +1,109 @@
+"""
+预序列化响应
+静态卦象数据在启动时一次性编码为 UTF-8 JSON，并预先压缩为 gzip / br 版本
+"""
+
+from __future__ import annotations
+
+import gzip
+import hashlib
+import json as _json
+import threading
+from typing import Any, Dict, NamedTuple, Optional, Tuple
+
+from .store import HexagramStore, get_store
+
+try:  # 可选依赖：未安装时只提供 gzip
+    import brotli as _brotli
+except ImportError:  # pragma: no cover
+    _brotli = None
+
+# 浏览器缓存 1 小时，CDN 缓存 1 年（重新部署时 CDN 缓存会被清空）
+CACHE_CONTROL = "public, max-age=3600, s-maxage=31536000, stale-while-revalidate=86400"
+
+# 小于该长度的响应不值得压缩
+MIN_COMPRESS_SIZE = 256
+
+
+class EncodedPayload(NamedTuple):
+    body: bytes
+    etag: str
+    gzip: Optional[bytes] = None
+    br: Optional[bytes] = None
+
+    def variant(self, encoding: Optional[str]) -> Tuple[bytes, str]:
+        """返回指定编码的响应体与对应 ETag（每种编码使用不同的强 ETag）"""
+        if encoding == "br" and self.br is not None:
+            return self.br, self.etag[:-1] + '-br"'
+        if encoding == "gzip" and self.gzip is not None:
+            return self.gzip, self.etag[:-1] + '-gz"'
+        return self.body, self.etag
+
+
+def encode_payload(obj: Any) -> EncodedPayload:
+    """序列化并压缩一个 JSON 对象"""
+    body = _json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    etag = '"' + hashlib.sha256(body).hexdigest()[:32] + '"'
+    if len(body) < MIN_COMPRESS_SIZE:
+        return EncodedPayload(body, etag)
+    gz = gzip.compress(body, compresslevel=9, mtime=0)
+    br = _brotli.compress(body, quality=11) if _brotli is not None else None
+    return EncodedPayload(body, etag, gz, br)
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """判断 If-None-Match 是否命中（弱比较，支持 * 与多值）"""
+    if not if_none_match:
+        return False
+    base = etag[:-1]
+    variants = ("*", etag, base + '-gz"', base + '-br"')
+    for tag in if_none_match.split(","):
+        tag = tag.strip()
+        if tag.startswith("W/"):
+            tag = tag[2:]
+        if tag in variants:
+            return True
+    return False
+
+
+def pick_encoding(accept_encoding: Optional[str], payload: EncodedPayload) -> Optional[str]:
+    """按 Accept-Encoding（含 q 值）选择最优的可用编码：br > gzip > identity"""
+    if not accept_encoding or payload.gzip is None:
+        return None
+    accepted: Dict[str, float] = {}
+    for part in accept_encoding.lower().split(","):
+        token, _, params = part.strip().partition(";")
+        q = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        accepted[token.strip()] = q
+    wildcard = accepted.get("*", 0.0)
+    for enc in ("br", "gzip"):
+        if enc == "br" and payload.br is None:
+            continue
+        if accepted.get(enc, wildcard) > 0:
+            return enc
+    return None
+
+
+def build_hex_payloads(store: HexagramStore) -> Dict[int, EncodedPayload]:
+    """64 卦完整记录的预编码响应，按序号索引"""
+    return {code: encode_payload(rec) for code, rec in store.records.items()}
+
+
+_HEX_PAYLOADS: Optional[Dict[int, EncodedPayload]] = None
+_HEX_PAYLOADS_LOCK = threading.Lock()
+
+
+def get_hex_payloads() -> Dict[int, EncodedPayload]:
+    """进程内共享的卦象响应缓存（首次调用时构建）"""
+    global _HEX_PAYLOADS
+    if _HEX_PAYLOADS is None:
+        with _HEX_PAYLOADS_LOCK:
+            if _HEX_PAYLOADS is None:
+                _HEX_PAYLOADS = build_hex_payloads(get_store())
+    return _HEX_PAYLOADS
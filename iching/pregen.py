@@ -0,0 +1,377 @@
+"""
+离线预生成解读
+对每个 (本卦, 动爻掩码, 主题) 组合预先生成一份解读，64 × 64 × 主题数条，写入带定长索引的二进制文件；
+「综合运势 / 事业 / 感情 / 财运」这类常见问题直接从磁盘读出，不调用上游。
+
+生成方式：
+    template  由卦象库按主题与变爻确定性拼装（无需网络）
+    llm       逐条调用大模型（SILICONFLOW_BASE_URL 可指向模拟上游），提示词与 /api/ai 相同
+
+文件布局：MAGIC | 元数据长度(u32) | 元数据(JSON：主题、生成方式、模型、卦象库指纹…) | 索引表 | 正文区
+索引表按 (主题, 卦序-1, 掩码) 顺序排列，每项 (偏移 u32, 长度 u32)，长度为 0 表示缺失；
+正文为 zlib 压缩的 UTF-8 文本。查询是一次 unpack_from 加一次解压。
+
+生成按 (主题, 本卦) 切分为任务单元，用进程池并行；每个单元完成后写入独立的分片文件，
+中断后重新运行会跳过已有分片，全部完成后再合并为最终文件。
+元数据记录生成时 iching_basic.json 的指纹，卦象库更新后旧文件不再加载，需重新生成。
+服务只默认加载 llm 方式生成的文件；template 文件是卦辞爻辞的排版而非模型解读，
+须设 PREGEN_SERVE_TEMPLATE=1 才会代替 /api/ai 的结果返回（离线演示、无 API Key 的部署）。
+
+用法：
+    python -m iching.pregen                          # template 方式生成 .cache/interpretations.bin
+    python -m iching.pregen --mode llm --model Qwen/Qwen2.5-7B-Instruct --workers 4
+    python -m iching.pregen bench                    # 查询耗时
+"""
+
+from __future__ import annotations
+
+import hashlib
+import json as _json
+import marshal
+import mmap
+import os
+import struct
+import sys
+import threading
+import time
+import zlib
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from .cache import normalize_question
+
+MAGIC = b"ICHPRE01"
+_U32 = struct.Struct("<I")
+_SLOT = struct.Struct("<II")
+SLOTS_PER_TOPIC = 64 * 64
+
+DEFAULT_PATH = Path(__file__).resolve().parent.parent / ".cache" / "interpretations.bin"
+
+# (主题, 对应 fortune 字段, 视为该主题的规范化问题)
+TOPICS: Tuple[Tuple[str, str, Tuple[str, ...]], ...] = (
+    ("综合运势", "fortune", ("综合运势", "运势", "今天运势如何", "今日运势", "每日一卦", "运势如何")),
+    ("事业", "career", ("事业", "事业发展", "事业运", "工作", "事业如何", "事业运势", "工作运势")),
+    ("感情", "relationship", ("感情", "感情状况", "感情运", "姻缘", "恋爱", "桃花运")),
+    ("财运", "wealth", ("财运", "财运如何", "财运怎么样")),
+)
+TOPIC_NAMES = tuple(name for name, _, _ in TOPICS)
+_TOPIC_BY_QUESTION = {q: i for i, (_, _, qs) in enumerate(TOPICS) for q in qs}
+
+
+def topic_of(question: Optional[str]) -> Optional[int]:
+    """规范化后与主题问句完全一致时返回主题序号；具体问题（如「下周面试能过吗」）返回 None"""
+    return _TOPIC_BY_QUESTION.get(normalize_question(question))
+
+
+def slot_index(topic: int, code: int, mask: int) -> int:
+    return topic * SLOTS_PER_TOPIC + (code - 1) * 64 + (mask & 0b111111)
+
+
+# ===================== 生成 =====================
+
+def render_template(code: int, mask: int, topic: int) -> str:
+    """按主题与变爻由卦象库拼装解读，段落与 AI 解读一致（结论 / 形势分析 / 建议 / 注意事项）"""
+    from .prompts import get_prompt_fragments, select_lines
+    from .relations import changed_code
+    from .store import get_store
+
+    store = get_store()
+    rec = store.get(code) or {}
+    topic_name, field, _ = TOPICS[topic]
+    fortune = rec.get("fortune") if isinstance(rec.get("fortune"), dict) else {}
+    moving = [i for i in range(6) if mask >> i & 1]
+
+    changed_head, picked = select_lines(get_prompt_fragments()[code], code, mask)
+    head = f"{rec.get('name', '')}卦" + (f"，{len(moving)} 爻动" if moving else "，无动爻")
+    lead = fortune.get(field) or fortune.get("fortune") or rec.get("judgement", "")
+    out = [f"**结论**：{head}。就「{topic_name}」而言，{lead}。", "", "**形势分析**"]
+    if rec.get("judgement"):
+        out.append(f"- 卦辞：{rec['judgement']}")
+    if rec.get("image"):
+        out.append(f"- 象曰：{rec['image']}")
+    if picked:
+        label, *texts = picked.splitlines()
+        out.append(f"- {label}")
+        out.extend(f"  - {text}" for text in texts)
+    if moving:
+        rec2 = store.get(changed_code(code, mask)) or {}
+        fortune2 = rec2.get("fortune") if isinstance(rec2.get("fortune"), dict) else {}
+        trend = fortune2.get(field) or rec2.get("judgement", "")
+        if trend:
+            out.append(f"- 变卦「{rec2.get('name', '')}」示后势：{trend}")
+    out += ["", "**建议**"]
+    if fortune.get("advice"):
+        out.append(f"- {fortune['advice']}")
+    if fortune.get("suitable"):
+        out.append("- 宜：" + "、".join(fortune["suitable"]))
+    out += ["", "**注意事项**"]
+    if fortune.get("avoid"):
+        out.append("- 忌：" + "、".join(fortune["avoid"]))
+    out.append("- 卦象提示的是趋势与心态，具体决定仍需结合实际情况。")
+    return "\n".join(out)
+
+
+def _part_path(parts: Path, topic: int, code: int) -> Path:
+    return parts / f"t{topic}_{code:02d}.part"
+
+
+def _write_part(path: Path, entries: Dict[int, bytes]) -> None:
+    tmp = path.with_suffix(".tmp")
+    tmp.write_bytes(marshal.dumps(entries))
+    tmp.replace(path)
+
+
+def _template_unit(parts: str, topic: int, code: int) -> int:
+    entries = {
+        mask: zlib.compress(render_template(code, mask, topic).encode("utf-8"), 9) for mask in range(64)
+    }
+    _write_part(_part_path(Path(parts), topic, code), entries)
+    return len(entries)
+
+
+async def _llm_entries(topic: int, code: int, model: str, concurrency: int) -> Dict[int, bytes]:
+    import asyncio
+
+    from .llm import LLMClient, api_key_from_env, extract_content
+    from .prompts import build_payload, for_model
+    from .resilience import get_resilience
+
+    key = api_key_from_env() or ""
+    client = LLMClient(max_concurrency=concurrency)
+    gate = asyncio.Semaphore(concurrency)
+    question = TOPIC_NAMES[topic]
+    entries: Dict[int, bytes] = {}
+
+    async def one(mask: int) -> None:
+        payload = build_payload({"sequence": code, "bits": mask << 6}, question, model)
+        async with gate:
+            resp, used = await get_resilience().call(
+                model, lambda m, timeout: client.chat(for_model(payload, m), key, timeout), client.timeout
+            )
+        content = extract_content(resp)
+        if content and used == model:
+            entries[mask] = zlib.compress(content.encode("utf-8"), 9)
+
+    try:
+        await asyncio.gather(*(one(mask) for mask in range(64)))
+    finally:
+        await client.aclose()
+    return entries
+
+
+def _llm_unit(parts: str, topic: int, code: int, model: str, concurrency: int) -> int:
+    import asyncio
+
+    entries = asyncio.run(_llm_entries(topic, code, model, concurrency))
+    if len(entries) < 64:
+        # 不完整的单元不落盘，下次运行重试
+        raise RuntimeError(f"主题 {TOPIC_NAMES[topic]} 第 {code} 卦只生成了 {len(entries)}/64 条")
+    _write_part(_part_path(Path(parts), topic, code), entries)
+    return len(entries)
+
+
+def pack(path: Path, parts: Path, meta: Dict[str, Any]) -> Path:
+    """把全部分片合并为带索引的最终文件"""
+    topics = len(meta["topics"])
+    table = bytearray(_SLOT.size * topics * SLOTS_PER_TOPIC)
+    body = bytearray()
+    for topic in range(topics):
+        for code in range(1, 65):
+            part = _part_path(parts, topic, code)
+            if not part.exists():
+                continue
+            for mask, blob in marshal.loads(part.read_bytes()).items():
+                _SLOT.pack_into(table, slot_index(topic, code, mask) * _SLOT.size, len(body), len(blob))
+                body += blob
+    header = _json.dumps(meta, ensure_ascii=False).encode("utf-8")
+    tmp = path.with_suffix(".tmp")
+    tmp.write_bytes(MAGIC + _U32.pack(len(header)) + header + bytes(table) + bytes(body))
+    tmp.replace(path)
+    return path
+
+
+def data_fingerprint() -> Optional[str]:
+    """卦象库 iching_basic.json 的 sha256 前 16 位；文件不存在时返回 None"""
+    from .store import DATA_PATH
+
+    try:
+        return hashlib.sha256(DATA_PATH.read_bytes()).hexdigest()[:16]
+    except OSError:
+        return None
+
+
+def build(
+    path: Path = DEFAULT_PATH,
+    mode: str = "template",
+    model: Optional[str] = None,
+    workers: Optional[int] = None,
+    concurrency: int = 8,
+    resume: bool = True,
+) -> Dict[str, Any]:
+    """生成全部 (主题, 本卦) 单元后合并；resume=True 时跳过已完成的分片"""
+    from concurrent.futures import ProcessPoolExecutor, as_completed
+
+    path = Path(path)
+    parts = path.with_suffix(".parts")
+    parts.mkdir(parents=True, exist_ok=True)
+    meta_file = parts / "meta.json"
+    meta = {
+        "topics": list(TOPIC_NAMES), "mode": mode, "model": model if mode == "llm" else "template",
+        "data": data_fingerprint(),
+    }
+    if meta_file.exists() and _json.loads(meta_file.read_text(encoding="utf-8")) != meta:
+        resume = False  # 生成方式、模型或卦象库变了，旧分片作废
+    if not resume:
+        for old in parts.glob("*.part"):
+            old.unlink()
+    meta_file.write_text(_json.dumps(meta, ensure_ascii=False), encoding="utf-8")
+
+    units = [
+        (topic, code) for topic in range(len(TOPICS)) for code in range(1, 65)
+        if not _part_path(parts, topic, code).exists()
+    ]
+    started = time.perf_counter()
+    errors: List[str] = []
+    with ProcessPoolExecutor(max_workers=workers or os.cpu_count() or 1) as pool:
+        if mode == "llm":
+            futures = [pool.submit(_llm_unit, str(parts), t, c, model, concurrency) for t, c in units]
+        else:
+            futures = [pool.submit(_template_unit, str(parts), t, c) for t, c in units]
+        for future in as_completed(futures):
+            try:
+                future.result()
+            except Exception as e:
+                errors.append(str(e))
+    seconds = time.perf_counter() - started
+    if errors:
+        return {"path": None, "done_units": len(units) - len(errors), "failed_units": len(errors),
+                "errors": errors[:10], "seconds": round(seconds, 2)}
+    pack(path, parts, dict(meta, created=int(time.time())))
+    return {"path": str(path), "bytes": path.stat().st_size, "units": len(units), "seconds": round(seconds, 2)}
+
+
+# ===================== 查询 =====================
+
+class PregeneratedStore:
+    """只读、mmap 映射的预生成解读；线程安全（只读映射）"""
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        with open(self.path, "rb") as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._mm[:len(MAGIC)] != MAGIC:
+            raise ValueError(f"不是预生成解读文件：{self.path}")
+        (header_len,) = _U32.unpack_from(self._mm, len(MAGIC))
+        pos = len(MAGIC) + _U32.size
+        self.meta = _json.loads(bytes(self._mm[pos:pos + header_len]).decode("utf-8"))
+        self.topics: Sequence[str] = tuple(self.meta["topics"])
+        self._table = pos + header_len
+        self._body = self._table + _SLOT.size * len(self.topics) * SLOTS_PER_TOPIC
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, code: int, mask: int, topic: int) -> Optional[str]:
+        if not (1 <= code <= 64 and 0 <= topic < len(self.topics)):
+            self.misses += 1
+            return None
+        offset, length = _SLOT.unpack_from(self._mm, self._table + slot_index(topic, code, mask) * _SLOT.size)
+        if not length:
+            self.misses += 1
+            return None
+        self.hits += 1
+        start = self._body + offset
+        return zlib.decompress(self._mm[start:start + length]).decode("utf-8")
+
+    def lookup(self, code: int, mask: int, question: Optional[str]) -> Optional[str]:
+        """按问题归类主题后查询；问题不属于任何主题时返回 None"""
+        topic = topic_of(question)
+        if topic is None or TOPIC_NAMES[topic] not in self.topics:
+            return None
+        return self.get(code, mask, self.topics.index(TOPIC_NAMES[topic]))
+
+    def serves(self, model: Optional[str]) -> bool:
+        """请求未指定模型，或指定的正是生成该文件所用的模型时才可使用"""
+        return model is None or (self.meta.get("mode") == "llm" and model == self.meta.get("model"))
+
+    def stats(self) -> Dict[str, Any]:
+        return {"path": str(self.path), "mode": self.meta.get("mode"), "model": self.meta.get("model"),
+                "hits": self.hits, "misses": self.misses}
+
+
+def _serve_template() -> bool:
+    return os.getenv("PREGEN_SERVE_TEMPLATE", "").lower() in ("1", "true", "yes")
+
+
+_STORE: Optional[PregeneratedStore] = None
+_STORE_LOADED = False
+_STORE_LOCK = threading.Lock()
+
+
+def get_pregenerated() -> Optional[PregeneratedStore]:
+    """进程内共享的预生成解读；PREGEN_PATH 可指定文件，文件不存在、设为 none 或与当前卦象库不符时返回 None
+
+    template 方式生成的文件只在 PREGEN_SERVE_TEMPLATE=1 时加载。
+    """
+    global _STORE, _STORE_LOADED
+    if not _STORE_LOADED:
+        with _STORE_LOCK:
+            if not _STORE_LOADED:
+                spec = os.getenv("PREGEN_PATH", "") or str(DEFAULT_PATH)
+                if spec.lower() != "none" and Path(spec).exists():
+                    try:
+                        store = PregeneratedStore(Path(spec))
+                        if store.meta.get("data") != data_fingerprint():
+                            raise ValueError(f"{spec} 与当前卦象库不符，请重新运行 python -m iching.pregen build")
+                        if store.meta.get("mode") != "llm" and not _serve_template():
+                            raise ValueError(f"{spec} 为 template 方式生成，设 PREGEN_SERVE_TEMPLATE=1 才会代替模型解读返回")
+                        _STORE = store
+                    except (OSError, ValueError) as e:
+                        print(f"警告：预生成解读不可用：{e}")
+                _STORE_LOADED = True
+    return _STORE
+
+
+def bench(path: Path, rounds: int = 20000) -> Dict[str, Any]:
+    import random
+
+    store = PregeneratedStore(path)
+    rnd = random.Random(0)
+    keys = [(rnd.randint(1, 64), rnd.randrange(64), rnd.randrange(len(store.topics))) for _ in range(rounds)]
+    samples = []
+    for code, mask, topic in keys:
+        t = time.perf_counter_ns()
+        store.get(code, mask, topic)
+        samples.append(time.perf_counter_ns() - t)
+    samples.sort()
+    return {
+        "lookups": rounds,
+        "p50_us": round(samples[rounds // 2] / 1000, 2),
+        "p99_us": round(samples[int(rounds * 0.99)] / 1000, 2),
+        "bytes": path.stat().st_size,
+    }
+
+
+def _main(argv: Iterable[str]) -> None:
+    import argparse
+
+    parser = argparse.ArgumentParser(description="离线预生成卦象解读")
+    parser.add_argument("command", nargs="?", choices=("build", "bench"), default="build")
+    parser.add_argument("--mode", choices=("template", "llm"), default="template")
+    parser.add_argument("--model", default="Qwen/QwQ-32B", help="llm 方式使用的模型")
+    parser.add_argument("--workers", type=int, default=None, help="进程数（默认 CPU 核数）")
+    parser.add_argument("--concurrency", type=int, default=8, help="llm 方式每个进程的并发请求数")
+    parser.add_argument("--out", default=os.getenv("PREGEN_PATH", "") or str(DEFAULT_PATH))
+    parser.add_argument("--no-resume", action="store_true", help="忽略已完成的分片，全部重新生成")
+    args = parser.parse_args(list(argv))
+
+    if args.command == "bench":
+        print(_json.dumps(bench(Path(args.out)), ensure_ascii=False, indent=2))
+        return
+    result = build(Path(args.out), args.mode, args.model, args.workers, args.concurrency, not args.no_resume)
+    print(_json.dumps(result, ensure_ascii=False, indent=2))
+    if result["path"] is None:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    _main(sys.argv[1:])
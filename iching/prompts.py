@@ -0,0 +1,249 @@
+"""
+AI 解读提示词组装
+每卦的上下文片段（卦象、卦辞、象辞、六爻爻辞）由卦象库预先生成一次；请求时只按变爻挑选相关爻辞：
+    无变爻     只看卦辞、象辞
+    一至三爻变 取本卦动爻的爻辞
+    四、五爻变 取之卦不变爻的爻辞
+    六爻皆变   取之卦卦辞
+并估算输入 token 数，超出输入预算时依次舍去象辞、之卦片段并截断问题；
+按模型设置输出上限 max_tokens，系统提示中同步给出篇幅要求，避免回答被截断。
+
+AI_OUTPUT_BUDGETS 按 "模型:token数,模型:token数" 配置各模型输出上限，未列出的模型用 AI_MAX_TOKENS；
+AI_PROMPT_BUDGET 为输入预算。
+"""
+
+from __future__ import annotations
+
+import os
+import threading
+from functools import lru_cache
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
+
+from .core import CODE_TO_PATTERN, HEXAGRAM_NAMES, TRIGRAM_NAMES, TRIGRAM_SYMBOLS
+from .relations import changed_code
+from .store import get_store
+
+DEFAULT_OUTPUT_BUDGETS = "Qwen/QwQ-32B:1536,Qwen/Qwen2.5-7B-Instruct:800"
+DEFAULT_MAX_TOKENS = 1024
+DEFAULT_PROMPT_BUDGET = 1200
+MIN_QUESTION_TOKENS = 64
+
+SYSTEM_PROMPT = (
+    "你是一位严谨且通俗易懂的《周易》分析助手。"
+    "结合用户问题与卦象（卦名、卦辞、象辞、依变爻取用的爻辞），"
+    "给出结构化的中文解读：\n"
+    "- 结论（一句话）\n- 形势分析\n- 建议（行动要点）\n- 注意事项\n"
+    "要求：真实、简洁、避免迷信表达，避免绝对化断语。"
+)
+
+_LINE_POSITIONS = {"初": 0, "二": 1, "三": 2, "四": 3, "五": 4, "上": 5}
+
+
+def estimate_tokens(text: str) -> int:
+    """粗略估算 token 数：汉字与全角标点约 1 token，其余约 4 字节 1 token
+
+    按 UTF-8 字节数推算三字节字符个数，不逐字符遍历。
+    """
+    if not text:
+        return 0
+    n = len(text)
+    wide = (len(text.encode("utf-8")) - n) // 2
+    return wide + (n - wide + 3) // 4
+
+
+def line_index(label: Any) -> Optional[int]:
+    """爻名（初九、六二……上六）-> 爻位 0..5"""
+    label = str(label or "")
+    if label[:1] in ("初", "上"):
+        return _LINE_POSITIONS[label[0]]
+    return _LINE_POSITIONS.get(label[1:2]) if len(label) >= 2 else None
+
+
+def moving_mask(hexagram: Dict[str, Any]) -> int:
+    """由 bits（12 位打包卦象）或 changeList（爻名列表）得到动爻掩码"""
+    bits = hexagram.get("bits")
+    if isinstance(bits, int) and 0 <= bits < 1 << 12:
+        return bits >> 6
+    mask = 0
+    for label in hexagram.get("changeList") or ():
+        i = line_index(label)
+        if i is not None:
+            mask |= 1 << i
+    return mask
+
+
+def hexagram_code(hexagram: Dict[str, Any]) -> Optional[int]:
+    """请求中卦象的卦序（sequence 或 code），无效时返回 None"""
+    for field in ("sequence", "code"):
+        try:
+            code = int(hexagram.get(field))
+        except (TypeError, ValueError):
+            continue
+        if 1 <= code <= 64:
+            return code
+    return None
+
+
+class HexagramFragments(NamedTuple):
+    head: str
+    judgement: str
+    image: str
+    lines: Tuple[str, ...]  # lines[i] 为第 i 爻（0 为初爻）的爻辞，已带爻名
+
+
+def _full_name(code: int) -> str:
+    p = CODE_TO_PATTERN[code]
+    upper, lower = p >> 3, p & 0b111
+    if upper == lower:
+        return f"{TRIGRAM_NAMES[upper]}为{TRIGRAM_SYMBOLS[upper]}"
+    return f"{TRIGRAM_SYMBOLS[upper]}{TRIGRAM_SYMBOLS[lower]}{HEXAGRAM_NAMES[code - 1]}"
+
+
+def _fragments(code: int, rec: Dict[str, Any]) -> HexagramFragments:
+    lines = tuple(str(x) for x in (rec.get("lines") or ())[:6])
+    return HexagramFragments(
+        head=f"卦象：{HEXAGRAM_NAMES[code - 1]}（序号 {code}，{_full_name(code)}）",
+        judgement=f"卦辞：{rec.get('judgement', '')}",
+        image=f"象曰：{rec.get('image', '')}",
+        lines=lines + ("",) * (6 - len(lines)),
+    )
+
+
+_FRAGMENTS: Optional[Tuple[Optional[HexagramFragments], ...]] = None
+_FRAGMENTS_LOCK = threading.Lock()
+
+
+def get_prompt_fragments() -> Tuple[Optional[HexagramFragments], ...]:
+    """按卦序索引的预生成片段（下标 0 不用）"""
+    global _FRAGMENTS
+    if _FRAGMENTS is None:
+        with _FRAGMENTS_LOCK:
+            if _FRAGMENTS is None:
+                store = get_store()
+                frags: List[Optional[HexagramFragments]] = [None] * 65
+                for code in range(1, 65):
+                    rec = store.get(code)
+                    if rec:
+                        frags[code] = _fragments(code, rec)
+                _FRAGMENTS = tuple(frags)
+    return _FRAGMENTS
+
+
+def _request_fragments(hexagram: Dict[str, Any]) -> HexagramFragments:
+    """卦序未知时退回请求中携带的卦象字段"""
+    raw = [str(x) for x in (hexagram.get("lines") or ())][:6]
+    lines = tuple(raw) + ("",) * (6 - len(raw))
+    return HexagramFragments(
+        head=f"卦象：{hexagram.get('name', '')}（{hexagram.get('fullName', '')}）",
+        judgement=f"卦辞：{hexagram.get('judgement', '')}",
+        image=f"象曰：{hexagram.get('image', '')}",
+        lines=lines,
+    )
+
+
+def select_lines(frags: HexagramFragments, code: Optional[int], mask: int) -> Tuple[str, str]:
+    """按变爻数选取爻辞，返回 (本卦以外的之卦片段, 取用的爻辞文本)"""
+    moving = [i for i in range(6) if mask >> i & 1]
+    if not moving:
+        return "", ""
+    if len(moving) <= 3 or code is None:
+        picked = [frags.lines[i] for i in moving if frags.lines[i]]
+        return "", ("爻辞（动爻）：\n" + "\n".join(picked)) if picked else ""
+    target = changed_code(code, mask)
+    other = get_prompt_fragments()[target]
+    if other is None:
+        return "", ""
+    head = other.head.replace("卦象：", "之卦：", 1)
+    if len(moving) == 6:
+        return head, "之" + other.judgement
+    static = [other.lines[i] for i in range(6) if not mask >> i & 1 and other.lines[i]]
+    return head, "爻辞（之卦不变爻）：\n" + "\n".join(static)
+
+
+def _truncate(text: str, tokens: int) -> str:
+    if estimate_tokens(text) <= tokens:
+        return text
+    # 估算以汉字为主：逐步缩短到预算内
+    cut = max(1, tokens)
+    while cut > 1 and estimate_tokens(text[:cut]) > tokens:
+        cut = cut * 3 // 4
+    return text[:cut] + "…"
+
+
+def build_messages(
+    hexagram: Dict[str, Any], question: str, max_tokens: int, prompt_budget: Optional[int] = None
+) -> Tuple[List[Dict[str, str]], int]:
+    """组装 messages，返回 (messages, 估算输入 token 数)"""
+    hexagram = hexagram or {}
+    budget = prompt_budget or _env_int("AI_PROMPT_BUDGET", DEFAULT_PROMPT_BUDGET)
+    code = hexagram_code(hexagram)
+    frags = get_prompt_fragments()[code] if code else None
+    if frags is None:
+        code, frags = None, _request_fragments(hexagram)
+    mask = moving_mask(hexagram)
+    changed_head, picked = select_lines(frags, code, mask)
+
+    labels = "、".join(str(x) for x in (hexagram.get("changeList") or ())) or ("有" if mask else "无")
+    system = system_prompt(max_tokens)
+    parts = [frags.head, f"变爻：{labels}", frags.judgement, changed_head, picked, frags.image]
+    parts = [p for p in parts if p]
+    fixed = estimate_tokens(system) + sum(estimate_tokens(p) for p in parts)
+    # 超出预算时依次舍去象辞、之卦片段
+    for optional in (frags.image, changed_head):
+        if fixed + MIN_QUESTION_TOKENS <= budget:
+            break
+        if optional in parts:
+            parts.remove(optional)
+            fixed -= estimate_tokens(optional)
+    question = _truncate(str(question or ""), max(MIN_QUESTION_TOKENS, budget - fixed))
+    user = f"问题：{question}\n" + "\n".join(parts)
+    messages = [{"role": "system", "content": system}, {"role": "user", "content": user}]
+    return messages, estimate_tokens(system) + estimate_tokens(user)
+
+
+@lru_cache(maxsize=32)
+def system_prompt(max_tokens: int) -> str:
+    """带篇幅要求的系统提示；按输出上限缓存"""
+    chars = max(100, int(max_tokens * 0.6) // 50 * 50)
+    return f"{SYSTEM_PROMPT}\n篇幅：全文不超过约 {chars} 字，写完注意事项即结束。"
+
+
+def _env_int(name: str, default: int) -> int:
+    try:
+        return int(os.getenv(name, "") or default)
+    except ValueError:
+        return default
+
+
+@lru_cache(maxsize=8)
+def parse_budgets(spec: str) -> Dict[str, int]:
+    """解析 "模型:token数,模型:token数" 形式的输出上限配置"""
+    budgets: Dict[str, int] = {}
+    for item in (spec or "").split(","):
+        name, _, value = item.strip().rpartition(":")
+        try:
+            if name:
+                budgets[name] = int(value)
+        except ValueError:
+            continue
+    return budgets
+
+
+def output_budget(model: str) -> int:
+    budgets = parse_budgets(os.getenv("AI_OUTPUT_BUDGETS", DEFAULT_OUTPUT_BUDGETS))
+    return budgets.get(model) or _env_int("AI_MAX_TOKENS", DEFAULT_MAX_TOKENS)
+
+
+def build_payload(hexagram: Dict[str, Any], question: str, model: str, temperature: float = 0.7) -> Dict[str, Any]:
+    """上游 chat/completions 请求体；回退到其他模型时用 for_model 换模型与输出上限"""
+    max_tokens = output_budget(model)
+    messages, _ = build_messages(hexagram, question, max_tokens)
+    return {"model": model, "messages": messages, "temperature": temperature, "max_tokens": max_tokens}
+
+
+def for_model(payload: Dict[str, Any], model: str) -> Dict[str, Any]:
+    if model == payload.get("model"):
+        return payload
+    max_tokens = output_budget(model)
+    messages = [dict(payload["messages"][0], content=system_prompt(max_tokens))] + payload["messages"][1:]
+    return dict(payload, model=model, max_tokens=max_tokens, messages=messages)
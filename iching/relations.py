@@ -0,0 +1,80 @@
+"""
+卦象关系图
+由六爻位型预先计算 64 卦的互卦、综卦、错卦、交卦与六个单爻变邻卦，按卦序 O(1) 查询。
+
+命名约定：inverse 为综卦（六爻上下颠倒），complement 为错卦（六爻阴阳全变），
+swapped 为交卦（上下卦互换），nuclear 为互卦（二至四爻为下卦、三至五爻为上卦）。
+注意数据文件 relations 字段的 inverse/complement 分别对应这里的错卦与交卦。
+"""
+
+from __future__ import annotations
+
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
+
+from .core import CODE_TO_PATTERN, HEXAGRAM_NAMES, INVERSE_PATTERN, NUCLEAR_PATTERN, PATTERN_TO_CODE
+
+
+class HexagramRelations(NamedTuple):
+    code: int
+    nuclear: int
+    inverse: int
+    complement: int
+    swapped: int
+    neighbors: Tuple[int, ...]  # neighbors[i]：只变第 i 爻（0 为初爻）得到的卦序
+
+
+def _build(code: int) -> HexagramRelations:
+    p = CODE_TO_PATTERN[code]
+    return HexagramRelations(
+        code=code,
+        nuclear=PATTERN_TO_CODE[NUCLEAR_PATTERN[p]],
+        inverse=PATTERN_TO_CODE[INVERSE_PATTERN[p]],
+        complement=PATTERN_TO_CODE[p ^ 0b111111],
+        swapped=PATTERN_TO_CODE[((p & 0b111) << 3) | (p >> 3)],
+        neighbors=tuple(PATTERN_TO_CODE[p ^ (1 << i)] for i in range(6)),
+    )
+
+
+# 卦序 -> 关系（下标 0 不用）
+RELATIONS: Tuple[Optional[HexagramRelations], ...] = (None,) + tuple(_build(code) for code in range(1, 65))
+
+
+def relations_of(code: Any) -> Optional[HexagramRelations]:
+    try:
+        code = int(code)
+    except (TypeError, ValueError):
+        return None
+    return RELATIONS[code] if 1 <= code <= 64 else None
+
+
+def changed_code(code: int, moving_mask: int) -> int:
+    """本卦卦序与动爻掩码 -> 变卦卦序"""
+    return PATTERN_TO_CODE[CODE_TO_PATTERN[code] ^ (moving_mask & 0b111111)]
+
+
+def _ref(code: int) -> Dict[str, Any]:
+    return {"code": code, "name": HEXAGRAM_NAMES[code - 1]}
+
+
+def _to_dict(rel: HexagramRelations) -> Dict[str, Any]:
+    return {
+        **_ref(rel.code),
+        "nuclear": _ref(rel.nuclear),
+        "inverse": _ref(rel.inverse),
+        "complement": _ref(rel.complement),
+        "swapped": _ref(rel.swapped),
+        "neighbors": [dict(_ref(c), line=i) for i, c in enumerate(rel.neighbors)],
+    }
+
+
+# 接口直接返回的 JSON 结构，启动时生成一次
+RELATION_GRAPH: Tuple[Dict[str, Any], ...] = tuple(_to_dict(rel) for rel in RELATIONS[1:])
+
+
+def relation_graph() -> List[Dict[str, Any]]:
+    return list(RELATION_GRAPH)
+
+
+def relation_dict(code: Any) -> Optional[Dict[str, Any]]:
+    rel = relations_of(code)
+    return RELATION_GRAPH[rel.code - 1] if rel else None
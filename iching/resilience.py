@@ -0,0 +1,373 @@
+"""
+上游容错
+429/5xx 与网络错误按指数退避（全抖动）重试，重试次数受全局重试预算约束；
+每个模型一个熔断器，连续失败后快速失败；按顺序回退到备用模型，
+每个模型有自己的延迟目标，超时即换下一个模型而不是原地重试；
+总截止时间较短时，当前模型的尝试会为下一个回退模型留出其延迟目标。
+
+AI_MODEL_FALLBACKS 配置回退顺序与延迟目标（秒），例如：
+    Qwen/QwQ-32B:45,Qwen/Qwen2.5-7B-Instruct:15
+设为 none 关闭回退。
+"""
+
+from __future__ import annotations
+
+import asyncio
+import math
+import os
+import random
+import threading
+import time
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, NamedTuple, Optional, Tuple, TypeVar
+
+from .llm import UpstreamError, UpstreamTimeout
+
+T = TypeVar("T")
+
+DEFAULT_FALLBACKS = "Qwen/QwQ-32B:45,Qwen/Qwen2.5-7B-Instruct:15"
+RETRYABLE_STATUS = frozenset({429, 500, 502, 503, 504})
+
+
+class CircuitOpen(UpstreamError):
+    """所有候选模型的熔断器均处于打开状态"""
+
+
+class ModelTarget(NamedTuple):
+    model: str
+    timeout: Optional[float]  # 单次尝试的延迟目标；None 表示只受总截止时间约束
+
+
+def parse_fallbacks(spec: Optional[str]) -> List[ModelTarget]:
+    """解析 "模型:秒,模型:秒" 形式的回退配置"""
+    if not spec or spec.strip().lower() == "none":
+        return []
+    targets = []
+    for item in spec.split(","):
+        item = item.strip()
+        if not item:
+            continue
+        name, _, secs = item.rpartition(":")
+        try:
+            targets.append(ModelTarget(name, float(secs)) if name else ModelTarget(item, None))
+        except ValueError:
+            targets.append(ModelTarget(item, None))
+    return targets
+
+
+def is_retryable(error: UpstreamError) -> bool:
+    return error.status is None or error.status in RETRYABLE_STATUS
+
+
+class RetryPolicy:
+    """指数退避 + 全抖动；上游给出 Retry-After 时以其为下限"""
+
+    def __init__(self, max_attempts: int = 3, base_delay: float = 0.5, max_delay: float = 8.0):
+        self.max_attempts = max(1, max_attempts)
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    def backoff(self, attempt: int, retry_after: Optional[float] = None) -> float:
+        delay = random.uniform(0, min(self.max_delay, self.base_delay * (2 ** attempt)))
+        if retry_after:
+            delay = max(delay, min(retry_after, self.max_delay))
+        return delay
+
+
+class RetryBudget:
+    """重试预算：每个请求存入 ratio 个令牌，每次重试取出 1 个，避免故障时重试放大流量"""
+
+    def __init__(self, ratio: float = 0.2, reserve: float = 10.0, cap: float = 100.0):
+        self.ratio = ratio
+        self.cap = cap
+        self._tokens = reserve
+        self._lock = threading.Lock()
+
+    def deposit(self) -> None:
+        with self._lock:
+            self._tokens = min(self.cap, self._tokens + self.ratio)
+
+    def withdraw(self) -> bool:
+        with self._lock:
+            if self._tokens >= 1.0:
+                self._tokens -= 1.0
+                return True
+            return False
+
+    @property
+    def tokens(self) -> float:
+        return self._tokens
+
+
+class CircuitBreaker:
+    """closed -> 连续失败达到阈值 -> open -> 冷却后 half_open 放行一个探测请求"""
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = "closed"
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self.state == "closed":
+                return True
+            if self.state == "open" and time.monotonic() - self._opened_at >= self.reset_timeout:
+                self.state = "half_open"
+                self._probing = False
+            if self.state == "half_open" and not self._probing:
+                self._probing = True
+                return True
+            return False
+
+    def record_success(self) -> None:
+        with self._lock:
+            self.state = "closed"
+            self._failures = 0
+            self._probing = False
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self._failures += 1
+            if self.state == "half_open" or self._failures >= self.failure_threshold:
+                self.state = "open"
+                self._opened_at = time.monotonic()
+                self._probing = False
+
+    def release(self) -> None:
+        """尝试没有说明上游是否可用（如 4xx 请求错误）：归还探测名额，状态不变"""
+        with self._lock:
+            self._probing = False
+
+    def abandon(self) -> None:
+        """尝试未得出结果（截止时间耗尽、被取消或非上游异常）：半开探测按失败处理，重新冷却；closed 状态不计数"""
+        with self._lock:
+            if self.state == "half_open":
+                self.state = "open"
+                self._opened_at = time.monotonic()
+            self._probing = False
+
+
+class Resilience:
+    """组合重试、预算、熔断与模型回退"""
+
+    def __init__(
+        self,
+        fallbacks: Optional[List[ModelTarget]] = None,
+        policy: Optional[RetryPolicy] = None,
+        budget: Optional[RetryBudget] = None,
+        failure_threshold: int = 5,
+        reset_timeout: float = 30.0,
+    ):
+        self.fallbacks = list(fallbacks or [])
+        self.policy = policy or RetryPolicy()
+        self.budget = budget or RetryBudget()
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._breakers: Dict[str, CircuitBreaker] = {}
+        self._lock = threading.Lock()
+        self._stats = {"calls": 0, "retries": 0, "fallbacks": 0, "short_circuited": 0, "failures": 0}
+
+    def breaker(self, model: str) -> CircuitBreaker:
+        with self._lock:
+            b = self._breakers.get(model)
+            if b is None:
+                b = self._breakers[model] = CircuitBreaker(self.failure_threshold, self.reset_timeout)
+            return b
+
+    def plan(self, model: str) -> List[ModelTarget]:
+        """请求的模型优先，其后为其余回退模型"""
+        own = next((t for t in self.fallbacks if t.model == model), ModelTarget(model, None))
+        return [own] + [t for t in self.fallbacks if t.model != model]
+
+    def _attempt_timeout(self, target: ModelTarget, remaining: float, reserve: float = 0.0) -> float:
+        """单次尝试的超时：不超过延迟目标，并为下一个回退模型留出 reserve 秒（至少保留一半给当前模型）"""
+        budget = max(remaining - reserve, remaining / 2) if reserve else remaining
+        return min(target.timeout, budget) if target.timeout else budget
+
+    def _after_failure(self, target: ModelTarget, error: UpstreamError, attempt: int, remaining: float) -> Optional[float]:
+        """记录一次失败；返回重试前的等待秒数，None 表示换下一个模型"""
+        if not is_retryable(error):
+            self.breaker(target.model).release()  # 请求本身有误，不说明上游是否恢复
+            raise error
+        breaker = self.breaker(target.model)
+        breaker.record_failure()
+        if isinstance(error, UpstreamTimeout) or breaker.state == "open":
+            return None  # 超出该模型的延迟目标或已熔断：直接回退
+        if attempt + 1 >= self.policy.max_attempts or not self.budget.withdraw():
+            return None
+        delay = self.policy.backoff(attempt, getattr(error, "retry_after", None))
+        if delay >= remaining:
+            return None
+        self._stats["retries"] += 1
+        return delay
+
+    def _candidates(self, model: str, remaining: Callable[[], float]):
+        """依次产出 (目标, 为后续模型预留的秒数)；截止时间已到时不再占用熔断器的探测名额"""
+        tried = False
+        plan = self.plan(model)
+        for i, target in enumerate(plan):
+            if remaining() <= 0:
+                return
+            if not self.breaker(target.model).allow():
+                self._stats["short_circuited"] += 1
+                continue
+            if tried:
+                self._stats["fallbacks"] += 1
+            tried = True
+            nxt = plan[i + 1] if i + 1 < len(plan) else None
+            yield target, 0.0 if nxt is None else (nxt.timeout or math.inf)
+
+    def _give_up(self, last_error: Optional[UpstreamError], timed_out: bool = False) -> UpstreamError:
+        self._stats["failures"] += 1
+        if timed_out:
+            return UpstreamTimeout("AI 服务响应超时，请稍后重试")
+        if last_error is None:
+            return CircuitOpen("AI 服务暂不可用，请稍后重试", 503)
+        return last_error
+
+    async def call(
+        self, model: str, fn: Callable[[str, float], Awaitable[T]], timeout: float
+    ) -> Tuple[T, str]:
+        """fn(模型, 本次超时) -> 结果；返回 (结果, 实际使用的模型)"""
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        self._stats["calls"] += 1
+        self.budget.deposit()
+        last_error: Optional[UpstreamError] = None
+        for target, reserve in self._candidates(model, lambda: deadline - loop.time()):
+            breaker = self.breaker(target.model)
+            settled = False  # 本模型的尝试结果是否已计入熔断器
+            try:
+                for attempt in range(self.policy.max_attempts):
+                    remaining = deadline - loop.time()
+                    if remaining <= 0:
+                        raise self._give_up(last_error, timed_out=True)
+                    try:
+                        result = await fn(target.model, self._attempt_timeout(target, remaining, reserve))
+                    except UpstreamError as e:
+                        last_error = e
+                        settled = True
+                        delay = self._after_failure(target, e, attempt, deadline - loop.time())
+                        if delay is None:
+                            break
+                        await asyncio.sleep(delay)
+                    else:
+                        breaker.record_success()
+                        settled = True
+                        return result, target.model
+            finally:
+                if not settled:
+                    breaker.abandon()
+        raise self._give_up(last_error, timed_out=deadline - loop.time() <= 0)
+
+    async def stream(
+        self, model: str, open_stream: Callable[[str, float], AsyncIterator[T]], timeout: float
+    ) -> AsyncIterator[Tuple[T, str]]:
+        """流式版本：只在收到首个数据块之前重试/回退；产出 (数据块, 实际使用的模型)"""
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        self._stats["calls"] += 1
+        self.budget.deposit()
+        last_error: Optional[UpstreamError] = None
+        for target, reserve in self._candidates(model, lambda: deadline - loop.time()):
+            breaker = self.breaker(target.model)
+            settled = False
+            try:
+                for attempt in range(self.policy.max_attempts):
+                    remaining = deadline - loop.time()
+                    if remaining <= 0:
+                        raise self._give_up(last_error, timed_out=True)
+                    chunks = open_stream(target.model, remaining)
+                    try:
+                        first = await asyncio.wait_for(
+                            chunks.__anext__(), self._attempt_timeout(target, remaining, reserve)
+                        )
+                    except StopAsyncIteration:
+                        breaker.record_success()
+                        settled = True
+                        return
+                    except (UpstreamError, asyncio.TimeoutError) as e:
+                        await chunks.aclose()
+                        if isinstance(e, asyncio.TimeoutError):
+                            e = UpstreamTimeout("AI 服务响应超时，请稍后重试")
+                        last_error = e
+                        settled = True
+                        delay = self._after_failure(target, e, attempt, deadline - loop.time())
+                        if delay is None:
+                            break
+                        await asyncio.sleep(delay)
+                        continue
+                    breaker.record_success()
+                    settled = True
+                    yield first, target.model
+                    async for chunk in chunks:
+                        yield chunk, target.model
+                    return
+            finally:
+                if not settled:
+                    breaker.abandon()
+        raise self._give_up(last_error, timed_out=deadline - loop.time() <= 0)
+
+    def call_sync(self, model: str, fn: Callable[[str, float], T], timeout: float) -> Tuple[T, str]:
+        """同步版本，供 Vercel 无服务器函数使用"""
+        deadline = time.monotonic() + timeout
+        self._stats["calls"] += 1
+        self.budget.deposit()
+        last_error: Optional[UpstreamError] = None
+        for target, reserve in self._candidates(model, lambda: deadline - time.monotonic()):
+            breaker = self.breaker(target.model)
+            settled = False
+            try:
+                for attempt in range(self.policy.max_attempts):
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        raise self._give_up(last_error, timed_out=True)
+                    try:
+                        result = fn(target.model, self._attempt_timeout(target, remaining, reserve))
+                    except UpstreamError as e:
+                        last_error = e
+                        settled = True
+                        delay = self._after_failure(target, e, attempt, deadline - time.monotonic())
+                        if delay is None:
+                            break
+                        time.sleep(delay)
+                    else:
+                        breaker.record_success()
+                        settled = True
+                        return result, target.model
+            finally:
+                if not settled:
+                    breaker.abandon()
+        raise self._give_up(last_error, timed_out=deadline - time.monotonic() <= 0)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            breakers = {m: b.state for m, b in self._breakers.items()}
+        return dict(self._stats, retry_tokens=round(self.budget.tokens, 2), breakers=breakers)
+
+
+def _env(name: str, default: str) -> str:
+    value = os.getenv(name)
+    return default if value is None else value
+
+
+_RESILIENCE: Optional[Resilience] = None
+_RESILIENCE_LOCK = threading.Lock()
+
+
+def get_resilience() -> Resilience:
+    """进程内共享的容错策略；AI_MODEL_FALLBACKS / AI_RETRY_ATTEMPTS / AI_BREAKER_THRESHOLD / AI_BREAKER_RESET 可配置"""
+    global _RESILIENCE
+    if _RESILIENCE is None:
+        with _RESILIENCE_LOCK:
+            if _RESILIENCE is None:
+                _RESILIENCE = Resilience(
+                    fallbacks=parse_fallbacks(_env("AI_MODEL_FALLBACKS", DEFAULT_FALLBACKS)),
+                    policy=RetryPolicy(max_attempts=int(_env("AI_RETRY_ATTEMPTS", "3") or 3)),
+                    failure_threshold=int(_env("AI_BREAKER_THRESHOLD", "5") or 5),
+                    reset_timeout=float(_env("AI_BREAKER_RESET", "30") or 30),
+                )
+    return _RESILIENCE
@@ -0,0 +1,208 @@
+"""
+卦象全文检索
+启动时由卦象库建立字符二元组（bigram）倒排索引，适合不分词的中文；
+检索卦辞、象辞、爻辞、别名、标签、宜忌与现代应用，按覆盖度与 TF-IDF 排序并返回高亮片段。
+"""
+
+from __future__ import annotations
+
+import html
+import math
+import threading
+import unicodedata
+from typing import Any, Dict, Iterator, List, Mapping, NamedTuple, Optional, Tuple
+
+from .store import HexagramStore, get_store
+
+# (字段前缀, 标签, 权重)
+_FIELDS = (
+    ("name", "卦名", 3.0),
+    ("alias", "别名", 2.5),
+    ("tags", "标签", 2.0),
+    ("judgement", "卦辞", 2.0),
+    ("image", "象辞", 1.5),
+    ("lines", "爻辞", 1.5),
+    ("fortune.suitable", "宜", 1.0),
+    ("fortune.avoid", "忌", 1.0),
+    ("modern_applications", "现代应用", 1.0),
+)
+
+SNIPPET_RADIUS = 24
+MAX_LIMIT = 64
+
+
+def fold(text: str) -> str:
+    """逐字符 NFKC + 小写；保持长度不变，使索引位置与原文一一对应"""
+    out = []
+    for ch in text:
+        f = unicodedata.normalize("NFKC", ch).lower()
+        out.append(f if len(f) == 1 else ch)
+    return "".join(out)
+
+
+def tokenize(folded: str, unigrams: bool = False) -> Iterator[str]:
+    """按非字母数字字符切分后产出相邻二元组；单字片段产出单字，unigrams=True 时额外产出所有单字"""
+    run: List[str] = []
+    for ch in folded + " ":
+        if ch.isalnum():
+            run.append(ch)
+            continue
+        if unigrams or len(run) == 1:
+            yield from run
+        for i in range(len(run) - 1):
+            yield run[i] + run[i + 1]
+        run = []
+
+
+class _Field(NamedTuple):
+    code: int
+    key: str
+    label: str
+    weight: float
+    text: str
+    folded: str
+
+
+def _iter_fields(code: int, rec: Mapping[str, Any]) -> Iterator[_Field]:
+    for key, label, weight in _FIELDS:
+        head, _, sub = key.partition(".")
+        value = rec.get(head)
+        if sub and isinstance(value, dict):
+            value = value.get(sub)
+        if not value:
+            continue
+        if isinstance(value, str):
+            yield _Field(code, key, label, weight, value, fold(value))
+        elif isinstance(value, dict):
+            for k, v in value.items():
+                if isinstance(v, str) and v:
+                    yield _Field(code, f"{key}.{k}", label, weight, v, fold(v))
+        elif key == "lines":
+            for i, v in enumerate(value):
+                text = v if isinstance(v, str) else v.get("text") if isinstance(v, dict) else None
+                if text:
+                    yield _Field(code, f"lines.{i}", label, weight, text, fold(text))
+        else:
+            text = "、".join(str(v) for v in value if v)
+            if text:
+                yield _Field(code, key, label, weight, text, fold(text))
+
+
+def _highlight(text: str, folded: str, terms: Tuple[str, ...], radius: int = SNIPPET_RADIUS) -> str:
+    """截取首个命中附近的片段，命中的字符用 <mark> 包裹（其余内容已做 HTML 转义）"""
+    marked = [False] * len(text)
+    for term in terms:
+        start = folded.find(term)
+        while start >= 0:
+            for i in range(start, start + len(term)):
+                marked[i] = True
+            start = folded.find(term, start + 1)
+    first = marked.index(True) if True in marked else 0
+    lo = max(0, first - radius)
+    hi = min(len(text), first + radius * 2)
+    parts = ["…" if lo > 0 else ""]
+    i = lo
+    while i < hi:
+        j = i
+        while j < hi and marked[j] == marked[i]:
+            j += 1
+        chunk = html.escape(text[i:j])
+        parts.append(f"<mark>{chunk}</mark>" if marked[i] else chunk)
+        i = j
+    parts.append("…" if hi < len(text) else "")
+    return "".join(parts)
+
+
+class SearchIndex:
+    """只读倒排索引：词项（二元组与单字）-> ((字段序号, 词频), ...)"""
+
+    __slots__ = ("_fields", "_postings", "_idf", "_names")
+
+    def __init__(self, store: HexagramStore):
+        fields: List[_Field] = []
+        postings: Dict[str, Dict[int, int]] = {}
+        for code, rec in store.records.items():
+            for field in _iter_fields(code, rec):
+                fid = len(fields)
+                fields.append(field)
+                for token in tokenize(field.folded, unigrams=True):
+                    tf = postings.setdefault(token, {})
+                    tf[fid] = tf.get(fid, 0) + 1
+        docs = len(store) or 1
+        self._fields = tuple(fields)
+        self._postings = {t: tuple(tf.items()) for t, tf in postings.items()}
+        # 按卦计算 IDF：出现在越少卦中的词项越有区分度
+        self._idf = {
+            t: math.log(1 + docs / len({fields[fid].code for fid, _ in p})) for t, p in self._postings.items()
+        }
+        self._names = {code: rec.get("name", "") for code, rec in store.records.items()}
+
+    def __len__(self) -> int:
+        return len(self._postings)
+
+    def search(self, query: str, limit: int = 10, snippets: int = 3) -> Dict[str, Any]:
+        """返回 {"query", "terms", "total", "results"}；结果按命中词项数、得分降序"""
+        folded = fold((query or "").strip())
+        terms = tuple(dict.fromkeys(tokenize(folded)))
+        if not terms:
+            return {"query": query, "terms": 0, "total": 0, "results": []}
+
+        scores: Dict[int, float] = {}
+        covered: Dict[int, set] = {}
+        hits: Dict[int, Dict[int, float]] = {}
+        for term in terms:
+            idf = self._idf.get(term)
+            if idf is None:
+                continue
+            for fid, tf in self._postings[term]:
+                field = self._fields[fid]
+                s = idf * field.weight * (1.0 + math.log(tf))
+                scores[field.code] = scores.get(field.code, 0.0) + s
+                covered.setdefault(field.code, set()).add(term)
+                by_field = hits.setdefault(field.code, {})
+                by_field[fid] = by_field.get(fid, 0.0) + s
+
+        # 整句出现在字段中时额外加分
+        phrase = folded if len(terms) > 1 else ""
+        if phrase:
+            for code, by_field in hits.items():
+                for fid in by_field:
+                    if phrase in self._fields[fid].folded:
+                        bonus = self._fields[fid].weight * len(terms)
+                        by_field[fid] += bonus
+                        scores[code] += bonus
+
+        ranked = sorted(scores, key=lambda c: (-len(covered[c]), -scores[c], c))
+        limit = max(1, min(int(limit), MAX_LIMIT))
+        results = []
+        for code in ranked[:limit]:
+            best = sorted(hits[code].items(), key=lambda x: -x[1])[:snippets]
+            results.append({
+                "code": code,
+                "name": self._names.get(code, ""),
+                "score": round(scores[code], 4),
+                "matched": len(covered[code]),
+                "matches": [
+                    {
+                        "field": self._fields[fid].key,
+                        "label": self._fields[fid].label,
+                        "snippet": _highlight(self._fields[fid].text, self._fields[fid].folded, terms),
+                    }
+                    for fid, _ in best
+                ],
+            })
+        return {"query": query, "terms": len(terms), "total": len(ranked), "results": results}
+
+
+_INDEX: Optional[SearchIndex] = None
+_INDEX_LOCK = threading.Lock()
+
+
+def get_search_index() -> SearchIndex:
+    """进程内共享的检索索引（首次调用时由卦象库建立）"""
+    global _INDEX
+    if _INDEX is None:
+        with _INDEX_LOCK:
+            if _INDEX is None:
+                _INDEX = SearchIndex(get_store())
+    return _INDEX
@@ -0,0 +1,221 @@
+"""
+问题语义归一与相似问题缓存
+精确缓存键只认规范化后完全相同的问题，「我的事业怎么样」与「事业运势如何」因此各调一次上游。
+这里先把问题归一为规范问句：去掉「我的」「怎么样」「运势」等不影响解读的虚词，
+同义词换成主题词（工作/职场 → 事业，恋爱/姻缘 → 感情……）；再以字符一元、二元组的词频向量计算余弦相似度。
+
+SimilarityIndex 按「卦象 + 动爻 + 模型」分组记录已缓存问题的向量（动爻与提示词一样由 bits 或 changeList 得出），新问题未精确命中时，
+在同组内找最相似的一条，达到阈值即复用其缓存的解读。两个问题归入同一主题（事业、感情、财运、学业、健康）时
+用较低的 AI_SEMANTIC_TOPIC_THRESHOLD，其余用 AI_SEMANTIC_THRESHOLD；主题不同的问题从不互相复用。
+字面相近但意思相反或指向不同时间的问题（「能成功吗」/「不能成功吗」、「2024年」/「2025年」）
+还要求数字与否定词（不、没、未、否、别）完全一致才复用。
+纯 CPU、无外部依赖；索引只在进程内，多 worker 时各进程各自积累（解读本身仍在共享缓存层）。
+"""
+
+from __future__ import annotations
+
+import hashlib
+import json as _json
+import math
+import os
+import re
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+from .cache import DEFAULT_QUESTION, canonical_hexagram, normalize_question
+from .metrics import SEMANTIC_SIMILARITY
+
+DEFAULT_THRESHOLD = 0.85
+DEFAULT_TOPIC_THRESHOLD = 0.75
+
+TOPIC_WORDS = ("事业", "感情", "财运", "学业", "健康")
+
+# 主题词 -> 同义词（按长度从长到短匹配，避免「桃花运」先被「桃花」截断）
+_SYNONYMS = {
+    "事业": ("事业运", "工作运", "职业发展", "职场", "职业", "工作", "仕途", "前途", "升职", "求职"),
+    "感情": ("感情运", "桃花运", "爱情", "恋爱", "姻缘", "婚姻", "桃花", "对象", "另一半"),
+    "财运": ("财富", "钱财", "收入", "赚钱", "偏财", "正财", "理财", "投资"),
+    "学业": ("学习", "考试", "考研", "升学", "读书"),
+    "健康": ("身体", "病情"),
+}
+# 不影响解读的虚词
+_FILLERS = (
+    "请帮我看看", "帮我看看", "请问", "看一下", "看看",
+    "这段时间", "接下来", "最近", "近期", "今天", "今日", "今年",
+    "我的", "我",
+    "怎么样", "好不好", "会怎样", "如何", "怎样", "咋样",
+    "运势", "运气", "的", "吗", "呢", "吧", "啊", "呀",
+)
+
+_FILLER_PATTERN = re.compile("|".join(re.escape(w) for w in sorted(_FILLERS, key=len, reverse=True)))
+_SYNONYM = {w: topic for topic, words in _SYNONYMS.items() for w in words}
+_SYNONYM_PATTERN = re.compile("|".join(re.escape(w) for w in sorted(_SYNONYM, key=len, reverse=True)))
+
+_GUARD_PATTERN = re.compile(r"\d+|[零〇一二三四五六七八九十百千万两]+|[不没未否别]")
+
+Vector = Dict[str, float]
+Guard = Tuple[str, ...]
+
+
+def canonical_question(question: Optional[str]) -> str:
+    """规范问句：去掉虚词、同义词归为主题词；只剩空串时视为「综合运势」"""
+    text = normalize_question(question)
+    if text == DEFAULT_QUESTION:
+        return text
+    # 先去虚词再换同义词：「事业运势」去掉「运势」后为「事业」，不会被「事业运」截成「事业势」
+    text = _FILLER_PATTERN.sub("", text)
+    return _SYNONYM_PATTERN.sub(lambda m: _SYNONYM[m.group(0)], text) or DEFAULT_QUESTION
+
+
+def topic_of(canonical: str) -> Optional[str]:
+    """规范问句所属主题；综合运势单列，涉及多个主题或无主题词时返回 None"""
+    if canonical == DEFAULT_QUESTION:
+        return canonical
+    found = [t for t in TOPIC_WORDS if t in canonical]
+    return found[0] if len(found) == 1 else None
+
+
+def guard_tokens(canonical: str) -> Guard:
+    """数字与否定词序列：两问题的这部分不同则不论相似度多高都不复用"""
+    return tuple(_GUARD_PATTERN.findall(canonical))
+
+
+def vectorize(canonical: str) -> Vector:
+    """字符一元、二元组词频向量（已 L2 归一化）"""
+    counts: Dict[str, float] = {}
+    for gram in list(canonical) + [canonical[i:i + 2] for i in range(len(canonical) - 1)]:
+        counts[gram] = counts.get(gram, 0.0) + 1.0
+    norm = math.sqrt(sum(v * v for v in counts.values())) or 1.0
+    return {g: v / norm for g, v in counts.items()}
+
+
+def cosine(a: Vector, b: Vector) -> float:
+    if len(a) > len(b):
+        a, b = b, a
+    return sum(v * b.get(g, 0.0) for g, v in a.items())
+
+
+def similarity_group(hexagram: Dict[str, Any], model: str) -> str:
+    """分组键：与解读缓存键相同的卦象字段与动爻（掩码及变爻名），加上模型，不含问题
+
+    只填 bits 的请求也按动爻分组，动爻不同的卦不会互相复用解读。
+    """
+    hx, moving = canonical_hexagram(hexagram or {})
+    raw = _json.dumps({"h": hx, "m": moving, "model": model}, ensure_ascii=False, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class SimilarityIndex:
+    """按组保存已缓存问题的向量（线程安全）；组数超过 max_groups 时淘汰最久未访问的组"""
+
+    def __init__(
+        self,
+        threshold: float = DEFAULT_THRESHOLD,
+        topic_threshold: float = DEFAULT_TOPIC_THRESHOLD,
+        max_groups: int = 4096,
+        per_group: int = 16,
+    ):
+        self.threshold = threshold
+        self.topic_threshold = topic_threshold
+        self.max_groups = max_groups
+        self.per_group = per_group
+        # 组键 -> [(规范问句, 主题, 数字与否定词, 向量, 缓存键)]
+        self._groups: "OrderedDict[str, list[Tuple[str, Optional[str], Guard, Vector, str]]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {"lookups": 0, "hits": 0, "misses": 0, "near_misses": 0, "stale": 0, "added": 0}
+
+    def add(self, group: str, question: Optional[str], cache_key: str) -> None:
+        canonical = canonical_question(question)
+        with self._lock:
+            entries = self._groups.get(group)
+            if entries is None:
+                entries = self._groups[group] = []
+                if len(self._groups) > self.max_groups:
+                    self._groups.popitem(last=False)
+            else:
+                self._groups.move_to_end(group)
+            if any(e[4] == cache_key or e[0] == canonical for e in entries):
+                return
+            entries.append((canonical, topic_of(canonical), guard_tokens(canonical), vectorize(canonical), cache_key))
+            if len(entries) > self.per_group:
+                del entries[0]
+            self._stats["added"] += 1
+
+    def match(self, group: str, question: Optional[str]) -> Tuple[Optional[str], float]:
+        """同组内最相似且达到阈值的缓存键；返回 (缓存键或 None, 最高相似度)"""
+        canonical = canonical_question(question)
+        topic = topic_of(canonical)
+        guard = guard_tokens(canonical)
+        vec = vectorize(canonical)
+        hit_key, best, margin = None, None, -1.0
+        with self._lock:
+            self._stats["lookups"] += 1
+            for other, other_topic, other_guard, other_vec, key in self._groups.get(group, ()):
+                if (topic and other_topic and topic != other_topic) or guard != other_guard:
+                    continue
+                score = 1.0 if other == canonical else cosine(vec, other_vec)
+                needed = self.topic_threshold if topic and topic == other_topic else self.threshold
+                # 按超出各自阈值的幅度挑选，同主题候选与一般候选可以比较
+                if score - needed > margin:
+                    margin = score - needed
+                    best = score
+                    if margin >= 0:
+                        hit_key = key
+            if hit_key is not None:
+                self._stats["hits"] += 1
+            else:
+                self._stats["misses"] += 1
+                if best is not None and margin >= -0.1:
+                    self._stats["near_misses"] += 1  # 差一点达到阈值：调阈值时参考
+        if best is not None:
+            SEMANTIC_SIMILARITY.observe(best, result="hit" if hit_key else "miss")
+        return hit_key, best or 0.0
+
+    def forget(self, group: str, cache_key: str) -> None:
+        """命中的缓存条目已过期或被淘汰时移除"""
+        with self._lock:
+            entries = self._groups.get(group)
+            if entries:
+                entries[:] = [e for e in entries if e[4] != cache_key]
+            self._stats["stale"] += 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            s = dict(self._stats)
+            s["groups"] = len(self._groups)
+        s["hit_ratio"] = round(s["hits"] / s["lookups"], 4) if s["lookups"] else 0.0
+        s["threshold"] = self.threshold
+        s["topic_threshold"] = self.topic_threshold
+        return s
+
+
+def _env_float(name: str, default: float) -> float:
+    try:
+        return float(os.getenv(name, "") or default)
+    except ValueError:
+        return default
+
+
+_INDEX: Optional[SimilarityIndex] = None
+_INDEX_LOADED = False
+_INDEX_LOCK = threading.Lock()
+
+
+def get_similarity_index() -> Optional[SimilarityIndex]:
+    """进程内共享的相似问题索引；AI_SEMANTIC_THRESHOLD 设为 none 时关闭（返回 None）
+
+    AI_SEMANTIC_THRESHOLD / AI_SEMANTIC_TOPIC_THRESHOLD 为余弦相似度阈值，AI_SEMANTIC_SIZE 为最多记录的卦象组数。
+    """
+    global _INDEX, _INDEX_LOADED
+    if not _INDEX_LOADED:
+        with _INDEX_LOCK:
+            if not _INDEX_LOADED:
+                if os.getenv("AI_SEMANTIC_THRESHOLD", "").strip().lower() != "none":
+                    _INDEX = SimilarityIndex(
+                        threshold=_env_float("AI_SEMANTIC_THRESHOLD", DEFAULT_THRESHOLD),
+                        topic_threshold=_env_float("AI_SEMANTIC_TOPIC_THRESHOLD", DEFAULT_TOPIC_THRESHOLD),
+                        max_groups=int(_env_float("AI_SEMANTIC_SIZE", 4096)),
+                    )
+                _INDEX_LOADED = True
+    return _INDEX
@@ -0,0 +1,73 @@
+"""
+前端数据分片
+把 64 卦数据拆成按卦序号的精简分片（文件名带内容哈希，可长期缓存），
+并生成一个很小的 manifest.json 供前端按需拉取。
+
+用法：python -m iching.shards [输出目录]
+"""
+
+from __future__ import annotations
+
+import hashlib
+import json as _json
+import sys
+from pathlib import Path
+from typing import Any, Dict
+
+from .store import HexagramStore, get_store
+
+SHARD_DIR = Path(__file__).resolve().parent.parent / "static" / "hex"
+MANIFEST_NAME = "manifest.json"
+
+
+def slim_record(rec: Dict[str, Any]) -> Dict[str, Any]:
+    """只保留前端结果页渲染所需字段"""
+    fe = rec.get("five_elements_enhanced") or {}
+    fortune = rec.get("fortune") or {}
+    return {
+        "id": rec.get("id"),
+        "name": rec.get("name", ""),
+        "judgement": rec.get("judgement", ""),
+        "image": rec.get("image", ""),
+        "lines": rec.get("lines") or [],
+        "alias": rec.get("alias") or [],
+        "five_elements_enhanced": {"primary_element": fe.get("primary_element", "")},
+        "fortune": {
+            "overall": fortune.get("overall", ""),
+            "fortune": fortune.get("fortune", ""),
+            "advice": fortune.get("advice", ""),
+        },
+    }
+
+
+def _dump(obj: Any) -> bytes:
+    return _json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def build_shards(store: HexagramStore, out_dir: Path = SHARD_DIR) -> Dict[str, Any]:
+    """写出分片与 manifest，清理旧哈希的分片；返回 manifest 内容"""
+    out_dir.mkdir(parents=True, exist_ok=True)
+    shards: Dict[str, str] = {}
+    version = hashlib.sha256()
+    for code, rec in store.records.items():
+        body = _dump(slim_record(rec))
+        digest = hashlib.sha256(body).hexdigest()[:10]
+        filename = f"{code}.{digest}.json"
+        (out_dir / filename).write_bytes(body)
+        shards[str(code)] = filename
+        version.update(digest.encode("ascii"))
+
+    keep = set(shards.values())
+    for stale in out_dir.glob("*.*.json"):
+        if stale.name not in keep:
+            stale.unlink()
+
+    manifest = {"version": version.hexdigest()[:10], "shards": shards}
+    (out_dir / MANIFEST_NAME).write_bytes(_dump(manifest))
+    return manifest
+
+
+if __name__ == "__main__":
+    target = Path(sys.argv[1]) if len(sys.argv) > 1 else SHARD_DIR
+    result = build_shards(get_store(), target)
+    print(f"已生成 {len(result['shards'])} 个分片 -> {target}（version {result['version']}）")
@@ -0,0 +1,138 @@
+"""
+请求合并（single-flight）
+相同键的并发请求只触发一次上游调用，其余请求挂靠在进行中的调用上共享结果或数据流。
+上游调用运行在独立任务中，发起者断开连接不会中断其他等待者。
+"""
+
+from __future__ import annotations
+
+import asyncio
+import threading
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional, Tuple, TypeVar
+
+T = TypeVar("T")
+
+
+def _consume_exception(task: "asyncio.Future[Any]") -> None:
+    # 所有等待者都已离开时，避免出现 "exception was never retrieved" 警告
+    if not task.cancelled():
+        task.exception()
+
+
+class _Broadcast:
+    """把一个异步数据源广播给多个订阅者：已产出的数据块会先回放给后加入的订阅者"""
+
+    def __init__(self, source: AsyncIterator[Any]):
+        self.items: List[Any] = []
+        self.done = False
+        self.error: Optional[BaseException] = None
+        self._changed = asyncio.Condition()
+        self.task = asyncio.ensure_future(self._pump(source))
+
+    async def _pump(self, source: AsyncIterator[Any]) -> None:
+        try:
+            async for item in source:
+                self.items.append(item)
+                async with self._changed:
+                    self._changed.notify_all()
+        except Exception as e:
+            self.error = e
+        finally:
+            self.done = True
+            async with self._changed:
+                self._changed.notify_all()
+
+    async def subscribe(self) -> AsyncIterator[Any]:
+        i = 0
+        while True:
+            while i < len(self.items):
+                yield self.items[i]
+                i += 1
+            if self.done:
+                if self.error is not None:
+                    raise self.error
+                return
+            async with self._changed:
+                if i == len(self.items) and not self.done:
+                    await self._changed.wait()
+
+
+class SingleFlight:
+    """异步单飞：do() 合并一次性调用，stream() 合并流式调用"""
+
+    def __init__(self) -> None:
+        self._calls: Dict[str, "asyncio.Future[Any]"] = {}
+        self._streams: Dict[str, _Broadcast] = {}
+        self._stats = {"leaders": 0, "shared": 0}
+
+    async def do(self, key: str, fn: Callable[[], Awaitable[T]]) -> Tuple[T, bool]:
+        """返回 (结果, 是否共享了他人发起的调用)"""
+        task = self._calls.get(key)
+        shared = task is not None
+        if task is None:
+            task = asyncio.ensure_future(fn())
+            task.add_done_callback(_consume_exception)
+            task.add_done_callback(lambda _t: self._calls.pop(key, None))
+            self._calls[key] = task
+            self._stats["leaders"] += 1
+        else:
+            self._stats["shared"] += 1
+        return await asyncio.shield(task), shared
+
+    def stream(self, key: str, factory: Callable[[], AsyncIterator[Any]]) -> Tuple[AsyncIterator[Any], bool]:
+        """返回 (数据块迭代器, 是否共享了他人发起的数据流)"""
+        broadcast = self._streams.get(key)
+        shared = broadcast is not None
+        if broadcast is None:
+            broadcast = _Broadcast(factory())
+            broadcast.task.add_done_callback(lambda _t: self._streams.pop(key, None))
+            self._streams[key] = broadcast
+            self._stats["leaders"] += 1
+        else:
+            self._stats["shared"] += 1
+        return broadcast.subscribe(), shared
+
+    def streaming(self, key: str) -> bool:
+        """是否已有同键的流式调用可挂靠"""
+        return key in self._streams
+
+    def stats(self) -> Dict[str, int]:
+        return dict(self._stats, in_flight=len(self._calls) + len(self._streams))
+
+
+class _Call:
+    __slots__ = ("event", "result", "error")
+
+    def __init__(self) -> None:
+        self.event = threading.Event()
+        self.result: Any = None
+        self.error: Optional[BaseException] = None
+
+
+class SyncSingleFlight:
+    """线程版单飞，供同步的 BaseHTTPRequestHandler 使用"""
+
+    def __init__(self) -> None:
+        self._calls: Dict[str, _Call] = {}
+        self._lock = threading.Lock()
+
+    def do(self, key: str, fn: Callable[[], T]) -> Tuple[T, bool]:
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+        if not leader:
+            call.event.wait()
+        else:
+            try:
+                call.result = fn()
+            except BaseException as e:
+                call.error = e
+            finally:
+                with self._lock:
+                    self._calls.pop(key, None)
+                call.event.set()
+        if call.error is not None:
+            raise call.error
+        return call.result, not leader
@@ -0,0 +1,231 @@
+"""
+数据快照
+构建时把 iching_basic.json 编译为二进制快照，冷启动时免去整份 JSON 解析：
+文件头只含建立索引所需的字段（卦名、别名、拼音、上下卦）与每卦的偏移量，
+完整记录按卦单独 marshal，首次访问某一卦时才解码。
+
+文件布局：MAGIC | 头长度(u32 小端) | 头(marshal) | 各卦记录(marshal)
+头中记录源 JSON 的长度与 CRC32 及 marshal 格式版本，源文件改动或解释器的
+marshal 版本不同时快照自动失效并回退到 JSON。
+选用 marshal 而非 pickle：解码略快，且是内置模块，冷启动无需额外导入。
+
+用法：
+    python -m iching.snapshot            # 生成 data/iching_basic.snapshot
+    python -m iching.snapshot bench      # 比较各加载方式的耗时（JSON 输出）
+"""
+
+from __future__ import annotations
+
+import json as _json
+import marshal
+import struct
+import sys
+import time
+import zlib
+from collections.abc import Mapping
+from pathlib import Path
+from typing import Any, Dict, Iterator, Optional, Tuple
+
+MAGIC = b"ICHSNAP1"
+_HEADER_LEN = struct.Struct("<I")
+
+# HexagramStore 建立索引用到的字段
+_INDEX_FIELDS = ("id", "name", "alias", "pinyin")
+
+
+def snapshot_path(source: Path) -> Path:
+    return source.with_suffix(".snapshot")
+
+
+def _skeleton(rec: Dict[str, Any]) -> Dict[str, Any]:
+    tri = rec.get("trigrams") or {}
+    out = {k: rec[k] for k in _INDEX_FIELDS if k in rec}
+    out["trigrams"] = {"upper": tri.get("upper", ""), "lower": tri.get("lower", "")}
+    return out
+
+
+def _fingerprint(raw: bytes) -> Tuple[int, int]:
+    # 只用于判断快照是否过期，CRC32 足够且无需导入 hashlib
+    return len(raw), zlib.crc32(raw)
+
+
+def build_snapshot(source: Path, target: Optional[Path] = None) -> Path:
+    """由 JSON 生成快照文件，返回快照路径"""
+    raw_bytes = source.read_bytes()
+    raw = _json.loads(raw_bytes.decode("utf-8"))
+    body = bytearray()
+    offsets: Dict[str, Tuple[int, int]] = {}
+    index: Dict[str, Dict[str, Any]] = {}
+    for key, rec in raw.items():
+        blob = marshal.dumps(rec)
+        offsets[key] = (len(body), len(blob))
+        index[key] = _skeleton(rec)
+        body += blob
+    header = marshal.dumps(
+        {"marshal": marshal.version, "source": _fingerprint(raw_bytes), "index": index, "offsets": offsets}
+    )
+    target = target or snapshot_path(source)
+    tmp = target.with_suffix(".tmp")
+    tmp.write_bytes(MAGIC + _HEADER_LEN.pack(len(header)) + header + bytes(body))
+    tmp.replace(target)
+    return target
+
+
+class LazyRecords(Mapping):
+    """按卦序惰性解码的只读记录表；解码结果缓存在进程内"""
+
+    __slots__ = ("_buf", "_offsets", "_decoded")
+
+    def __init__(self, buf: memoryview, offsets: Dict[int, Tuple[int, int]]):
+        self._buf = buf
+        self._offsets = offsets
+        self._decoded: Dict[int, Dict[str, Any]] = {}
+
+    def __getitem__(self, code: int) -> Dict[str, Any]:
+        rec = self._decoded.get(code)
+        if rec is None:
+            start, length = self._offsets[code]
+            rec = self._decoded[code] = marshal.loads(self._buf[start:start + length])
+        return rec
+
+    def __iter__(self) -> Iterator[int]:
+        return iter(self._offsets)
+
+    def __len__(self) -> int:
+        return len(self._offsets)
+
+    def __contains__(self, code: object) -> bool:
+        return code in self._offsets
+
+
+def read_snapshot(
+    path: Path, source: Optional[Path] = None
+) -> Optional[Tuple[Dict[str, Dict[str, Any]], LazyRecords]]:
+    """读取快照，返回 (索引字段, 惰性记录表)；快照缺失、损坏或已过期时返回 None"""
+    try:
+        data = path.read_bytes()
+    except OSError:
+        return None
+    if not data.startswith(MAGIC):
+        return None
+    try:
+        pos = len(MAGIC)
+        (header_len,) = _HEADER_LEN.unpack_from(data, pos)
+        pos += _HEADER_LEN.size
+        header = marshal.loads(data[pos:pos + header_len])
+    except Exception:
+        return None
+    if header.get("marshal") != marshal.version:
+        return None
+    if source is not None and source.exists():
+        if _fingerprint(source.read_bytes()) != tuple(header.get("source") or ()):
+            return None
+    body = memoryview(data)[pos + header_len:]
+    index = header["index"]
+    offsets: Dict[int, Tuple[int, int]] = {}
+    for key, span in header["offsets"].items():
+        try:
+            offsets[int(index[key].get("id") or key)] = span
+        except (TypeError, ValueError):
+            continue
+    return index, LazyRecords(body, dict(sorted(offsets.items())))
+
+
+def _timeit(fn, repeat: int) -> Dict[str, float]:
+    samples = []
+    for _ in range(repeat):
+        t = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - t) * 1000)
+    samples.sort()
+
+    def pct(p: float) -> float:
+        return round(samples[min(len(samples) - 1, int(p * len(samples)))], 3)
+
+    return {"p50_ms": pct(0.50), "p95_ms": pct(0.95), "p99_ms": pct(0.99)}
+
+
+_COLD_SCRIPT = """
+import sys, time
+t = time.perf_counter()
+from iching.store import HexagramStore
+from pathlib import Path
+HexagramStore.load(Path(sys.argv[1]), use_snapshot=sys.argv[2] == "1").get(1)
+print((time.perf_counter() - t) * 1000)
+"""
+
+
+def _cold(source: Path, use_snapshot: bool, runs: int) -> Dict[str, float]:
+    """在全新进程中计时：导入 iching.store、加载数据并取一卦"""
+    import subprocess
+
+    root = str(Path(__file__).resolve().parent.parent)
+    samples = []
+    for _ in range(runs):
+        out = subprocess.check_output(
+            [sys.executable, "-c", _COLD_SCRIPT, str(source), "1" if use_snapshot else "0"], cwd=root
+        )
+        samples.append(float(out))
+    samples.sort()
+    return {
+        "p50_ms": round(samples[len(samples) // 2], 3),
+        "p99_ms": round(samples[min(len(samples) - 1, int(0.99 * len(samples)))], 3),
+        "max_ms": round(samples[-1], 3),
+    }
+
+
+def bench(source: Path, repeat: int = 200, cold_runs: int = 30) -> Dict[str, Any]:
+    """比较整份 JSON、整份 pickle 与快照（仅索引 / 索引 + 单卦 / 全部解码）的加载耗时，
+    以及全新进程中导入并加载数据的冷启动耗时"""
+    from .store import HexagramStore
+
+    snap = snapshot_path(source)
+    if not snap.exists():
+        build_snapshot(source)
+    import pickle
+
+    whole = pickle.dumps(_json.loads(source.read_text(encoding="utf-8")), protocol=5)
+
+    def json_store() -> None:
+        HexagramStore.load(source, use_snapshot=False)
+
+    def snapshot_store() -> None:
+        HexagramStore.load(source)
+
+    def snapshot_one() -> None:
+        HexagramStore.load(source).get(1)
+
+    def snapshot_all() -> None:
+        store = HexagramStore.load(source)
+        for code in store:
+            store.get(code)
+
+    results = {
+        "json.load": _timeit(lambda: _json.loads(source.read_text(encoding="utf-8")), repeat),
+        "pickle.loads(whole)": _timeit(lambda: pickle.loads(whole), repeat),
+        "store(json)": _timeit(json_store, repeat),
+        "store(snapshot)": _timeit(snapshot_store, repeat),
+        "store(snapshot)+get(1)": _timeit(snapshot_one, repeat),
+        "store(snapshot)+get(all)": _timeit(snapshot_all, repeat),
+    }
+    return {
+        "python": sys.version.split()[0],
+        "repeat": repeat,
+        "source_bytes": source.stat().st_size,
+        "snapshot_bytes": snap.stat().st_size,
+        "results": results,
+        "cold_process": {
+            "json": _cold(source, False, cold_runs),
+            "snapshot": _cold(source, True, cold_runs),
+        },
+    }
+
+
+if __name__ == "__main__":
+    from .store import DATA_PATH
+
+    if len(sys.argv) > 1 and sys.argv[1] == "bench":
+        print(_json.dumps(bench(DATA_PATH), ensure_ascii=False, indent=2))
+    else:
+        out = build_snapshot(DATA_PATH, Path(sys.argv[1]) if len(sys.argv) > 1 else None)
+        print(f"已生成快照 -> {out}（{out.stat().st_size} 字节）")
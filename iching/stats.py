@@ -0,0 +1,151 @@
+"""
+占卜统计
+所有用户的起卦记录追加写入定长二进制日志，每条 8 字节：时间戳(u32) | 打包卦象(u16) | 来源(u8) | 填充。
+计数器随日志增量维护：总数、按日直方图、按卦计数（附带按计数有序的排名表）、动爻数与各爻动的分布，
+查询只读计数器，总数与当日为 O(1)，前 k 卦为 O(k)，按日直方图为 O(天数)，从不回扫历史。
+
+多 worker 部署时各进程共用同一日志文件：小于 PIPE_BUF 的 O_APPEND 写入是原子的，
+每次读写前先从上次读到的偏移处补读其他进程追加的记录，各进程的计数因此保持一致。
+"""
+
+from __future__ import annotations
+
+import os
+import struct
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+from .core import HEXAGRAM_NAMES, PATTERN_TO_CODE
+
+RECORD = struct.Struct("<IHBx")
+DAY = 86400
+
+# 来源标记：前端起卦 / 其他调用方（都经由服务端 /api/divine/coin）
+SOURCE_WEB = 0
+SOURCE_API = 1
+
+DEFAULT_LOG = Path(__file__).resolve().parent.parent / ".cache" / "readings.log"
+
+
+class ReadingStats:
+    """追加式起卦日志与增量计数器（线程安全；日期按 UTC 计）"""
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT | os.O_APPEND, 0o644)
+        self._lock = threading.Lock()
+        self._offset = 0
+        self.total = 0
+        self._days: Dict[int, int] = {}
+        self._codes = [0] * 65  # 下标 0 不用
+        self._moving_count = [0] * 7
+        self._moving_line = [0] * 6
+        # 按计数降序的卦序排名；_first[c] 为计数为 c 的一段在 _rank 中的起点，计数 +1 时与段首交换即可 O(1) 维持有序
+        self._rank = list(range(1, 65))
+        self._pos = {code: i for i, code in enumerate(self._rank)}
+        self._first: Dict[int, int] = {0: 0}
+        with self._lock:
+            self._catch_up()
+
+    def close(self) -> None:
+        os.close(self._fd)
+
+    def _bump(self, code: int) -> None:
+        c = self._codes[code]
+        i, j = self._pos[code], self._first[c]
+        other = self._rank[j]
+        self._rank[i], self._rank[j] = other, code
+        self._pos[other], self._pos[code] = i, j
+        self._codes[code] = c + 1
+        if j + 1 < 64 and self._codes[self._rank[j + 1]] == c:
+            self._first[c] = j + 1
+        else:
+            del self._first[c]
+        self._first.setdefault(c + 1, j)
+
+    def _apply(self, ts: int, bits: int) -> None:
+        self.total += 1
+        day = ts // DAY
+        self._days[day] = self._days.get(day, 0) + 1
+        self._bump(PATTERN_TO_CODE[bits & 0b111111])
+        mask = (bits >> 6) & 0b111111
+        self._moving_count[bin(mask).count("1")] += 1
+        for i in range(6):
+            if mask >> i & 1:
+                self._moving_line[i] += 1
+
+    def _catch_up(self) -> None:
+        """补读日志中尚未计入的完整记录（含其他进程追加的）"""
+        size = os.fstat(self._fd).st_size
+        usable = size - (size - self._offset) % RECORD.size
+        if usable <= self._offset:
+            return
+        data = os.pread(self._fd, usable - self._offset, self._offset)
+        for ts, bits, _source in RECORD.iter_unpack(data):
+            self._apply(ts, bits)
+        self._offset = usable
+
+    def record(self, bits: int, source: int = SOURCE_WEB, ts: Optional[float] = None) -> None:
+        """追加一条起卦记录；bits 为 iching.core.Reading 的 12 位打包值"""
+        if not 0 <= bits < 1 << 12:
+            raise ValueError("bits 须为 0–4095 的 12 位打包卦象")
+        rec = RECORD.pack(int(time.time() if ts is None else ts), bits, source)
+        with self._lock:
+            os.write(self._fd, rec)
+            self._catch_up()
+
+    # ---- 查询 ----
+
+    def summary(self, k: int = 1) -> Dict[str, Any]:
+        with self._lock:
+            self._catch_up()
+            return {
+                "total": self.total,
+                "today": self._days.get(int(time.time()) // DAY, 0),
+                "top": self._top(k),
+            }
+
+    def daily(self, days: int = 30) -> List[Dict[str, Any]]:
+        """最近 days 天（含今天）的每日次数，按日期升序"""
+        today = int(time.time()) // DAY
+        with self._lock:
+            self._catch_up()
+            counts = [(d, self._days.get(d, 0)) for d in range(today - days + 1, today + 1)]
+        return [{"date": time.strftime("%Y-%m-%d", time.gmtime(d * DAY)), "count": n} for d, n in counts]
+
+    def _top(self, k: int) -> List[Dict[str, Any]]:
+        out = []
+        for code in self._rank[:k]:
+            count = self._codes[code]
+            if not count:
+                break
+            out.append({"code": code, "name": HEXAGRAM_NAMES[code - 1], "count": count})
+        return out
+
+    def top(self, k: int = 10) -> List[Dict[str, Any]]:
+        with self._lock:
+            self._catch_up()
+            return self._top(k)
+
+    def moving(self) -> Dict[str, Any]:
+        """动爻分布：by_count[n] 为恰有 n 个动爻的次数，by_line[i] 为第 i 爻（0 为初爻）动的次数"""
+        with self._lock:
+            self._catch_up()
+            return {"total": self.total, "by_count": list(self._moving_count), "by_line": list(self._moving_line)}
+
+
+_STATS: Optional[ReadingStats] = None
+_STATS_LOCK = threading.Lock()
+
+
+def get_reading_stats() -> ReadingStats:
+    """进程内共享的统计实例；READING_STATS_LOG 可指定日志路径（默认 .cache/readings.log）"""
+    global _STATS
+    if _STATS is None:
+        with _STATS_LOCK:
+            if _STATS is None:
+                _STATS = ReadingStats(Path(os.getenv("READING_STATS_LOG", "") or DEFAULT_LOG))
+    return _STATS
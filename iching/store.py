@@ -0,0 +1,172 @@
+"""
+易经数据存储
+启动时一次性加载 iching_basic.json，建立只读索引，供各端点 O(1) 查询；
+存在未过期的二进制快照（iching.snapshot）时改为读取快照，完整记录按卦惰性解码
+"""
+
+from __future__ import annotations
+
+import json as _json
+import threading
+import unicodedata
+from pathlib import Path
+from types import MappingProxyType
+from typing import Any, Dict, Iterator, List, Mapping, Optional, Tuple
+
+from .core import CODE_TO_PATTERN, pattern_from_trigrams
+
+DATA_PATH = Path(__file__).resolve().parent.parent / "data" / "iching_basic.json"
+
+_EMPTY: Tuple[int, ...] = ()
+
+
+def _fold_pinyin(s: str) -> str:
+    """去掉声调并转小写：lǚ -> lu"""
+    s = unicodedata.normalize("NFKD", s.strip().lower())
+    return "".join(ch for ch in s if not unicodedata.combining(ch)).replace("ü", "u")
+
+
+class HexagramStore:
+    """只读卦象库：按序号、卦名、别名、拼音、上下卦、六爻位型建立索引"""
+
+    __slots__ = (
+        "_records", "_by_name", "_by_alias", "_by_pinyin",
+        "_by_trigrams", "_by_pattern", "_pattern_of",
+    )
+
+    def __init__(self, raw: Mapping[str, Any], full: Optional[Mapping[int, Dict[str, Any]]] = None):
+        """raw 为序号 -> 记录；给定 full（序号 -> 完整记录）时 raw 只需包含索引字段"""
+        records: Dict[int, Dict[str, Any]] = {}
+        by_name: Dict[str, int] = {}
+        by_alias: Dict[str, Tuple[int, ...]] = {}
+        by_pinyin: Dict[str, Tuple[int, ...]] = {}
+        by_trigrams: Dict[Tuple[str, str], int] = {}
+        by_pattern: Dict[int, int] = {}
+        pattern_of: Dict[int, int] = {}
+
+        for key, rec in raw.items():
+            try:
+                code = int(rec.get("id") or key)
+            except (TypeError, ValueError):
+                continue
+            records[code] = rec
+            name = rec.get("name")
+            if name:
+                by_name[name] = code
+            for alias in rec.get("alias") or ():
+                by_alias[alias] = by_alias.get(alias, _EMPTY) + (code,)
+            pinyin = rec.get("pinyin")
+            if pinyin:
+                for k in {pinyin, _fold_pinyin(pinyin)}:
+                    by_pinyin[k] = by_pinyin.get(k, _EMPTY) + (code,)
+            tri = rec.get("trigrams") or {}
+            upper, lower = tri.get("upper", ""), tri.get("lower", "")
+            pattern = pattern_from_trigrams(upper, lower)
+            if pattern is not None:
+                by_trigrams[(upper, lower)] = code
+                by_pattern[pattern] = code
+                pattern_of[code] = pattern
+
+        self._records = full if full is not None else MappingProxyType(dict(sorted(records.items())))
+        self._by_name = MappingProxyType(by_name)
+        self._by_alias = MappingProxyType(by_alias)
+        self._by_pinyin = MappingProxyType(by_pinyin)
+        self._by_trigrams = MappingProxyType(by_trigrams)
+        self._by_pattern = MappingProxyType(by_pattern)
+        self._pattern_of = MappingProxyType(pattern_of)
+
+    @classmethod
+    def load(cls, path: Path = DATA_PATH, use_snapshot: bool = True) -> "HexagramStore":
+        """优先读取快照，否则从 JSON 文件加载；文件缺失或损坏时返回空库"""
+        if use_snapshot:
+            from .snapshot import read_snapshot, snapshot_path
+
+            snap = read_snapshot(snapshot_path(path), path)
+            if snap is not None:
+                return cls(*snap)
+        if not path.exists():
+            return cls({})
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                raw = _json.load(f)
+        except Exception as e:
+            print(f"警告：无法加载易经数据库 {path}: {e}")
+            raw = {}
+        return cls(raw if isinstance(raw, dict) else {})
+
+    def __len__(self) -> int:
+        return len(self._records)
+
+    def __contains__(self, code: object) -> bool:
+        return code in self._records
+
+    def __iter__(self) -> Iterator[int]:
+        return iter(self._records)
+
+    @property
+    def records(self) -> Mapping[int, Dict[str, Any]]:
+        return self._records
+
+    def get(self, code: Any) -> Optional[Dict[str, Any]]:
+        """按序号（1..64，int 或 str）查询"""
+        try:
+            return self._records.get(int(code))
+        except (TypeError, ValueError):
+            return None
+
+    def by_name(self, name: str) -> Optional[Dict[str, Any]]:
+        """按卦名查询，兼容「乾为天」之类的全称别名"""
+        code = self._by_name.get(name)
+        if code is None:
+            codes = self._by_alias.get(name, _EMPTY)
+            code = codes[0] if len(codes) == 1 else None
+        return self._records.get(code) if code is not None else None
+
+    def by_alias(self, alias: str) -> Tuple[Dict[str, Any], ...]:
+        return tuple(self._records[c] for c in self._by_alias.get(alias, _EMPTY))
+
+    def by_pinyin(self, pinyin: str) -> Tuple[Dict[str, Any], ...]:
+        codes = self._by_pinyin.get(pinyin) or self._by_pinyin.get(_fold_pinyin(pinyin), _EMPTY)
+        return tuple(self._records[c] for c in codes)
+
+    def by_trigrams(self, upper: str, lower: str) -> Optional[Dict[str, Any]]:
+        code = self._by_trigrams.get((upper, lower))
+        return self._records.get(code) if code is not None else None
+
+    def by_pattern(self, pattern: int) -> Optional[Dict[str, Any]]:
+        """按六爻位型查询：第 i 位为第 i 爻（自下而上），阳=1"""
+        code = self._by_pattern.get(pattern)
+        return self._records.get(code) if code is not None else None
+
+    def pattern_of(self, code: int) -> Optional[int]:
+        return self._pattern_of.get(code)
+
+    def validate(self) -> List[str]:
+        """检查 64 卦是否齐全、字段是否完整、上下卦与卦序是否一致；返回问题列表，空列表表示通过"""
+        problems: List[str] = []
+        for code in range(1, 65):
+            rec = self.get(code)
+            if rec is None:
+                problems.append(f"缺少第 {code} 卦")
+                continue
+            if not rec.get("name") or not rec.get("judgement"):
+                problems.append(f"第 {code} 卦缺少卦名或卦辞")
+            if len(rec.get("lines") or ()) != 6:
+                problems.append(f"第 {code} 卦爻辞数量不为 6")
+            if self._pattern_of.get(code) != CODE_TO_PATTERN[code]:
+                problems.append(f"第 {code} 卦的上下卦与卦序不符")
+        return problems
+
+
+_STORE: Optional[HexagramStore] = None
+_STORE_LOCK = threading.Lock()
+
+
+def get_store() -> HexagramStore:
+    """进程内共享的卦象库（首次调用时加载；线程池中的并发首次调用只加载一次）"""
+    global _STORE
+    if _STORE is None:
+        with _STORE_LOCK:
+            if _STORE is None:
+                _STORE = HexagramStore.load()
+    return _STORE
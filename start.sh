@@ -12,5 +12,10 @@ if [ -z "$SILICONFLOW_API_KEY" ]; then
     exit 1
 fi
 
-# 启动服务
-python app.py
\ No newline at end of file
+# 启动服务：./start.sh prod 以多 worker 生产模式运行
+# WEB_CONCURRENCY 指定 worker 数（默认 CPU 核数）；kill -HUP <主进程> 平滑重启全部 worker
+if [ "$1" = "prod" ]; then
+    exec python app.py --workers "${WEB_CONCURRENCY:-0}"
+else
+    exec python app.py
+fi
@@ -10,16 +10,16 @@ const guaList = [
     "巽", "兑", "涣", "节", "中孚", "小过", "既济", "未济"
 ];
 
-// 卦象索引映射
+// 卦象索引映射：guaIndex[上卦][下卦] -> guaList 下标（三爻卦按初爻为最低位编码，与后端 iching.core 一致）
 const guaIndex = [
-    [0, 1, 2, 3, 4, 5, 6, 7],
-    [8, 9, 10, 11, 12, 13, 14, 15],
-    [16, 17, 18, 19, 20, 21, 22, 23],
-    [24, 25, 26, 27, 28, 29, 30, 31],
-    [32, 33, 34, 35, 36, 37, 38, 39],
-    [40, 41, 42, 43, 44, 45, 46, 47],
-    [48, 49, 50, 51, 52, 53, 54, 55],
-    [56, 57, 58, 59, 60, 61, 62, 63]
+    [1, 23, 6, 18, 14, 35, 45, 10],
+    [15, 50, 39, 53, 61, 54, 31, 33],
+    [7, 2, 28, 59, 38, 62, 47, 4],
+    [44, 16, 46, 57, 30, 48, 27, 42],
+    [22, 26, 3, 40, 51, 21, 17, 25],
+    [34, 20, 63, 37, 55, 29, 49, 13],
+    [19, 41, 58, 60, 52, 36, 56, 8],
+    [11, 24, 5, 9, 32, 12, 43, 0]
 ];
 
 // 今日推荐问题
@@ -42,7 +42,10 @@ let coinResults = [];
 let totalRounds = 6;
 let hexagramList = []; // 改用类似divination项目的HexagramObj数组
 let lastFaces = [true, true, true]; // 记录上次三枚硬币朝向：true=head(正), false=tail(反)
-let ichingData = null; // 动态加载的 64 卦基础库
+let castLines = null; // 服务端起出的六爻（自下而上），摇卦动画按此还原；为 null 时本地随机
+let ichingData = null; // 兜底：完整 64 卦基础库（仅在分片清单不可用时加载）
+let shardManifest = null; // 分片清单：卦序号 -> 带内容哈希的分片文件名
+const shardCache = new Map(); // 已拉取的分片（按卦序号）
 let animationObserver = null; // 动画观察器
 
 // DOM元素引用
@@ -60,13 +63,8 @@ document.addEventListener('DOMContentLoaded', async function() {
     renderSuggestions();
     await loadIchingData();
 
-    // 初始刷新统计UI（从localStorage读取）
-    try {
-        const key = 'divine_stats';
-        const data = JSON.parse(localStorage.getItem(key) || '{}');
-        const today = new Date().toISOString().slice(0, 10);
-        updateStatsUI(data, today);
-    } catch (e) {}
+    // 初始刷新统计UI：优先读取全站统计，接口不可用时读取 localStorage
+    loadStats();
 
     // 避免硬币元素与 FLIP 竞争 transform（忽略这些元素的位移动画）
     try {
@@ -121,7 +119,7 @@ function initEventListeners() {
     if (typeof regenerateBtn !== 'undefined' && regenerateBtn) {
         regenerateBtn.addEventListener('click', () => {
             if (!hexagramResult) return;
-            triggerAI(currentQuestion, hexagramResult.hexInfo, hexagramResult.rec);
+            triggerAI(currentQuestion, hexagramResult.hexInfo, hexagramResult.rec, { noCache: true });
         });
     }
 }
@@ -169,7 +167,7 @@ function renderSuggestions() {
 
 // 开始算卦（重构：严格一轮一 await，同步“摇一次-出一爻”节奏）
 // 严格按照divination项目的方案：每次点击触发一次硬币动画，动画结束后更新状态
-function startDivination() {
+async function startDivination() {
     const question = questionInput.value.trim();
     if (!question) {
         alert('心诚则灵，请先输入您的问题。');
@@ -185,10 +183,34 @@ function startDivination() {
         hexagramList = [];
         resetUIForNewDivination();
     }
-    
+
+    if (hexagramList.length === 0) {
+        isAnimating = true; // 等待服务端起卦期间屏蔽重复点击
+        castLines = await castOnServer();
+        isAnimating = false;
+    }
+
     startSingleRound();
 }
 
+// 向服务端起卦（计入全站统计）；接口不可用（如 Vercel 部署）时返回 null，改为本地随机
+async function castOnServer() {
+    if (!serverStats) return null;
+    try {
+        const res = await fetch(`${API_BASE}/api/divine/coin`, {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/json' },
+            body: JSON.stringify({ source: 'web' }),
+        });
+        if (!res.ok) throw new Error(res.status);
+        const { primary } = await res.json();
+        return primary.lines.map((yang, i) => ({ yang: !!yang, change: !!primary.moving[i] }));
+    } catch (e) {
+        serverStats = false;
+        return null;
+    }
+}
+
 // 开始单轮硬币动画
 function startSingleRound() {
     if (isAnimating) {
@@ -284,20 +306,40 @@ function animateCoin(coinElement, resultFace, prevFace) {
 // 生成随机硬币结果
 function generateCoinResults() {
     // 仅三枚（一次一爻）
-    return Array.from({ length: 3 }, () => Math.random() > 0.5);
+    const line = castLines && castLines[hexagramList.length];
+    if (!line) return Array.from({ length: 3 }, () => Math.random() > 0.5);
+    // 按服务端的爻还原硬币：老阳三正、老阴三反、少阳两正、少阴一正，正面落在哪枚随机
+    const heads = line.change ? (line.yang ? 3 : 0) : (line.yang ? 2 : 1);
+    const faces = [0, 1, 2].map(i => i < heads);
+    for (let i = faces.length - 1; i > 0; i--) {
+        const j = Math.floor(Math.random() * (i + 1));
+        [faces[i], faces[j]] = [faces[j], faces[i]];
+    }
+    return faces;
 }
 
 // 由三枚硬币计算一爻的函数已被移除，现在直接在onTransitionEnd中计算
 
 // 计算卦象
+// 六爻打包为 12 位整数：低 6 位为阴阳（第 i 位为第 i 爻），高 6 位为动爻，与后端 iching.core.Reading 一致
+function packReading(lines) {
+    let bits = 0;
+    lines.forEach((line, i) => {
+        if (line.yang) bits |= 1 << i;
+        if (line.change) bits |= 1 << (i + 6);
+    });
+    return bits;
+}
+
 function calculateHexagram(lines) {
     if (!lines || lines.length !== 6) {
         return null;
     }
 
-    // 计算上下卦索引（阳=1 阴=0；自下而上权重1、2、4）
-    const lowerTrigram = (lines[0].yang ? 1 : 0) + (lines[1].yang ? 2 : 0) + (lines[2].yang ? 4 : 0);
-    const upperTrigram = (lines[3].yang ? 1 : 0) + (lines[4].yang ? 2 : 0) + (lines[5].yang ? 4 : 0);
+    // 上下卦索引直接取位型的低三位与高三位
+    const bits = packReading(lines);
+    const lowerTrigram = bits & 7;
+    const upperTrigram = (bits >> 3) & 7;
 
     const guaIndexValue = guaIndex[upperTrigram][lowerTrigram];
     const guaName = guaList[guaIndexValue];
@@ -305,9 +347,10 @@ function calculateHexagram(lines) {
 
     const YAO_NAMES_YANG = ["初九", "九二", "九三", "九四", "九五", "上九"]; // 阳动
     const YAO_NAMES_YIN  = ["初六", "六二", "六三", "六四", "六五", "上六"]; // 阴动
-    const changeList = lines
-        .map((line, i) => line.change ? (line.yang ? YAO_NAMES_YANG[i] : YAO_NAMES_YIN[i]) : null)
-        .filter(Boolean);
+    const changeList = [];
+    for (let i = 0; i < 6; i++) {
+        if ((bits >> (i + 6)) & 1) changeList.push((bits >> i) & 1 ? YAO_NAMES_YANG[i] : YAO_NAMES_YIN[i]);
+    }
 
     const GUA_DICTS = {
         names: ["坤", "震", "坎", "兑", "艮", "离", "巽", "乾"],
@@ -324,6 +367,7 @@ function calculateHexagram(lines) {
     return {
         name: guaName,
         sequence,
+        bits,
         fullGuaName,
         positionDesc: `${upperName}上${lowerName}下`,
         changeList,
@@ -412,7 +456,7 @@ function createHexagramRow(lineData, index) {
 // renderSingleNewLine函数已被renderHexagram替代，不再需要
 
 // 显示结果
-function showResult(result) {
+async function showResult(result) {
     if (!result) return;
 
     // 顶部横向卦象标题
@@ -422,16 +466,7 @@ function showResult(result) {
         setTimeout(() => headerEl.classList.add('show'), 100);
     }
 
-    let rec = ichingData ? ichingData[String(result.sequence)] : null;
-    // 兜底：按卦名匹配
-    if (!rec && ichingData) {
-        for (const k in ichingData) {
-            if (Object.prototype.hasOwnProperty.call(ichingData, k)) {
-                const r = ichingData[k];
-                if (r && r.name === result.name) { rec = r; break; }
-            }
-        }
-    }
+    const rec = await getHexagramRecord(result.sequence, result.name);
     if (!rec) return;
 
     const titleEl = document.getElementById('result-title');
@@ -481,8 +516,20 @@ function showResult(result) {
     triggerAI(currentQuestion, result, rec);
 }
 
-// 动态加载易经基础库
+// 加载分片清单（约 2KB）；清单不可用时回退到完整基础库
 async function loadIchingData() {
+    try {
+        const res = await fetch('/static/hex/manifest.json', { cache: 'no-cache' });
+        if (!res.ok) throw new Error(`HTTP ${res.status}`);
+        shardManifest = await res.json();
+    } catch (e) {
+        console.warn('加载分片清单失败，回退到完整基础库：', e);
+        shardManifest = null;
+        await loadFullIchingData();
+    }
+}
+
+async function loadFullIchingData() {
     try {
         const res = await fetch('/static/iching_basic.json');
         if (!res.ok) throw new Error(`HTTP ${res.status}`);
@@ -493,6 +540,39 @@ async function loadIchingData() {
     }
 }
 
+// 按需获取单卦数据：优先分片，失败时回退到完整基础库
+async function getHexagramRecord(sequence, name) {
+    const key = String(sequence);
+    if (shardCache.has(key)) return shardCache.get(key);
+
+    const file = shardManifest && shardManifest.shards ? shardManifest.shards[key] : null;
+    if (file) {
+        try {
+            const res = await fetch(`/static/hex/${file}`);
+            if (!res.ok) throw new Error(`HTTP ${res.status}`);
+            const rec = await res.json();
+            shardCache.set(key, rec);
+            return rec;
+        } catch (e) {
+            console.warn(`加载分片 ${file} 失败：`, e);
+        }
+    }
+
+    if (!ichingData) await loadFullIchingData();
+    if (!ichingData) return null;
+    let rec = ichingData[key] || null;
+    // 兜底：按卦名匹配
+    if (!rec) {
+        for (const k in ichingData) {
+            if (Object.prototype.hasOwnProperty.call(ichingData, k)) {
+                const r = ichingData[k];
+                if (r && r.name === name) { rec = r; break; }
+            }
+        }
+    }
+    return rec;
+}
+
 // 填充卦象详细信息
 function populateHexagramDetails(hexagramData) {
     if (!hexagramData) return;
@@ -511,7 +591,8 @@ function populateHexagramDetails(hexagramData) {
     const primaryElementEl = document.getElementById('primary-element');
     
     if (hexagramData.five_elements_enhanced && primaryElementEl) {
-        primaryElementEl.textContent = hexagramData.five_elements_enhanced.primary || '—';
+        const fe = hexagramData.five_elements_enhanced;
+        primaryElementEl.textContent = fe.primary_element || fe.primary || '—';
     }
     
     // 运势简要
@@ -521,7 +602,7 @@ function populateHexagramDetails(hexagramData) {
         const adviceEl = document.getElementById('fortune-advice');
         
         if (overallEl) overallEl.textContent = hexagramData.fortune.overall || '—';
-        if (generalEl) generalEl.textContent = hexagramData.fortune.general || '—';
+        if (generalEl) generalEl.textContent = hexagramData.fortune.general || hexagramData.fortune.fortune || '—';
         if (adviceEl) adviceEl.textContent = hexagramData.fortune.advice || '—';
     }
 }
@@ -564,8 +645,48 @@ function resetUIForNewDivination() {
     if (regenerateBtn) regenerateBtn.style.display = 'none';
 }
 
-// ===================== 本地统计 =====================
+// ===================== 统计 =====================
+// 全站统计由服务端（app.py）维护；接口不存在（如 Vercel 部署）时退回浏览器本地统计
+let serverStats = true;
+
+function renderServerStats(summary) {
+    const totalEl = document.getElementById('stats-total');
+    const todayEl = document.getElementById('stats-today');
+    const freqEl = document.getElementById('stats-frequent');
+    const top = (summary.top || [])[0];
+    if (totalEl) totalEl.textContent = String(summary.total || 0);
+    if (todayEl) todayEl.textContent = String(summary.today || 0);
+    if (freqEl) freqEl.textContent = top ? `${top.name}（${top.count}次）` : '—';
+}
+
+function loadLocalStats() {
+    try {
+        const data = JSON.parse(localStorage.getItem('divine_stats') || '{}');
+        updateStatsUI(data, new Date().toISOString().slice(0, 10));
+    } catch (e) {}
+}
+
+async function loadStats() {
+    try {
+        const res = await fetch(`${API_BASE}/api/stats`);
+        if (!res.ok) throw new Error(res.status);
+        renderServerStats(await res.json());
+    } catch (e) {
+        serverStats = false;
+        loadLocalStats();
+    }
+}
+
 function updateStats(result) {
+    // 服务端起卦时已计入全站统计，这里只刷新显示；本地起卦只记入浏览器本地统计
+    if (castLines) {
+        loadStats();
+    } else {
+        updateLocalStats(result);
+    }
+}
+
+function updateLocalStats(result) {
     try {
         const key = 'divine_stats';
         const today = new Date();
@@ -628,16 +749,19 @@ function buildHexagramForAI(result, rec) {
     };
 }
 const API_BASE = '';
-async function triggerAI(question, result, rec) {
+const AI_STREAM = true; // 优先使用 SSE 流式接口；接口不存在（如 Vercel 部署）时回退到 /api/ai
+async function triggerAI(question, result, rec, options = {}) {
     try {
         // 展示AI区域与加载状态
         setAISectionVisible(true);
+        setLoadingText('AI 分析中...');
         if (aiResultContent) aiResultContent.innerHTML = '';
         const payload = {
             question: (question || '').trim() || '综合运势',
-            model: 'Qwen/QwQ-32B',
             hexagram: buildHexagramForAI(result, rec),
+            no_cache: !!options.noCache, // 重新生成时跳过服务端解读缓存
         };
+        if (AI_STREAM && await streamAI(payload)) return;
         const resp = await fetch(`${API_BASE}/api/ai`, {
             method: 'POST',
             headers: { 'Content-Type': 'application/json' },
@@ -649,8 +773,106 @@ async function triggerAI(question, result, rec) {
         renderAIResult(false, { detail: String(e || '网络错误') });
     }
 }
+
+// 流式读取 /api/ai/stream，边接收边渲染；接口不可用时返回 false 以便回退
+async function streamAI(payload) {
+    let resp;
+    try {
+        resp = await fetch(`${API_BASE}/api/ai/stream`, {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/json', 'Accept': 'text/event-stream' },
+            body: JSON.stringify(payload),
+        });
+    } catch (e) {
+        return false;
+    }
+    if (resp.status === 404 || resp.status === 405) return false;
+    if (!resp.ok) {
+        const data = await resp.json().catch(() => ({}));
+        renderAIResult(false, data);
+        return true;
+    }
+    const contentType = resp.headers.get('content-type') || '';
+    if (!resp.body || !contentType.includes('text/event-stream')) return false;
+
+    const reader = resp.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = '';
+    let text = '';
+    let finished = false;
+    while (!finished) {
+        const { value, done } = await reader.read();
+        if (done) break;
+        buffer += decoder.decode(value, { stream: true });
+        let sep;
+        while (!finished && (sep = buffer.indexOf('\n\n')) >= 0) {
+            const evt = parseSSEEvent(buffer.slice(0, sep));
+            buffer = buffer.slice(sep + 2);
+            if (!evt) continue;
+            if (evt.event === 'reasoning') {
+                setLoadingText('AI 思考中...');
+            } else if (evt.event === 'delta') {
+                text += evt.data.content || '';
+                scheduleAIStreamRender(text);
+            } else if (evt.event === 'done') {
+                finished = true;
+                renderAIResult(true, evt.data);
+            } else if (evt.event === 'error') {
+                finished = true;
+                renderAIResult(false, evt.data);
+            }
+        }
+    }
+    if (!finished) {
+        renderAIResult(!!text, text ? { content: text } : { detail: 'AI 响应中断，请重试。' });
+    }
+    return true;
+}
+
+function parseSSEEvent(raw) {
+    let event = 'message';
+    const dataLines = [];
+    raw.split('\n').forEach(line => {
+        if (line.startsWith('event:')) event = line.slice(6).trim();
+        else if (line.startsWith('data:')) dataLines.push(line.slice(5).trim());
+    });
+    if (!dataLines.length) return null;
+    try {
+        return { event, data: JSON.parse(dataLines.join('\n')) };
+    } catch (e) {
+        return null;
+    }
+}
+
+// 增量 Markdown 渲染：每帧最多重绘一次
+let aiStreamText = '';
+let aiStreamFrame = 0;
+function scheduleAIStreamRender(text) {
+    aiStreamText = text;
+    if (aiStreamFrame) return;
+    aiStreamFrame = requestAnimationFrame(() => {
+        aiStreamFrame = 0;
+        if (!aiResultContent) return;
+        if (loadingIndicator) loadingIndicator.style.display = 'none';
+        try {
+            aiResultContent.innerHTML = marked.parse(aiStreamText);
+        } catch (error) {
+            aiResultContent.innerHTML = aiStreamText.split(/\n+/).filter(Boolean).map(p => `<p>${escapeHTML(p)}</p>`).join('');
+        }
+    });
+}
+
+function setLoadingText(text) {
+    const label = loadingIndicator ? loadingIndicator.querySelector('span') : null;
+    if (label) label.textContent = text;
+}
+
 function renderAIResult(ok, data) {
     if (!aiResultSection || !aiResultContent) return;
+    if (aiStreamFrame) {
+        cancelAnimationFrame(aiStreamFrame);
+        aiStreamFrame = 0;
+    }
     if (loadingIndicator) loadingIndicator.style.display = 'none';
     if (ok && data && data.content) {
         const text = String(data.content);
@@ -0,0 +1,22 @@
+"""app.py 在导入时读取部分环境变量：先把统计日志、任务库、缓存等指向临时目录，测试不碰工作区也不连真实上游"""
+
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+_TMP = Path(tempfile.mkdtemp(prefix="iching-tests-"))
+
+for name, value in {
+    "READING_STATS_LOG": str(_TMP / "readings.log"),
+    "AI_JOB_DB": str(_TMP / "jobs.db"),
+    "AI_JOB_WORKERS": "0",
+    "AI_RATE_LIMIT": "none",
+    "CHEAP_RATE_LIMIT": "none",
+    "AI_MODEL_FALLBACKS": "none",
+    "PREGEN_PATH": "none",
+    "SILICONFLOW_API_KEY": "",
+}.items():
+    os.environ.setdefault(name, value)
@@ -0,0 +1,90 @@
+"""限流与准入：令牌桶、客户端识别（伪造的 X-API-Key / X-Forwarded-For 不能换出新额度）、429 响应与优先级排队"""
+
+import asyncio
+import math
+
+import pytest
+from fastapi.testclient import TestClient
+
+import app as A
+from iching.admission import PRIORITY_BACKGROUND, PRIORITY_INTERACTIVE, AdmissionQueue, Overloaded, RateLimiter, parse_rate
+
+
+def scope(client="203.0.113.9", **headers):
+    return {
+        "client": (client, 1234),
+        "headers": [(k.replace("_", "-").lower().encode(), v.encode()) for k, v in headers.items()],
+    }
+
+
+def test_token_bucket(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr("iching.admission.time.monotonic", lambda: now[0])
+    limiter = RateLimiter(rate=1.0, burst=2)
+    assert limiter.hit("a") == 0 and limiter.hit("a") == 0
+    assert limiter.hit("a") == 1.0
+    assert limiter.hit("b") == 0  # 各键独立
+    now[0] += 1.0
+    assert limiter.hit("a") == 0
+    assert limiter.rejected == 1
+    assert math.isinf(RateLimiter(rate=0, burst=1).hit("x", cost=2))
+
+
+def test_parse_rate():
+    assert parse_rate("5:10") == (5.0, 10.0)
+    assert parse_rate("0.5") == (0.5, 1.0)
+    assert parse_rate("none") is None and parse_rate("x") is None
+
+
+def test_client_key_ignores_forged_headers(monkeypatch):
+    monkeypatch.setattr(A, "_RATE_LIMIT_KEYS", frozenset({"partner"}))
+    monkeypatch.setattr(A, "_TRUSTED_HOPS", 0)
+    assert A._client_key(scope(x_api_key="partner")) == "key:partner"
+    assert A._client_key(scope(x_api_key="made-up")) == "ip:203.0.113.9"
+    # 没有可信代理时不看 X-Forwarded-For
+    assert A._client_key(scope(x_forwarded_for="1.2.3.4")) == "ip:203.0.113.9"
+
+    monkeypatch.setattr(A, "_TRUSTED_HOPS", 1)
+    # 客户端自带的左侧地址被忽略，取代理追加的最右一项
+    assert A._client_key(scope(x_forwarded_for="1.2.3.4, 198.51.100.7")) == "ip:198.51.100.7"
+    monkeypatch.setattr(A, "_TRUSTED_HOPS", 2)
+    assert A._client_key(scope(x_forwarded_for="1.2.3.4, 198.51.100.7, 10.0.0.2")) == "ip:198.51.100.7"
+    assert A._client_key(scope(x_forwarded_for="198.51.100.7")) == "ip:198.51.100.7"
+
+
+def test_middleware_returns_429(monkeypatch):
+    monkeypatch.setitem(A._RATE_LIMITERS, "cheap", RateLimiter(rate=0.001, burst=2))
+    monkeypatch.setattr(A, "_RATE_LIMIT_KEYS", frozenset())
+    client = TestClient(A.app)
+    assert client.get("/api/stats").status_code == 200
+    assert client.get("/api/stats", headers={"X-API-Key": "a"}).status_code == 200
+    limited = client.get("/api/stats", headers={"X-API-Key": "b"})
+    assert limited.status_code == 429
+    assert int(limited.headers["Retry-After"]) >= 1
+    assert client.get("/healthz").status_code == 200  # 探针不限流
+
+
+def test_admission_queue_serves_interactive_first():
+    async def main():
+        queue = AdmissionQueue(concurrency=1, max_queue=2, max_wait=5.0, initial_service=0.01)
+        order = []
+        await queue.acquire()
+
+        async def wait(name, priority):
+            await queue.acquire(priority)
+            order.append(name)
+            queue.release()
+
+        background = asyncio.create_task(wait("background", PRIORITY_BACKGROUND))
+        await asyncio.sleep(0)
+        interactive = asyncio.create_task(wait("interactive", PRIORITY_INTERACTIVE))
+        await asyncio.sleep(0)
+        with pytest.raises(Overloaded):
+            await queue.acquire()  # 排队已满，立即拒绝
+        queue.release()
+        await asyncio.gather(background, interactive)
+        return order, queue.stats()
+
+    order, stats = asyncio.run(main())
+    assert order == ["interactive", "background"]
+    assert stats["active"] == 0 and stats["waiting"] == 0 and stats["shed"] == 1
@@ -0,0 +1,33 @@
+"""解读缓存键与两级缓存：键须覆盖提示词用到的全部输入，动爻由 bits 或 changeList 得出"""
+
+from iching.cache import InterpretationCache, SQLiteCache, TTLCache, interpretation_key, normalize_question
+
+QIAN = {"sequence": 1, "name": "乾", "changeList": []}
+
+
+def test_key_follows_moving_mask_from_bits():
+    still = interpretation_key(dict(QIAN, bits=0b111111), "事业", "m")
+    moving = interpretation_key(dict(QIAN, bits=0b111111 | 1 << 6), "事业", "m")
+    assert still != moving
+    # 没有 bits 时与 changeList 推出的动爻一致
+    assert interpretation_key(QIAN, "事业", "m") == still
+    labelled = dict(QIAN, changeList=["初九"])
+    assert interpretation_key(labelled, "事业", "m") != still
+
+
+def test_key_ignores_presentation_fields_and_punctuation():
+    base = interpretation_key(QIAN, "我的事业？", "m")
+    assert interpretation_key(dict(QIAN, link="https://example.com"), "我的事业?", "m") == base
+    assert interpretation_key(QIAN, "我的事业", "other") != base
+    assert normalize_question("  ") == "综合运势"
+
+
+def test_two_level_cache(tmp_path):
+    disk = SQLiteCache(str(tmp_path / "ai.sqlite3"))
+    cache = InterpretationCache(TTLCache(2), disk)
+    cache.set("k", {"content": "x"})
+    assert InterpretationCache(TTLCache(2), disk).get("k") == {"content": "x"}
+    assert cache.get("k") == {"content": "x"}
+    assert cache.get("missing") is None
+    stats = cache.stats()
+    assert stats["memory_hits"] == 1 and stats["misses"] == 1
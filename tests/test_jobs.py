@@ -0,0 +1,69 @@
+"""后台任务：取任务互斥、租约到期重取、执行期间续租，以及 webhook 地址校验"""
+
+import asyncio
+import time
+
+from iching.jobs import JobRunner, JobStore, validate_webhook
+
+
+def test_claim_is_exclusive_and_ordered(tmp_path):
+    store = JobStore(str(tmp_path / "jobs.db"))
+    first = store.submit({"n": 1})
+    store.submit({"n": 2})
+    job = store.claim(60)
+    assert job["id"] == first and job["request"] == {"n": 1} and job["attempts"] == 1
+    assert store.claim(60)["request"] == {"n": 2}
+    assert store.claim(60) is None
+    assert store.get(first)["status"] == "running"
+
+
+def test_expired_lease_is_reclaimed_and_renew_is_fenced(tmp_path):
+    store = JobStore(str(tmp_path / "jobs.db"))
+    job_id = store.submit({})
+    stale = store.claim(0.05)
+    assert store.renew(job_id, stale["attempts"], 0.05)
+    time.sleep(0.1)
+    fresh = store.claim(60)
+    assert fresh["id"] == job_id and fresh["attempts"] == 2
+    # 原 worker 的租约已被取代，不能再续
+    assert not store.renew(job_id, stale["attempts"], 60)
+    assert store.renew(job_id, fresh["attempts"], 60)
+    store.finish(job_id, {"ok": True})
+    assert not store.renew(job_id, fresh["attempts"], 60)
+
+
+def test_running_job_keeps_its_lease(tmp_path):
+    store = JobStore(str(tmp_path / "jobs.db"))
+    calls = []
+
+    async def slow(request):
+        calls.append(request)
+        await asyncio.sleep(0.5)  # 远超租约
+        return {"ok": True}
+
+    async def main():
+        runner = JobRunner(store, slow, workers=1, lease=0.15, poll_interval=0.02)
+        runner.start()
+        job_id = store.submit({"n": 1})
+        runner.notify()
+        await asyncio.sleep(0.3)
+        # 另一个进程此时来取任务：租约一直在续，取不到
+        assert await asyncio.to_thread(store.claim, 60) is None
+        while store.get(job_id)["status"] != "done":
+            await asyncio.sleep(0.02)
+        await runner.stop()
+        return job_id
+
+    job_id = asyncio.run(main())
+    assert len(calls) == 1
+    assert store.get(job_id)["attempts"] == 1
+
+
+def test_webhook_rejects_internal_targets(monkeypatch):
+    monkeypatch.delenv("JOB_WEBHOOK_ALLOW_PRIVATE", raising=False)
+    monkeypatch.delenv("JOB_WEBHOOK_HOSTS", raising=False)
+    assert validate_webhook("ftp://example.com/") is not None
+    for url in ("http://127.0.0.1/", "http://169.254.169.254/latest", "http://10.0.0.1/", "http://[::ffff:127.0.0.1]/"):
+        assert validate_webhook(url) is not None, url
+    monkeypatch.setenv("JOB_WEBHOOK_ALLOW_PRIVATE", "1")
+    assert validate_webhook("http://127.0.0.1/") is None
@@ -0,0 +1,54 @@
+"""流式请求：上游中途停顿时按截止时间超时"""
+
+import asyncio
+import sys
+import time
+from pathlib import Path
+
+import httpx
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from iching.llm import LLMClient, UpstreamTimeout
+
+
+def _stalling_transport(stall: float) -> httpx.MockTransport:
+    async def body():
+        yield b'data: {"choices": [{"delta": {"content": "a"}}]}\n\n'
+        await asyncio.sleep(stall)
+        yield b"data: [DONE]\n\n"
+
+    async def handler(request):
+        return httpx.Response(200, content=body(), headers={"content-type": "text/event-stream"})
+
+    return httpx.MockTransport(handler)
+
+
+def test_stream_times_out_on_mid_stream_stall():
+    async def main():
+        client = LLMClient(base_url="http://upstream.test/v1/chat/completions", transport=_stalling_transport(5))
+        chunks = []
+        started = time.monotonic()
+        try:
+            with pytest.raises(UpstreamTimeout):
+                async for chunk in client.stream_chat({"model": "m"}, "key", timeout=0.3):
+                    chunks.append(chunk)
+        finally:
+            await client.aclose()
+        return chunks, time.monotonic() - started
+
+    chunks, elapsed = asyncio.run(main())
+    assert len(chunks) == 1
+    assert elapsed < 2
+
+
+def test_stream_completes_within_deadline():
+    async def main():
+        client = LLMClient(base_url="http://upstream.test/v1/chat/completions", transport=_stalling_transport(0.01))
+        try:
+            return [c async for c in client.stream_chat({"model": "m"}, "key", timeout=2)]
+        finally:
+            await client.aclose()
+
+    assert len(asyncio.run(main())) == 1
@@ -0,0 +1,67 @@
+"""预生成解读：模板文件须显式开启才代替模型解读返回，指定其他模型时不使用"""
+
+import json
+
+import pytest
+
+import app as A
+from iching import pregen
+from iching.pregen import MAGIC, _U32, build, get_pregenerated
+
+QIAN = {"sequence": 1, "bits": 0b111111}
+
+
+@pytest.fixture(scope="module")
+def template_file(tmp_path_factory):
+    path = tmp_path_factory.mktemp("pregen") / "interpretations.bin"
+    build(path, "template", None, 1)
+    return path
+
+
+def as_llm(src, dst, model):
+    """把模板文件的元数据改成 llm 方式生成（正文不变），模拟调用上游生成的文件"""
+    raw = src.read_bytes()
+    (length,) = _U32.unpack_from(raw, len(MAGIC))
+    start = len(MAGIC) + _U32.size
+    meta = json.loads(raw[start:start + length])
+    meta.update(mode="llm", model=model)
+    header = json.dumps(meta, ensure_ascii=False).encode("utf-8")
+    dst.write_bytes(MAGIC + _U32.pack(len(header)) + header + raw[start + length:])
+    return dst
+
+
+def load(monkeypatch, path, serve_template=None):
+    monkeypatch.setenv("PREGEN_PATH", str(path))
+    if serve_template is None:
+        monkeypatch.delenv("PREGEN_SERVE_TEMPLATE", raising=False)
+    else:
+        monkeypatch.setenv("PREGEN_SERVE_TEMPLATE", serve_template)
+    monkeypatch.setattr(pregen, "_STORE", None)
+    monkeypatch.setattr(pregen, "_STORE_LOADED", False)
+    return get_pregenerated()
+
+
+def test_template_file_requires_opt_in(monkeypatch, template_file):
+    assert load(monkeypatch, template_file) is None
+    assert A._pregenerated(A.AIRequest(question="事业", hexagram=QIAN)) is None
+
+    store = load(monkeypatch, template_file, "1")
+    assert store is not None and store.meta["mode"] == "template"
+    hit = A._pregenerated(A.AIRequest(question="事业运势", hexagram=QIAN))
+    assert hit["pregenerated"] and hit["content"]
+    # 非主题问题、显式指定模型、重新生成时都不使用
+    assert A._pregenerated(A.AIRequest(question="明天出门顺利吗", hexagram=QIAN)) is None
+    assert A._pregenerated(A.AIRequest(question="事业", hexagram=QIAN, model="Qwen/QwQ-32B")) is None
+    assert A._pregenerated(A.AIRequest(question="事业", hexagram=QIAN, no_cache=True)) is None
+
+
+def test_llm_file_serves_its_own_model(monkeypatch, template_file, tmp_path):
+    path = as_llm(template_file, tmp_path / "llm.bin", "Qwen/QwQ-32B")
+    store = load(monkeypatch, path)
+    assert store is not None
+    assert store.serves(None) and store.serves("Qwen/QwQ-32B") and not store.serves("other")
+    hit = A._pregenerated(A.AIRequest(question="感情", hexagram=QIAN, model="Qwen/QwQ-32B"))
+    assert hit["model"] == "Qwen/QwQ-32B"
+    # 变爻不同取不同条目
+    moving = A._pregenerated(A.AIRequest(question="感情", hexagram=dict(QIAN, bits=0b111111 | 1 << 6)))
+    assert moving["content"] != hit["content"]
@@ -0,0 +1,37 @@
+"""提示词组装：动爻由 bits 或 changeList 得出，按变爻数选取爻辞，超出预算时舍去可选片段"""
+
+from iching.prompts import build_messages, hexagram_code, moving_mask
+
+
+def user_prompt(hexagram, question="事业", **kw):
+    messages, tokens = build_messages(hexagram, question, 512, **kw)
+    return messages[-1]["content"], tokens
+
+
+def test_moving_mask_and_code():
+    assert moving_mask({"bits": 0b111111 | 0b101 << 6, "changeList": ["上九"]}) == 0b101
+    assert moving_mask({"bits": 5000, "changeList": ["九二", "上九"]}) == 0b100010
+    assert moving_mask({}) == 0
+    assert hexagram_code({"sequence": "64"}) == 64
+    assert hexagram_code({"sequence": 0, "code": 2}) == 2
+    assert hexagram_code({"code": "x"}) is None
+
+
+def test_line_selection_follows_moving_count():
+    still, _ = user_prompt({"sequence": 1, "bits": 0b111111})
+    assert "爻辞" not in still and "之卦" not in still
+
+    one, _ = user_prompt({"sequence": 1, "bits": 0b111111 | 1 << 6})
+    assert "初九：潜龙勿用" in one and "之卦" not in one
+
+    # 四爻变：取之卦（风地观）的两条不变爻
+    four, _ = user_prompt({"sequence": 1, "bits": 0b111111 | 0b1111 << 6})
+    assert "之卦：观" in four and "九五" in four and "上九" in four and "初九" not in four
+
+
+def test_budget_drops_optional_parts():
+    full, tokens = user_prompt({"sequence": 1, "bits": 0b111111 | 0b1111 << 6})
+    tight, tight_tokens = user_prompt({"sequence": 1, "bits": 0b111111 | 0b1111 << 6}, prompt_budget=120)
+    assert tight_tokens < tokens
+    assert "象曰" in full and "象曰" not in tight
+    assert tight.startswith("问题：事业")
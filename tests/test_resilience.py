@@ -0,0 +1,163 @@
+"""熔断、重试与模型回退：用假的上游调用验证熔断器状态不会卡住"""
+
+import asyncio
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from iching.llm import UpstreamError, UpstreamTimeout
+from iching.resilience import CircuitOpen, ModelTarget, Resilience, RetryPolicy
+
+
+def make(fallbacks=(), attempts=1, threshold=1, reset=0.0):
+    return Resilience(
+        fallbacks=[ModelTarget(m, t) for m, t in fallbacks],
+        policy=RetryPolicy(max_attempts=attempts, base_delay=0.0),
+        failure_threshold=threshold,
+        reset_timeout=reset,
+    )
+
+
+def trip(r, model="A"):
+    """让模型 A 的熔断器进入 open（reset=0 时下一次 allow 即转为 half_open）"""
+    r.breaker(model).record_failure()
+    assert r.breaker(model).state == "open"
+
+
+def test_success_and_fallback_on_5xx():
+    r = make([("A", None), ("B", None)])
+    calls = []
+
+    async def fn(model, timeout):
+        calls.append(model)
+        if model == "A":
+            raise UpstreamError("HTTP 503", 503)
+        return "ok"
+
+    assert asyncio.run(r.call("A", fn, 5)) == ("ok", "B")
+    assert calls == ["A", "B"]
+    assert r.breaker("A").state == "open"
+    assert r.stats()["fallbacks"] == 1
+
+
+def test_retry_then_success():
+    r = make(attempts=3, threshold=5)
+    seen = []
+
+    def fn(model, timeout):
+        seen.append(model)
+        if len(seen) < 3:
+            raise UpstreamError("HTTP 429", 429)
+        return "ok"
+
+    assert r.call_sync("A", fn, 5) == ("ok", "A")
+    assert len(seen) == 3
+    assert r.breaker("A").state == "closed"
+
+
+def test_expired_deadline_does_not_take_probe():
+    r = make()
+    trip(r)
+
+    def fn(model, timeout):
+        return "ok"
+
+    with pytest.raises(UpstreamTimeout):
+        r.call_sync("A", fn, 0)
+    # 截止时间已到时没有占用探测名额，下一次请求仍可探测并恢复
+    assert r.call_sync("A", fn, 5) == ("ok", "A")
+    assert r.breaker("A").state == "closed"
+
+
+def test_non_upstream_exception_releases_probe():
+    r = make()
+    trip(r)
+
+    async def broken(model, timeout):
+        return {}["choices"]
+
+    with pytest.raises(KeyError):
+        asyncio.run(r.call("A", broken, 5))
+    assert r.breaker("A").state == "open"
+
+    async def ok(model, timeout):
+        return "ok"
+
+    assert asyncio.run(r.call("A", ok, 5)) == ("ok", "A")
+
+
+def test_cancelled_probe_is_released():
+    r = make()
+    trip(r)
+
+    async def slow(model, timeout):
+        await asyncio.sleep(10)
+
+    async def main():
+        task = asyncio.create_task(r.call("A", slow, 30))
+        await asyncio.sleep(0.01)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    asyncio.run(main())
+    assert r.breaker("A").state == "open"
+    assert r.breaker("A").allow()  # 冷却后可再次探测
+
+
+def test_client_error_does_not_close_half_open_breaker():
+    r = make()
+    trip(r)
+
+    def bad_request(model, timeout):
+        raise UpstreamError("HTTP 400", 400)
+
+    with pytest.raises(UpstreamError):
+        r.call_sync("A", bad_request, 5)
+    assert r.breaker("A").state == "half_open"
+    assert r.breaker("A").allow()
+
+
+def test_all_breakers_open():
+    r = make([("A", None)], reset=60)
+    trip(r)
+    with pytest.raises(CircuitOpen):
+        r.call_sync("A", lambda model, timeout: "ok", 5)
+
+
+def test_stream_probe_released_on_close():
+    r = make()
+    trip(r)
+
+    async def never(model, timeout):
+        await asyncio.sleep(10)
+        yield "x"
+
+    async def main():
+        stream = r.stream("A", never, 30)
+        task = asyncio.create_task(stream.__anext__())
+        await asyncio.sleep(0.01)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        await stream.aclose()
+
+    asyncio.run(main())
+    assert r.breaker("A").state == "open"
+
+
+def test_first_model_leaves_time_for_fallback():
+    r = make([("A", 45), ("B", 15)])
+    budgets = {}
+
+    def fn(model, timeout):
+        budgets[model] = timeout
+        raise UpstreamTimeout("timeout")
+
+    with pytest.raises(UpstreamTimeout):
+        r.call_sync("A", fn, 30)
+    assert budgets["A"] <= 15.01
+    assert budgets["B"] > 10
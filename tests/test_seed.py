@@ -0,0 +1,44 @@
+"""起卦种子：0 与空串也应可复现，非法种子返回 400"""
+
+import json
+import sys
+import threading
+from http.server import HTTPServer
+from pathlib import Path
+from urllib import error, request
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from api.divine import handler
+from iching.core import divine_coin, make_rng
+
+
+def test_falsy_seeds_are_reproducible():
+    for seed in (0, ""):
+        assert make_rng(seed).random() == make_rng(seed).random()
+        assert divine_coin(seed) == divine_coin(seed)
+
+
+def test_none_uses_system_random():
+    assert type(make_rng(None)).__name__ == "SystemRandom"
+
+
+def _post(port, body):
+    req = request.Request(f"http://127.0.0.1:{port}/api/divine", data=json.dumps(body).encode(), method="POST")
+    try:
+        with request.urlopen(req, timeout=5) as resp:
+            return resp.status
+    except error.HTTPError as e:
+        return e.code
+
+
+def test_vercel_divine_rejects_non_scalar_seed():
+    server = HTTPServer(("127.0.0.1", 0), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        port = server.server_address[1]
+        assert _post(port, {"seed": [1, 2]}) == 400
+        assert _post(port, {"seed": {"a": 1}}) == 400
+        assert _post(port, {"seed": 0}) == 200
+    finally:
+        server.shutdown()
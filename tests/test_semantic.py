@@ -0,0 +1,44 @@
+"""相似问题复用：只在同卦同动爻同模型内复用，数字与否定词不同的问题从不复用"""
+
+from iching.semantic import SimilarityIndex, canonical_question, guard_tokens, similarity_group, topic_of
+
+QIAN = {"sequence": 1, "bits": 0b111111}
+
+
+def test_canonical_question_and_topic():
+    assert canonical_question("我的事业怎么样？") == canonical_question("事业运势如何") == "事业"
+    assert canonical_question("工作运势") == "事业"
+    assert topic_of(canonical_question("最近感情如何")) == "感情"
+    assert topic_of("事业感情") is None
+
+
+def test_guard_tokens():
+    assert guard_tokens(canonical_question("2024年财运")) == ("2024",)
+    assert guard_tokens(canonical_question("三月能升职吗")) == ("三",)
+    assert guard_tokens(canonical_question("不能成功吗")) == ("不",)
+    assert guard_tokens(canonical_question("能成功吗")) == ()
+
+
+def test_group_follows_moving_mask_from_bits():
+    still = similarity_group(QIAN, "m")
+    assert similarity_group(dict(QIAN, bits=0b111111 | 1 << 6), "m") != still
+    assert similarity_group(dict(QIAN, changeList=["初九"]), "m") != still
+    assert similarity_group(QIAN, "other") != still
+
+
+def test_match_respects_guard_and_topic():
+    index = SimilarityIndex()
+    group = similarity_group(QIAN, "m")
+    index.add(group, "我的事业怎么样", "k-career")
+    index.add(group, "2024年财运", "k-2024")
+    index.add(group, "这件事能成功吗", "k-yes")
+
+    assert index.match(group, "事业运势如何")[0] == "k-career"
+    assert index.match(group, "感情如何")[0] is None
+    assert index.match(group, "2025年财运")[0] is None
+    assert index.match(group, "这件事不能成功吗")[0] is None
+    # 动爻不同的卦是另一组
+    assert index.match(similarity_group(dict(QIAN, bits=0b111111 | 1 << 6), "m"), "事业运势如何")[0] is None
+
+    index.forget(group, "k-career")
+    assert index.match(group, "事业运势如何")[0] is None
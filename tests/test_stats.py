@@ -0,0 +1,39 @@
+"""全站起卦统计：日志回放、增量计数，以及只统计服务端起出的卦"""
+
+from fastapi.testclient import TestClient
+
+import app as A
+from iching.core import PATTERN_TO_CODE
+from iching.stats import SOURCE_API, ReadingStats, get_reading_stats
+
+
+def test_counters_and_replay(tmp_path):
+    path = tmp_path / "readings.log"
+    stats = ReadingStats(path)
+    stats.record(0b111111, SOURCE_API)            # 乾，无动爻
+    stats.record(0b111111 | 1 << 6, SOURCE_API)   # 乾，初爻动
+    stats.record(0, SOURCE_API)                   # 坤
+    assert stats.summary(2)["total"] == 3
+    assert stats.summary()["today"] == 3
+    assert [t["code"] for t in stats.top(2)] == [PATTERN_TO_CODE[0b111111], PATTERN_TO_CODE[0]]
+    assert stats.top(2)[0]["count"] == 2
+    assert stats.moving()["by_count"][:2] == [2, 1]
+    assert stats.moving()["by_line"][0] == 1
+    assert stats.daily(3)[-1]["count"] == 3
+    expected = stats.summary(2)
+    stats.close()
+
+    replayed = ReadingStats(path)
+    assert replayed.summary(2) == expected
+    replayed.close()
+
+
+def test_only_server_casts_are_counted():
+    client = TestClient(A.app)
+    before = get_reading_stats().summary()["total"]
+    assert client.post("/api/divine/coin", json={"source": "web"}).status_code == 200
+    assert client.post("/api/divine/coin", json={"seed": "replay"}).status_code == 200
+    assert get_reading_stats().summary()["total"] == before + 1
+    # 客户端不能再上报任意卦象
+    assert client.post("/api/stats/readings", json={"bits": 63}).status_code in (404, 405)
+    assert get_reading_stats().summary()["total"] == before + 1